@@ -0,0 +1,47 @@
+from typing import Optional
+
+import backtrader as bt
+
+from engine.analytics import Recorder
+
+COMMISSION = 0.001
+SIZER_PERCENTS = 95
+
+
+def create_cerebro(startcash: int, analytics: str = 'backtrader', broker: Optional[bt.BrokerBase] = None) -> bt.Cerebro:
+    """
+    Creates a Cerebro with the broker settings, sizer and analyzers used by
+    every backtest. With numpy analytics only the equity and trades are
+    recorded and the results are computed from them after the run. A given
+    broker replaces the default BackBroker and gets the same settings.
+    """
+    cerebro = bt.Cerebro(maxcpus=1)
+    if broker is not None:
+        cerebro.setbroker(broker)
+
+    cerebro.broker.setcash(startcash)
+    cerebro.broker.setcommission(commission=COMMISSION)
+
+    # TODO check this for live trading
+    cerebro.addsizer(bt.sizers.PercentSizer, percents=SIZER_PERCENTS)
+
+    if analytics == 'numpy':
+        cerebro.addanalyzer(Recorder, _name='recorder')
+        return cerebro
+
+    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
+    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trades')
+    cerebro.addanalyzer(bt.analyzers.SQN, _name='SQN')
+    cerebro.addanalyzer(bt.analyzers.PeriodStats,
+                        _name='period', timeframe=bt.TimeFrame.Days)
+
+    return cerebro
+
+
+def add_feed(cerebro: bt.Cerebro, d: bt.feed.DataBase) -> None:
+    """Adds a data feed to the Cerebro, intraday feeds are restricted to the trading session."""
+    if d.p.timeframe < bt.TimeFrame.Days:
+        d.addfilter(bt.filters.SessionFilter)
+
+    cerebro.adddata(d)
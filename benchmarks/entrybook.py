@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of the SuperScalper entry book.
+
+Replays a random walk through a full book and compares the EntryBook with
+the previous implementation, which summed the profit and searched the best
+entry over all entries on every bar. Both must exit the same entries.
+
+Run from the repository root:
+    python -m benchmarks.entrybook [--entries 200] [--bars 100000]
+"""
+import argparse
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from strategies.SuperScalper import Entry, EntryBook
+
+
+def scan(entries: List[Entry], close: float) -> Tuple[float, int]:
+    """The previous per bar work: the profit and the best entry by a full scan."""
+    total_profit = sum(entry.type * (entry.entry - close) for entry in entries)
+
+    best_idx = 0
+    best_value = -float('inf')
+    for i, entry in enumerate(entries):
+        position = -entry.type * (entry.entry - close)
+        if position > best_value:
+            best_idx, best_value = i, position
+
+    return total_profit, best_idx
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SuperScalper entry book.')
+    parser.add_argument('--entries', type=int, default=200, help='amt_open_trades')
+    parser.add_argument('--bars', type=int, default=100_000, help='number of bars to replay')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    closes = np.round(100 + np.cumsum(rng.normal(0, 0.05, args.bars + args.entries)), 2).tolist()
+    types = rng.choice([-1, 1], args.bars + args.entries).tolist()
+
+    entries = [Entry(type=types[i], entry=closes[i], index=i) for i in range(args.entries)]
+    start = time.perf_counter()
+    expected = []
+    for i in range(args.entries, len(closes)):
+        profit, best = scan(entries, closes[i])
+        entries[best] = Entry(type=types[i], entry=closes[i], index=i)
+        expected.append((profit, best))
+    scan_time = time.perf_counter() - start
+
+    book = EntryBook()
+    for i in range(args.entries):
+        book.put(i, Entry(type=types[i], entry=closes[i], index=i))
+    start = time.perf_counter()
+    actual = []
+    for i in range(args.entries, len(closes)):
+        profit = book.profit(closes[i])
+        best = book.pop_best(closes[i])
+        book.put(best, Entry(type=types[i], entry=closes[i], index=i))
+        actual.append((profit, best))
+    book_time = time.perf_counter() - start
+
+    same_exits = [best for _, best in expected] == [best for _, best in actual]
+    profit_error = max(abs(e - a) for (e, _), (a, _) in zip(expected, actual))
+
+    print(f'{args.bars} bars with {args.entries} open entries')
+    print(f'scan:      {scan_time:.3f}s ({args.bars / scan_time:,.0f} bars/s)')
+    print(f'EntryBook: {book_time:.3f}s ({args.bars / book_time:,.0f} bars/s)')
+    print(f'speedup:   {scan_time / book_time:.1f}x')
+    print(f'identical exits: {same_exits}, max profit difference: {profit_error:.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Throughput of the SuperScalper tick replay.
+
+Writes a tick file of a seeded random walk of trades during the session of
+every business day, then replays it with engine/replay.py and reports the
+ticks per second, the time spent and the peak memory, which stays bounded by
+the block size of the tick file however many days are replayed.
+
+Run from the repository root:
+    python -m benchmarks.replay [--days 20] [--ticks-per-day 1000000]
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+from typing import Dict, Iterator
+
+import numpy as np
+import pandas as pd
+
+from data.barcache import EXCHANGE_TZ
+from data.tickfile import read_ticks, write_ticks
+from engine.replay import ScalperReplay
+
+SESSION_SECONDS = 390 * 60
+
+
+def random_ticks(days: int, per_day: int, seed: int) -> Iterator[Dict[str, np.ndarray]]:
+    """Yields the trades of every business day from 2021-01-04 as one chunk per day."""
+    rng = np.random.default_rng(seed)
+    price = 100.0
+    for day in pd.bdate_range('2021-01-04', periods=days):
+        open_ = pd.Timestamp(day.date(), tz=EXCHANGE_TZ) + pd.Timedelta(hours=9, minutes=30)
+        offsets = np.sort(rng.integers(0, SESSION_SECONDS * 1_000_000_000, per_day))
+        prices = price + np.cumsum(rng.normal(0, 0.002, per_day))
+        price = float(prices[-1])
+        yield {'datetime': open_.value + offsets, 'price': np.round(prices, 2), 'size': rng.integers(1, 500, per_day).astype(np.float64)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SuperScalper tick replay.')
+    parser.add_argument('--days', type=int, default=20)
+    parser.add_argument('--ticks-per-day', type=int, default=1_000_000)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds between a decision and its order')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'AAPL.ticks')
+        start = time.perf_counter()
+        count = write_ticks(path, random_ticks(args.days, args.ticks_per_day, args.seed))
+        print(f'Wrote {count:,} ticks in {time.perf_counter() - start:.1f}s, {os.path.getsize(path) / 2 ** 20:.0f} MiB')
+
+        replay = ScalperReplay(latency=args.latency)
+        start = time.perf_counter()
+        result = replay.run(read_ticks(path), 100_000)
+        seconds = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'Replayed {replay.ticks:,} ticks in {seconds:.2f}s ({replay.ticks / seconds:,.0f} ticks/s), peak memory {peak:.0f} MiB')
+    print(f'{len(result.executions):,} fills, pnl ${result.pnl:,.2f}')
+
+
+if __name__ == '__main__':
+    main()
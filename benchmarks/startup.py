@@ -0,0 +1,79 @@
+"""
+Startup time of main.py.
+
+Starts main.py with the given arguments in a fresh interpreter again and
+again and reports the wall time until it exits, which is what a scheduler
+running many short jobs pays on top of the work of every job. With
+--imports the modules main.py imports are listed by their cumulative import
+time, as reported by python -X importtime, to find what loads on the path.
+
+Run from the repository root:
+    python -m benchmarks.startup [--runs 20] [--imports] [-- ARGS of main.py]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+# Matches a line of -X importtime: self us | cumulative us | indented module name
+IMPORT_TIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+
+def measure(arguments: List[str], runs: int) -> List[float]:
+    """The wall time in seconds of every run of main.py with the arguments."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, MAIN, *arguments], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def imports(arguments: List[str]) -> List[Tuple[str, int, int]]:
+    """The modules imported directly by main.py or its local imports with their cumulative ms, slowest first."""
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', MAIN, *arguments],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+
+    result = []
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        # Only the outermost imports, their dependencies are included in the cumulative time
+        if match and not match.group(3):
+            result.append((match.group(4), int(match.group(2)) // 1000, int(match.group(1)) // 1000))
+    return sorted(result, key=lambda module: -module[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of main.py.')
+    parser.add_argument('--runs', type=int, default=20, help='number of times main.py is started')
+    parser.add_argument('--imports', action='store_true', help='list the slowest imports of one run')
+    parser.add_argument('--top', type=int, default=15, help='number of imports listed')
+    parser.add_argument('arguments', nargs='*', help='arguments of main.py after --, --help by default')
+    args = parser.parse_args()
+    arguments = args.arguments or ['--help']
+
+    times = measure(arguments, args.runs)
+    print(f'main.py {" ".join(arguments)}')
+    print(
+        f'{args.runs} runs: min {min(times) * 1000:.0f} ms, median {statistics.median(times) * 1000:.0f} ms, '
+        f'max {max(times) * 1000:.0f} ms'
+    )
+
+    if args.imports:
+        print(f'\n{"module":<40}{"cumulative ms":>14}{"self ms":>10}')
+        for module, cumulative, own in imports(arguments)[:args.top]:
+            print(f'{module:<40}{cumulative:>14}{own:>10}')
+
+
+if __name__ == '__main__':
+    main()
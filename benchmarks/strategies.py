@@ -0,0 +1,223 @@
+"""
+Throughput benchmark of every strategy in the registry of main.py.
+
+Generates deterministic 1 minute bars of a random walk during the trading
+sessions of every business day, resamples them to the timeframes of each
+strategy and backtests it once (single) and over the first combinations
+of its parameterSpace on a pool of worker processes (optimize). No network
+access or Alpaca keys are needed.
+
+Every case runs in a fresh process, so the peak memory of one case does
+not carry over to the next. The results can be saved as a baseline and
+later runs are compared against it, regressions of the bars per second or
+the peak memory beyond the tolerance fail the benchmark.
+
+Run from the repository root:
+    python -m benchmarks.strategies [--days 60] [--combinations 8] [--save]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+from pytz import timezone
+
+from backtest import add_feed, create_cerebro
+from data.barcache import EXCHANGE_TZ, CachedData
+from data.resample import resample
+from main import load_strategy, strategies
+from optimization.sweep import SharedBars, Sweep
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+MODES = ['single', 'optimize']
+
+START = '2021-01-04'
+TICKER = 'SYNTH'
+
+
+def random_walk(days: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    1 minute bars from 09:30 to 16:00 of the given number of business days,
+    as the columns of the BarCache. Prices follow a random walk with a gap
+    between the sessions.
+    """
+    rng = np.random.default_rng(seed)
+    sessions = pd.bdate_range(START, periods=days)
+    minutes = pd.DatetimeIndex(np.concatenate([
+        pd.date_range(day + pd.Timedelta('9h30min'), periods=390, freq='1min').values for day in sessions
+    ])).tz_localize(EXCHANGE_TZ)
+
+    returns = rng.normal(0, 0.001, len(minutes))
+    returns[::390] += rng.normal(0, 0.01, days)  # overnight gaps
+    close = 100 * np.exp(np.cumsum(returns))
+    open_ = np.concatenate([[100.0], close[:-1]])
+    wick = np.abs(rng.normal(0, 0.0005, (2, len(minutes))))
+
+    return {
+        'datetime': minutes.tz_convert('UTC').as_unit('ns').asi8,
+        'open': open_,
+        'high': np.maximum(open_, close) * (1 + wick[0]),
+        'low': np.minimum(open_, close) * (1 - wick[1]),
+        'close': close,
+        'volume': rng.integers(100, 10_000, len(minutes)).astype(np.float64),
+    }
+
+
+def strategy_feeds(strategy, minutes: Dict[str, np.ndarray]) -> Tuple[List[dict], List[Dict[str, np.ndarray]]]:
+    """The CachedData parameters and bars of every timeframe of the strategy, resampled from the minutes."""
+    specs, bars = [], []
+    fromdate = datetime.strptime(START, '%Y-%m-%d')
+    for compression, timeframe in strategy.timeframes.values():
+        specs.append(dict(
+            dataname=TICKER,
+            timeframe=timeframe,
+            compression=compression,
+            fromdate=fromdate,
+            tz=timezone(EXCHANGE_TZ)
+        ))
+        if (timeframe, compression) == (bt.TimeFrame.Minutes, 1):
+            bars.append(minutes)
+        else:
+            bars.append(resample(minutes, timeframe, compression, timeframe < bt.TimeFrame.Days))
+    return specs, bars
+
+
+def run_case(name: str, mode: str, days: int, combinations: int, workers: Optional[int]) -> Dict[str, float]:
+    """Backtests the strategy in the mode in the current process, returning its bars, seconds and peak memory."""
+    strategy = load_strategy(name)
+    specs, bars = strategy_feeds(strategy, random_walk(days))
+    feed_bars = sum(len(feed['datetime']) for feed in bars)
+
+    start = time.perf_counter()
+    if mode == 'single':
+        cerebro = create_cerebro(100_000)
+        strategy.addStrategyToCerebro(cerebro)
+        for spec, feed in zip(specs, bars):
+            add_feed(cerebro, CachedData(bars=feed, **spec))
+        cerebro.run()
+        runs = 1
+    else:
+        grid = strategy.parameterSpace().grid()[:combinations]
+        shared = SharedBars.create(bars)
+        try:
+            Sweep(strategy, 100_000, specs, shared, workers).evaluate(grid)
+        finally:
+            shared.unlink()
+        runs = len(grid)
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux, the workers of the sweep are children
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {
+        'runs': runs,
+        'bars': feed_bars * runs,
+        'seconds': round(seconds, 3),
+        'bars_per_second': round(feed_bars * runs / seconds, 1),
+        'peak_mb': round(peak / 1024, 1),
+    }
+
+
+def run_isolated(name: str, mode: str, days: int, combinations: int, workers: Optional[int]) -> Dict[str, float]:
+    """Runs the case in a new interpreter, so its peak memory is its own."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(_in_tempdir, name, mode, days, combinations, workers).result()
+
+
+def _in_tempdir(*case) -> Dict[str, float]:
+    # The output of the strategies is discarded, the workers of the sweep inherit the file descriptor
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), sys.stdout.fileno())
+
+    # SuperScalper writes its trade journal to the working directory
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        return run_case(*case)
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """The cases which are slower or use more memory than the baseline beyond the tolerance."""
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        before = baseline[case]
+        if result['bars_per_second'] < before['bars_per_second'] * (1 - tolerance):
+            regressions.append(f'{case}: {before["bars_per_second"]:,.0f} -> {result["bars_per_second"]:,.0f} bars/s')
+        if result['peak_mb'] > before['peak_mb'] * (1 + tolerance):
+            regressions.append(f'{case}: {before["peak_mb"]:.0f} -> {result["peak_mb"]:.0f} MB peak memory')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every strategy on synthetic bars.')
+    parser.add_argument('--days', type=int, default=60, help='business days of synthetic 1 minute bars')
+    parser.add_argument('--combinations', type=int, default=8, help='parameter combinations of the optimize mode')
+    parser.add_argument('--workers', type=int, help='worker processes of the optimize mode, one per core by default')
+    parser.add_argument('--strategies', nargs='+', help='strategies to run, all by default')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file to compare against and save to')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression against the baseline')
+    args = parser.parse_args()
+
+    names = args.strategies or list(strategies)
+
+    results = {}
+    print(f'{"case":<24}{"runs":>6}{"bars":>12}{"seconds":>10}{"bars/s":>12}{"peak MB":>10}')
+    for name in names:
+        for mode in args.modes:
+            case = f'{name} {mode}'
+            result = run_isolated(name, mode, args.days, args.combinations, args.workers)
+            results[case] = result
+            print(
+                f'{case:<24}{result["runs"]:>6}{result["bars"]:>12,}{result["seconds"]:>10.2f}'
+                f'{result["bars_per_second"]:>12,.0f}{result["peak_mb"]:>10.1f}'
+            )
+
+    regressions = []
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if baseline is not None and (baseline['days'], baseline['combinations']) != (args.days, args.combinations):
+        print(
+            f'\nNot compared against {args.baseline}, it was run with --days {baseline["days"]} '
+            f'--combinations {baseline["combinations"]}.'
+        )
+    elif baseline is not None:
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f'\nRegressions against {args.baseline} from {baseline["created"]}:')
+            for regression in regressions:
+                print(f'  {regression}')
+        else:
+            print(f'\nNo regressions against {args.baseline} from {baseline["created"]}.')
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'days': args.days,
+                'combinations': args.combinations,
+                'results': results
+            }, f, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+
+    if regressions and not args.save:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+import json
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+# fetcher(ticker, timeframe, compression, start, end) -> DataFrame indexed by a
+# tz-aware DatetimeIndex with the columns in COLUMNS
+Fetcher = Callable[[str, int, int, pd.Timestamp, pd.Timestamp], pd.DataFrame]
+
+EXCHANGE_TZ = 'US/Eastern'
+
+# backtrader encodes datetimes as days since 0001-01-01, 1970-01-01 is this day
+EPOCH_NUM = 719163.0
+NS_PER_DAY = 86_400 * 1_000_000_000
+
+# Alpaca quotes prices with at most 4 decimals, rounding float32 prices to them
+# restores the original prices up to about $800
+PRICE_DECIMALS = 4
+
+
+def alpaca_fetcher(store) -> Fetcher:
+    """Returns a fetcher which downloads the bars through an AlpacaStore."""
+
+    def fetch(ticker, timeframe, compression, start, end):
+        granularity = store.get_granularity(timeframe, compression)
+        return store.get_aggs_from_alpaca(ticker, start, end, granularity, compression)
+
+    return fetch
+
+
+def to_num(ns: np.ndarray) -> np.ndarray:
+    """Converts UTC nanosecond timestamps into backtrader's float datetimes."""
+    return ns / NS_PER_DAY + EPOCH_NUM
+
+
+class CachedData(bt.feed.DataBase):
+    """
+    Feeds backtrader from the column arrays of the BarCache.
+
+    Works like bt.feeds.PandasData, but reads plain NumPy arrays instead of
+    doing a DataFrame lookup per field and bar, and keeps the ticker as
+    `dataname` so strategies can keep using `d.p.dataname` as the symbol.
+    Float32 prices, like those of bar files, are rounded to PRICE_DECIMALS.
+    """
+    params = (
+        ('bars', None),  # Dict of column name -> array, 'datetime' in UTC ns
+    )
+
+    def start(self):
+        super().start()
+
+        self._idx = -1
+        self._dt = to_num(np.asarray(self.p.bars['datetime']))
+        self._cols = [
+            (getattr(self.lines, column), np.asarray(self.p.bars[column]))
+            for column in COLUMNS
+        ]
+        self._decimals = PRICE_DECIMALS if any(values.dtype == np.float32 for _, values in self._cols) else None
+
+    def _load(self):
+        self._idx += 1
+
+        if self._idx >= len(self._dt):
+            return False
+
+        self.lines.datetime[0] = self._dt[self._idx]
+        if self._decimals is None:
+            for line, values in self._cols:
+                line[0] = values[self._idx]
+        else:
+            for line, values in self._cols:
+                line[0] = round(float(values[self._idx]), self._decimals)
+        self.lines.openinterest[0] = 0.0
+
+        return True
+
+
+class BarCache:
+    """
+    Persistent on-disk cache for historical bars.
+
+    Bars are stored per (ticker, timeframe, compression, session filter) as one
+    memory-mapped NumPy file per column. Which date ranges were already
+    downloaded is tracked separately, so only the missing parts of a requested
+    range are fetched and days without any bars are not requested again.
+    Without a fetcher the cache works offline and only serves stored bars.
+    The cached bars of a feed can also be exported into a compact bar file.
+    """
+
+    def __init__(self, root: str, fetcher: Optional[Fetcher] = None):
+        self.root = root
+        self.fetcher = fetcher
+
+    def path(self, ticker: str, timeframe: int, compression: int, sessionfilter: bool) -> str:
+        name = f'{bt.TimeFrame.getname(timeframe, compression)}-{compression}'
+        if sessionfilter:
+            name += '-session'
+        return os.path.join(self.root, ticker, name)
+
+    def getdata(
+        self,
+        dataname: str,
+        timeframe: int,
+        compression: int,
+        fromdate: datetime,
+        todate: datetime,
+        sessionfilter: bool = False,
+        tz=None,
+        base: Optional[Tuple[int, int]] = None,
+        compact: bool = False
+    ) -> bt.feed.DataBase:
+        """
+        Returns a backtrader feed with the bars of the ticker, downloading missing ranges first.
+
+        With compact the feed reads the bar file of the cached bars instead,
+        which can not be resampled from a base.
+        """
+        if compact:
+            # Imported here, the bar files depend on the constants of this module
+            from data.barfile import MappedData
+
+            self.load(dataname, timeframe, compression, fromdate, todate, sessionfilter)
+            return MappedData(
+                dataname=dataname,
+                path=self.compact(dataname, timeframe, compression, sessionfilter),
+                start=_localize(fromdate).value,
+                end=_localize(todate).value,
+                timeframe=timeframe,
+                compression=compression,
+                fromdate=fromdate,
+                todate=todate,
+                tz=tz
+            )
+
+        bars = self.getbars(dataname, timeframe, compression, fromdate, todate, sessionfilter, base)
+
+        return CachedData(
+            dataname=dataname,
+            bars=bars,
+            timeframe=timeframe,
+            compression=compression,
+            fromdate=fromdate,
+            todate=todate,
+            tz=tz
+        )
+
+    def getbars(
+        self,
+        dataname: str,
+        timeframe: int,
+        compression: int,
+        fromdate: datetime,
+        todate: datetime,
+        sessionfilter: bool = False,
+        base: Optional[Tuple[int, int]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Returns the bars of the ticker as columns, downloading missing ranges first.
+
+        If a finer base (timeframe, compression) is given, only the base bars
+        are loaded and the requested bars are resampled from them locally.
+        """
+        if not base or base == (timeframe, compression):
+            return self.load(dataname, timeframe, compression, fromdate, todate, sessionfilter)
+
+        # Imported here, resample depends on the constants of this module
+        from data.resample import resample
+
+        # Intraday bases are always session filtered, so every timeframe
+        # of a ticker shares the same download
+        return resample(
+            self.load(dataname, *base, fromdate, todate, base[0] < bt.TimeFrame.Days),
+            timeframe,
+            compression,
+            sessionfilter
+        )
+
+    def load(
+        self,
+        ticker: str,
+        timeframe: int,
+        compression: int,
+        fromdate: datetime,
+        todate: datetime,
+        sessionfilter: bool = False
+    ) -> Dict[str, np.ndarray]:
+        """Returns the cached columns between fromdate and todate, downloading missing ranges first."""
+        path = self.path(ticker, timeframe, compression, sessionfilter)
+        start, end = _localize(fromdate), _localize(todate)
+
+        missing = self.missing(ticker, timeframe, compression, fromdate, todate, sessionfilter)
+        if missing and self.fetcher is not None:
+            self._fetch(path, ticker, timeframe, compression, sessionfilter, missing)
+        elif missing:
+            print(f'Offline: {ticker} is not cached for {", ".join(f"{s} - {e}" for s, e in missing)}.')
+
+        bars = self._read(path)
+        lo, hi = np.searchsorted(bars['datetime'], [start.value, end.value])
+        return {column: values[lo:hi] for column, values in bars.items()}
+
+    def missing(
+        self,
+        ticker: str,
+        timeframe: int,
+        compression: int,
+        fromdate: datetime,
+        todate: datetime,
+        sessionfilter: bool = False
+    ) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """Returns the parts of the range between fromdate and todate which were not downloaded yet."""
+        path = self.path(ticker, timeframe, compression, sessionfilter)
+        return _subtract((_localize(fromdate), _localize(todate)), self._ranges(path))
+
+    def compact(self, ticker: str, timeframe: int, compression: int, sessionfilter: bool = False) -> str:
+        """Returns the path of the bar file of the cached bars, writing it if the cache changed since."""
+        # Imported here, the bar files depend on the constants of this module
+        from data.barfile import write_bars
+
+        path = self.path(ticker, timeframe, compression, sessionfilter)
+        barfile = os.path.join(path, 'bars.bin')
+        columns = os.path.join(path, 'datetime.npy')
+        if not os.path.exists(barfile) or (
+            os.path.exists(columns) and os.path.getmtime(columns) > os.path.getmtime(barfile)
+        ):
+            os.makedirs(path, exist_ok=True)
+            write_bars(barfile, self._read(path))
+        return barfile
+
+    def store(
+        self,
+        ticker: str,
+        timeframe: int,
+        compression: int,
+        sessionfilter: bool,
+        df: pd.DataFrame,
+        covered: List[Tuple[pd.Timestamp, pd.Timestamp]]
+    ) -> None:
+        """Merges the bars of df into the cache and marks the covered ranges as downloaded."""
+        path = self.path(ticker, timeframe, compression, sessionfilter)
+
+        if sessionfilter and len(df):
+            df = _exchange_time(df).between_time('09:30', '16:00')
+
+        self._write(path, _merge(self._read(path), _columns(df)))
+
+        # Do not mark today as covered, it is not over yet
+        today = pd.Timestamp.now(tz=EXCHANGE_TZ).normalize()
+        covered = [(s, min(e, today)) for s, e in covered if s < today]
+        self._write_ranges(path, _union(self._ranges(path) + covered))
+
+    def _fetch(self, path, ticker, timeframe, compression, sessionfilter, missing) -> None:
+        frames = []
+        for start, end in missing:
+            print(f'Downloading {ticker} {bt.TimeFrame.getname(timeframe, compression)} from {start} to {end}.')
+            frames.append(self.fetcher(ticker, timeframe, compression, start, end))
+
+        frames = [df for df in frames if df is not None and len(df)]
+        df = pd.concat(frames) if frames else pd.DataFrame(columns=COLUMNS)
+        self.store(ticker, timeframe, compression, sessionfilter, df, missing)
+
+    def _read(self, path: str) -> Dict[str, np.ndarray]:
+        if not os.path.exists(os.path.join(path, 'datetime.npy')):
+            return _columns(pd.DataFrame(columns=COLUMNS))
+
+        return {
+            column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')
+            for column in ['datetime'] + COLUMNS
+        }
+
+    def _write(self, path: str, bars: Dict[str, np.ndarray]) -> None:
+        os.makedirs(path, exist_ok=True)
+        for column, values in bars.items():
+            # Write to a temporary file first, so an interrupted run never
+            # leaves a truncated column behind
+            tmp = os.path.join(path, f'{column}.tmp.npy')
+            np.save(tmp, values)
+            os.replace(tmp, os.path.join(path, f'{column}.npy'))
+
+    def _ranges(self, path: str) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        try:
+            with open(os.path.join(path, 'ranges.json')) as f:
+                return [(_localize(s), _localize(e)) for s, e in json.load(f)]
+        except FileNotFoundError:
+            return []
+
+    def _write_ranges(self, path: str, ranges: List[Tuple[pd.Timestamp, pd.Timestamp]]) -> None:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'ranges.json'), 'w') as f:
+            json.dump([[s.isoformat(), e.isoformat()] for s, e in ranges], f)
+
+
+def _localize(dt) -> pd.Timestamp:
+    ts = pd.Timestamp(dt)
+    return ts.tz_localize(EXCHANGE_TZ) if ts.tzinfo is None else ts.tz_convert(EXCHANGE_TZ)
+
+
+def _exchange_time(df: pd.DataFrame) -> pd.DataFrame:
+    index = pd.DatetimeIndex(df.index)
+    index = index.tz_localize(EXCHANGE_TZ) if index.tz is None else index.tz_convert(EXCHANGE_TZ)
+    return df.set_axis(index)
+
+
+def _columns(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Splits a DataFrame with a DatetimeIndex into UTC ns datetimes and float64 OHLCV columns."""
+    if len(df):
+        dt = _exchange_time(df).index.tz_convert('UTC').as_unit('ns').asi8
+    else:
+        dt = np.empty(0, dtype=np.int64)
+
+    bars = {'datetime': np.asarray(dt, dtype=np.int64)}
+    for column in COLUMNS:
+        bars[column] = df[column].to_numpy(dtype=np.float64) if len(df) else np.empty(0)
+    return bars
+
+
+def _merge(old: Dict[str, np.ndarray], new: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Merges two sets of columns, sorted by datetime, new bars replacing old ones at the same time."""
+    merged = {column: np.concatenate([new[column], old[column]]) for column in old}
+    # np.unique keeps the first occurrence, which is the newly downloaded bar
+    _, idx = np.unique(merged['datetime'], return_index=True)
+    return {column: values[idx] for column, values in merged.items()}
+
+
+def _union(ranges: List[Tuple[pd.Timestamp, pd.Timestamp]]) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    result = []
+    for start, end in sorted(ranges):
+        if result and start <= result[-1][1]:
+            result[-1] = (result[-1][0], max(result[-1][1], end))
+        else:
+            result.append((start, end))
+    return result
+
+
+def _subtract(
+    wanted: Tuple[pd.Timestamp, pd.Timestamp],
+    covered: List[Tuple[pd.Timestamp, pd.Timestamp]]
+) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """Returns the parts of the wanted range which are not in any covered range."""
+    start, end = wanted
+    missing = []
+    for s, e in _union(covered):
+        if e <= start or s >= end:
+            continue
+        if s > start:
+            missing.append((start, s))
+        start = max(start, e)
+    if start < end:
+        missing.append((start, end))
+    return missing
@@ -0,0 +1,272 @@
+"""
+Concurrent bulk download of historical bars into the BarCache.
+
+The BarCache downloads missing ranges one feed at a time through the
+AlpacaStore, blocking on every HTTP round trip. Before a backtest the
+BulkDownloader instead requests the missing ranges of all feeds at once
+from the Alpaca market data API. It uses one pooled aiohttp session, splits
+every range into date chunks which are paginated concurrently, stays under
+the rate limit of the API with a token bucket and retries failed requests
+with exponential backoff. The bars of every feed are merged into the cache
+as soon as all of its chunks are downloaded.
+
+Only 1 minute bars are requested. The bars of a feed are resampled from
+those in the session with data.resample, like the AlpacaStore builds them,
+so the cache holds the same bars whichever of the two downloaded a range.
+The API's own aggregates would include the trades after 16:00 in the last
+bar of the day.
+
+The base URL is configurable, so the downloader can be pointed at a local
+server which implements GET /v2/stocks/{symbol}/bars.
+"""
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from data.barcache import COLUMNS, BarCache
+from data.resample import resample
+
+# Length of the date chunks requested concurrently, a chunk of 1 minute bars
+# fits into a few pages of the API
+CHUNK_DAYS = 30
+
+# Timeframes resampled from the 1 minute bars, the BarCache downloads the
+# others through the AlpacaStore when they are loaded
+TIMEFRAMES = (bt.TimeFrame.Minutes, bt.TimeFrame.Days)
+
+# Maximum number of bars per page of the API
+PAGE_LIMIT = 10_000
+
+# Field of the API bars -> column of the cache
+FIELDS = {'o': 'open', 'h': 'high', 'l': 'low', 'c': 'close', 'v': 'volume'}
+
+
+class DownloadError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Job:
+    """The bars of one feed as the BarCache stores them."""
+    ticker: str
+    timeframe: int
+    compression: int
+    sessionfilter: bool
+    fromdate: Any
+    todate: Any
+
+    @property
+    def name(self) -> str:
+        return f'{self.ticker} {bt.TimeFrame.getname(self.timeframe, self.compression)}'
+
+
+def aggregate(df: pd.DataFrame, timeframe: int, compression: int, sessionfilter: bool) -> pd.DataFrame:
+    """The bars of the timeframe resampled from the 1 minute bars of df in the session."""
+    if not len(df):
+        return df
+
+    minutes = {'datetime': df.index.tz_convert('UTC').as_unit('ns').asi8}
+    minutes.update({column: df[column].to_numpy(dtype=np.float64) for column in COLUMNS})
+    bars = resample(minutes, bt.TimeFrame.Minutes, 1, sessionfilter=True)
+    if (timeframe, compression) != (bt.TimeFrame.Minutes, 1):
+        bars = resample(bars, timeframe, compression, sessionfilter)
+
+    index = pd.DatetimeIndex(bars['datetime'], tz='UTC')
+    return pd.DataFrame({column: bars[column] for column in COLUMNS}, index=index)
+
+
+def chunks(start: pd.Timestamp, end: pd.Timestamp, days: int) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """Splits the range into consecutive ranges of at most days."""
+    step = pd.Timedelta(days=days)
+    result = []
+    while start < end:
+        result.append((start, min(start + step, end)))
+        start += step
+    return result
+
+
+class TokenBucket:
+    """
+    Rate limiter which allows rate requests per second on average and
+    bursts of up to capacity requests.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = max(capacity or rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # Waiting while holding the lock serves the requests in order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BulkDownloader:
+    """
+    Downloads the ranges of many feeds which are missing in the cache concurrently.
+
+    connections limits the open HTTP connections of the session and with it
+    the requests in flight, rate_limit the requests per minute. A request is
+    retried up to retries times after connection errors, timeouts, 429 and
+    5xx responses, waiting backoff * 2^attempt seconds or the Retry-After of
+    the response.
+    """
+
+    def __init__(
+        self,
+        cache: BarCache,
+        key_id: Optional[str],
+        secret_key: Optional[str],
+        base_url: str = 'https://data.alpaca.markets',
+        connections: int = 8,
+        rate_limit: float = 200,
+        retries: int = 5,
+        backoff: float = 0.5,
+        timeout: float = 30
+    ):
+        self.cache = cache
+        self.headers = {'APCA-API-KEY-ID': key_id or '', 'APCA-API-SECRET-KEY': secret_key or ''}
+        self.base_url = base_url.rstrip('/')
+        self.connections = connections
+        self.rate_limit = rate_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.requests = 0
+        self.slots: Optional[asyncio.Semaphore] = None
+
+    def download(self, jobs: List[Job]) -> Dict[Job, int]:
+        """Downloads the missing ranges of the jobs, returning the number of downloaded bars per job."""
+        return asyncio.run(self.download_async(jobs))
+
+    async def download_async(self, jobs: List[Job]) -> Dict[Job, int]:
+        missing = {
+            job: self.cache.missing(job.ticker, job.timeframe, job.compression, job.fromdate, job.todate, job.sessionfilter)
+            for job in dict.fromkeys(jobs)
+            if job.timeframe in TIMEFRAMES
+        }
+        missing = {job: ranges for job, ranges in missing.items() if ranges}
+        if not missing:
+            return {}
+
+        print(f'Downloading {len(missing)} feeds with {self.connections} connections.')
+        start = time.perf_counter()
+        self.requests = 0
+        bucket = TokenBucket(self.rate_limit / 60)
+        # Requests wait here instead of in the connection pool, where the wait would count towards their timeout
+        self.slots = asyncio.Semaphore(self.connections)
+        connector = aiohttp.TCPConnector(limit=self.connections)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with aiohttp.ClientSession(headers=self.headers, connector=connector, timeout=timeout) as session:
+            counts = await asyncio.gather(*[
+                self._download_job(session, bucket, job, ranges) for job, ranges in missing.items()
+            ])
+
+        elapsed = time.perf_counter() - start
+        print(f'Downloaded {sum(counts)} bars of {len(missing)} feeds in {self.requests} requests and {elapsed:.1f}s.')
+        return dict(zip(missing, counts))
+
+    async def _download_job(self, session: aiohttp.ClientSession, bucket: TokenBucket, job: Job, missing) -> int:
+        ranges = [chunk for start, end in missing for chunk in chunks(start, end, CHUNK_DAYS)]
+        try:
+            frames = await asyncio.gather(*[
+                self._download_range(session, bucket, job, start, end) for start, end in ranges
+            ])
+        except DownloadError as e:
+            # The ranges stay missing in the cache and are requested again by the next run
+            print(f'Failed to download {job.name}: {e}')
+            return 0
+
+        frames = [df for df in frames if len(df)]
+        df = pd.concat(frames) if frames else pd.DataFrame(columns=COLUMNS)
+        df = aggregate(df, job.timeframe, job.compression, job.sessionfilter)
+        # Writing the columns blocks, so it runs in a thread while the other jobs download
+        await asyncio.to_thread(self.cache.store, job.ticker, job.timeframe, job.compression, job.sessionfilter, df, missing)
+        return len(df)
+
+    async def _download_range(
+        self,
+        session: aiohttp.ClientSession,
+        bucket: TokenBucket,
+        job: Job,
+        start: pd.Timestamp,
+        end: pd.Timestamp
+    ) -> pd.DataFrame:
+        """Requests every page of bars of the job between start and end."""
+        url = f'{self.base_url}/v2/stocks/{job.ticker}/bars'
+        params = {
+            'timeframe': '1Min',
+            'start': _rfc3339(start),
+            'end': _rfc3339(end),
+            'limit': PAGE_LIMIT,
+        }
+
+        # Every page is converted right away, a DataFrame takes a fraction of the memory of the JSON bars
+        frames = []
+        while True:
+            page = await self._get(session, bucket, url, params)
+            frames.append(_frame(page.get('bars') or []))
+            token = page.get('next_page_token')
+            if not token:
+                break
+            params = {**params, 'page_token': token}
+
+        frames = [df for df in frames if len(df)]
+        return pd.concat(frames) if frames else pd.DataFrame(columns=COLUMNS)
+
+    async def _get(self, session: aiohttp.ClientSession, bucket: TokenBucket, url: str, params: dict) -> dict:
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            async with self.slots:
+                await bucket.acquire()
+                self.requests += 1
+                try:
+                    async with session.get(url, params=params) as response:
+                        if response.status == 429 or response.status >= 500:
+                            retry_after = response.headers.get('Retry-After')
+                            if retry_after and retry_after.isdigit():
+                                delay = float(retry_after)
+                            error = f'HTTP {response.status}'
+                        elif response.status != 200:
+                            raise DownloadError(f'HTTP {response.status}: {await response.text()}')
+                        else:
+                            return await response.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+
+        raise DownloadError(f'{error} after {self.retries + 1} attempts')
+
+
+def _rfc3339(ts: pd.Timestamp) -> str:
+    return ts.tz_convert('UTC').strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _frame(bars: List[dict]) -> pd.DataFrame:
+    """The bars of the API as a DataFrame like the AlpacaStore returns them."""
+    if not bars:
+        return pd.DataFrame(columns=COLUMNS)
+
+    df = pd.DataFrame(bars)
+    index = pd.to_datetime(df['t'], utc=True)
+    return df[list(FIELDS)].rename(columns=FIELDS).astype('float64').set_axis(pd.DatetimeIndex(index))
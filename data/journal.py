@@ -0,0 +1,80 @@
+import json
+import os
+from typing import Any, Dict
+
+import numpy as np
+
+
+class Journal:
+    """
+    Append-only columnar journal of fixed-size records.
+
+    Records are buffered in preallocated NumPy arrays, one per column, and
+    every batch records the buffers are appended to one raw file per column.
+    Memory therefore stays bounded by the batch size no matter how many
+    records a run writes. The files are complete after every flush and can
+    be read back lazily with read, which memory-maps the columns.
+    """
+
+    def __init__(self, path: str, columns: Dict[str, Any], batch: int = 10_000):
+        self.path = path
+        self.dtypes = {column: np.dtype(dtype) for column, dtype in columns.items()}
+        self.batch = batch
+        self.rows = 0
+        self.buffer = {column: np.empty(batch, dtype=dtype) for column, dtype in self.dtypes.items()}
+        self.buffered = 0
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'columns.json'), 'w') as f:
+            json.dump({column: dtype.str for column, dtype in self.dtypes.items()}, f)
+        for column in self.dtypes:
+            open(self._file(path, column), 'wb').close()
+
+    def __len__(self) -> int:
+        return self.rows + self.buffered
+
+    def append(self, record: Any) -> None:
+        """Appends the attributes of record named like the columns."""
+        for column, values in self.buffer.items():
+            values[self.buffered] = getattr(record, column)
+        self.buffered += 1
+
+        if self.buffered == self.batch:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffered:
+            return
+
+        for column, values in self.buffer.items():
+            with open(self._file(self.path, column), 'ab') as f:
+                f.write(values[:self.buffered].tobytes())
+        self.rows += self.buffered
+        self.buffered = 0
+
+    def close(self) -> None:
+        self.flush()
+
+    @classmethod
+    def read(cls, path: str) -> Dict[str, np.ndarray]:
+        """Memory-maps every column of the journal at path."""
+        with open(os.path.join(path, 'columns.json')) as f:
+            dtypes = {column: np.dtype(dtype) for column, dtype in json.load(f).items()}
+
+        columns = {}
+        for column, dtype in dtypes.items():
+            file = cls._file(path, column)
+            rows = os.path.getsize(file) // dtype.itemsize
+            if rows:
+                columns[column] = np.memmap(file, dtype=dtype, mode='r', shape=rows)
+            else:
+                # np.memmap can not map an empty file
+                columns[column] = np.empty(0, dtype=dtype)
+
+        # An interrupted flush may have appended to only some of the columns
+        rows = min((len(values) for values in columns.values()), default=0)
+        return {column: values[:rows] for column, values in columns.items()}
+
+    @staticmethod
+    def _file(path: str, column: str) -> str:
+        return os.path.join(path, f'{column}.bin')
@@ -0,0 +1,62 @@
+from typing import Dict
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from data.barcache import EXCHANGE_TZ, NS_PER_DAY
+
+NS_PER_MINUTE = 60 * 1_000_000_000
+
+SESSION_START = 9 * 60 + 30
+SESSION_END = 16 * 60
+
+
+def resample(
+    bars: Dict[str, np.ndarray],
+    timeframe: int,
+    compression: int,
+    sessionfilter: bool = False
+) -> Dict[str, np.ndarray]:
+    """
+    Aggregates bars into coarser (timeframe, compression) bars in one vectorized pass.
+
+    Buckets start at midnight exchange time and are labeled with their start,
+    the same way Alpaca resamples its bars on download, so derived bars have
+    identical boundaries to downloaded ones. With the session filter, bars
+    labeled outside of 09:30 - 16:00 are dropped like Alpaca does.
+    """
+    dt = np.asarray(bars['datetime'])
+    if not len(dt):
+        return {column: np.asarray(values) for column, values in bars.items()}
+
+    # Offset of the exchange time zone for every bar, DST aware
+    local = pd.DatetimeIndex(dt, tz='UTC').tz_convert(EXCHANGE_TZ).tz_localize(None).asi8
+    offset = local - dt
+
+    if timeframe == bt.TimeFrame.Minutes:
+        period = compression * NS_PER_MINUTE
+    elif timeframe == bt.TimeFrame.Days:
+        period = compression * NS_PER_DAY
+    else:
+        raise ValueError(f'Can not resample to {bt.TimeFrame.getname(timeframe, compression)}')
+
+    bucket = local - local % period
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(dt)] - 1
+
+    result = {
+        'datetime': bucket[starts] - offset[starts],
+        'open': np.asarray(bars['open'])[starts],
+        'high': np.maximum.reduceat(np.asarray(bars['high']), starts),
+        'low': np.minimum.reduceat(np.asarray(bars['low']), starts),
+        'close': np.asarray(bars['close'])[ends],
+        'volume': np.add.reduceat(np.asarray(bars['volume']), starts),
+    }
+
+    if sessionfilter and timeframe < bt.TimeFrame.Days:
+        minute = bucket[starts] % NS_PER_DAY // NS_PER_MINUTE
+        keep = (minute >= SESSION_START) & (minute <= SESSION_END)
+        result = {column: values[keep] for column, values in result.items()}
+
+    return result
@@ -0,0 +1,117 @@
+"""
+Compressed tick files which are read back in chunks.
+
+A tick file holds the trades or quotes of one ticker in blocks of up to
+BLOCK_TICKS ticks, every column of a block compressed on its own. The
+header lists the columns and their dtypes, the datetime column holds UTC ns
+and must be sorted. Reading decompresses one block at a time and skips the
+blocks outside the requested range without decompressing them, so a replay
+of months of ticks only ever holds one block in memory.
+"""
+import itertools
+import json
+import os
+import zlib
+from typing import Dict, Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'TICK0001'
+
+# Ticks per compressed block, the chunk size of reading
+BLOCK_TICKS = 1_000_000
+
+# Columns of trade and of quote ticks, one of them is expected by the replay engine
+TRADE_DTYPES = {'datetime': '<i8', 'price': '<f8', 'size': '<f8'}
+QUOTE_DTYPES = {'datetime': '<i8', 'bid': '<f8', 'ask': '<f8'}
+
+
+def write_ticks(path: str, chunks: Iterable[Dict[str, np.ndarray]], level: int = 1) -> int:
+    """Writes the chunks of ticks, in order, as a tick file and returns the number of ticks."""
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError(f'No ticks to write to {path}')
+    if 'datetime' not in first:
+        raise ValueError('Ticks need a datetime column')
+    # The datetime column is written first, so reading can skip a block by it
+    columns = ['datetime', *(column for column in first if column != 'datetime')]
+    dtypes = {column: np.asarray(first[column]).dtype.newbyteorder('<').str for column in columns}
+
+    count = 0
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        header = json.dumps(dtypes).encode()
+        f.write(MAGIC + np.array([len(header)], dtype='<i8').tobytes() + header)
+
+        for chunk in itertools.chain([first], chunks):
+            rows = len(chunk['datetime'])
+            for lo in range(0, rows, BLOCK_TICKS):
+                hi = min(lo + BLOCK_TICKS, rows)
+                f.write(np.array([hi - lo], dtype='<i8').tobytes())
+                for column, dtype in dtypes.items():
+                    data = zlib.compress(np.ascontiguousarray(chunk[column][lo:hi], dtype=dtype).tobytes(), level)
+                    f.write(np.array([len(data)], dtype='<i8').tobytes())
+                    f.write(data)
+            count += rows
+    os.replace(tmp, path)
+    return count
+
+
+def read_ticks(path: str, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[Dict[str, np.ndarray]]:
+    """Yields the ticks of a tick file block by block, limited to those from start until before end in UTC ns."""
+    with open(path, 'rb') as f:
+        if f.read(8) != MAGIC:
+            raise ValueError(f'{path} is not a tick file')
+        size = int(np.frombuffer(f.read(8), dtype='<i8')[0])
+        dtypes = {column: np.dtype(dtype) for column, dtype in json.loads(f.read(size)).items()}
+
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                return
+            rows = int(np.frombuffer(head, dtype='<i8')[0])
+
+            # Only the datetime column of a block outside the range is decompressed
+            block = {}
+            for column, dtype in dtypes.items():
+                size = int(np.frombuffer(f.read(8), dtype='<i8')[0])
+                if block.get('datetime', True) is None:
+                    f.seek(size, os.SEEK_CUR)
+                    continue
+                values = np.frombuffer(zlib.decompress(f.read(size)), dtype=dtype, count=rows)
+                if column == 'datetime':
+                    dt = values
+                    if end is not None and dt[0] >= end:
+                        return
+                    if start is not None and dt[-1] < start:
+                        values = None
+                block[column] = values
+            if block['datetime'] is None:
+                continue
+
+            lo, hi = np.searchsorted(dt, [
+                start if start is not None else np.iinfo(np.int64).min,
+                end if end is not None else np.iinfo(np.int64).max
+            ])
+            yield {column: values[lo:hi] for column, values in block.items()}
+
+
+def csv_ticks(path: str, chunk: int = BLOCK_TICKS) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Yields the ticks of a CSV file, compressed or not, in chunks. The
+    timestamp column, ISO dates or UTC ns, becomes the datetime column,
+    bid_price and ask_price of Alpaca quotes become bid and ask.
+    """
+    for frame in pd.read_csv(path, chunksize=chunk):
+        frame = frame.rename(columns={'bid_price': 'bid', 'ask_price': 'ask'})
+        timestamp = frame.pop('timestamp')
+        if pd.api.types.is_numeric_dtype(timestamp):
+            dt = timestamp.to_numpy(dtype=np.int64)
+        else:
+            dt = pd.DatetimeIndex(pd.to_datetime(timestamp, utc=True)).as_unit('ns').asi8
+        columns = TRADE_DTYPES if 'price' in frame else QUOTE_DTYPES
+        yield {'datetime': dt, **{
+            column: frame[column].to_numpy(dtype=np.float64) for column in columns if column != 'datetime'
+        }}
@@ -0,0 +1,225 @@
+"""
+Vectorized analytics of a backtest.
+
+The Recorder analyzer only writes the broker value of every step and the net
+P&L of every closed trade into preallocated arrays while the backtest runs.
+metrics computes every column of the results row from them afterwards in
+one NumPy pass, instead of the per bar and per trade bookkeeping of the
+DrawDown, Returns, TradeAnalyzer, SQN and PeriodStats analyzers. The values
+are computed the way those analyzers compute them, so the rows are the same.
+"""
+import math
+from typing import Any, Dict, Optional
+
+import backtrader as bt
+import numpy as np
+
+from data.barcache import EPOCH_NUM, NS_PER_DAY
+
+NS_PER_SECOND = 1_000_000_000
+
+# Periods per year by timeframe to normalize the returns, like bt.analyzers.Returns
+ANNUALIZATION = {
+    bt.TimeFrame.Days: 252.0,
+    bt.TimeFrame.Weeks: 52.0,
+    bt.TimeFrame.Months: 12.0,
+    bt.TimeFrame.Years: 1.0,
+}
+
+# Rows the arrays are allocated for when the length of the data is not known, e.g. live
+INITIAL_CAPACITY = 4096
+
+
+class Recorder(bt.Analyzer):
+    """Records the datetime and broker value of every step and the net P&L and side of every closed trade."""
+
+    def start(self):
+        # Preloaded datas know their length, the arrays only grow for live data
+        capacity = max([d.buflen() for d in self.strategy.datas] + [INITIAL_CAPACITY])
+        self.datetime = np.empty(capacity)
+        self.value = np.empty(capacity)
+        self.steps = 0
+
+        self.pnl = np.empty(INITIAL_CAPACITY)
+        self.long = np.empty(INITIAL_CAPACITY, dtype=bool)
+        self.closed = 0
+        self.opened = 0
+
+        self.start_value = self.strategy.broker.getvalue()
+        self._value = self.start_value
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        self._value = value
+
+    def next(self):
+        if self.steps == len(self.value):
+            self.datetime = np.resize(self.datetime, 2 * self.steps)
+            self.value = np.resize(self.value, 2 * self.steps)
+        self.datetime[self.steps] = self.strategy.datetime[0]
+        self.value[self.steps] = self._value
+        self.steps += 1
+
+    def notify_trade(self, trade):
+        if trade.justopened:
+            self.opened += 1
+        elif trade.status == trade.Closed:
+            if self.closed == len(self.pnl):
+                self.pnl = np.resize(self.pnl, 2 * self.closed)
+                self.long = np.resize(self.long, 2 * self.closed)
+            self.pnl[self.closed] = trade.pnlcomm
+            self.long[self.closed] = trade.long
+            self.closed += 1
+
+    def stop(self):
+        self.end_value = self.strategy.broker.getvalue()
+        # The data the periods of the returns are counted in, like the analyzers of a strategy
+        self.timeframe = self.strategy.data._timeframe
+        self.compression = self.strategy.data._compression
+
+    def get_analysis(self):
+        return dict(
+            datetime=self.datetime[:self.steps],
+            value=self.value[:self.steps],
+            pnl=self.pnl[:self.closed],
+            long=self.long[:self.closed],
+            opened=self.opened,
+            start_value=self.start_value,
+            end_value=self.end_value,
+            timeframe=self.timeframe,
+            compression=self.compression
+        )
+
+
+def _total(values: np.ndarray) -> float:
+    """The sum added up in order like the analyzers do, to the same last bit."""
+    return float(np.cumsum(values)[-1]) if len(values) else 0.0
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 5)
+
+
+def longest_streak(flags: np.ndarray) -> int:
+    """The longest run of True in flags."""
+    if not flags.any():
+        return 0
+    edges = np.flatnonzero(np.diff(np.r_[0, flags.astype(np.int8), 0]))
+    return int((edges[1::2] - edges[::2]).max())
+
+
+def periods(datetime: np.ndarray, timeframe: int, compression: int) -> np.ndarray:
+    """
+    The period of every backtrader datetime number, counted like the
+    TimeFrameAnalyzerBase: intraday periods end at the next multiple of the
+    compression, days, weeks, months and years are calendar periods.
+    """
+    # The time of the day in microseconds, snapped to the second within 10us
+    # like bt.num2date compensates the float error of the datetime numbers
+    whole = np.floor(datetime)
+    us = np.round((datetime - whole) * (NS_PER_DAY // 1000)).astype(np.int64)
+    fraction = us % 1_000_000
+    us[fraction < 10] -= fraction[fraction < 10]
+    us[fraction > 999_990] += 1_000_000 - fraction[fraction > 999_990]
+    ns = (whole - EPOCH_NUM).astype(np.int64) * NS_PER_DAY + us * 1000
+    day = ns // NS_PER_DAY
+    if timeframe == bt.TimeFrame.Days:
+        return day
+    if timeframe == bt.TimeFrame.Weeks:
+        # Day 0 is a Thursday, ISO weeks start on Monday
+        return (day + 3) // 7
+    if timeframe == bt.TimeFrame.Months:
+        return ns.astype('datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+    if timeframe == bt.TimeFrame.Years:
+        return ns.astype('datetime64[ns]').astype('datetime64[Y]').astype(np.int64)
+
+    unit = 60 * NS_PER_SECOND if timeframe == bt.TimeFrame.Minutes else NS_PER_SECOND
+    point = (ns % NS_PER_DAY // unit // compression + 1) * compression
+    return day * (NS_PER_DAY // unit) + point
+
+
+def _mean_std(values: np.ndarray):
+    """The average and population standard deviation, summed with fsum like bt.mathsupport."""
+    mean = math.fsum(values) / len(values)
+    return mean, math.sqrt(math.fsum((values - mean) ** 2) / len(values))
+
+
+def metrics(recorded: Dict[str, Any]) -> Dict[str, Any]:
+    """The columns of the results row but the params and risk from the recorded equity and trades."""
+    pnl, long, value = recorded['pnl'], recorded['long'], recorded['value']
+    closed = len(pnl)
+    won = pnl >= 0.0
+
+    # DrawDown, from the highest value of all steps so far
+    peak = np.maximum.accumulate(value)
+    moneydown = peak - value
+    drawdown = 100.0 * moneydown / peak
+
+    # Returns, the log return averaged over the periods of the data
+    start, end = recorded['start_value'], recorded['end_value']
+    rtot = math.log(end / start) if start and end / start > 0.0 else -math.inf
+    period = periods(recorded['datetime'], recorded['timeframe'], recorded['compression'])
+    ravg = rtot / (1 + int(np.count_nonzero(np.diff(period))))
+    rnorm = math.expm1(ravg * ANNUALIZATION.get(recorded['timeframe'], 1.0)) if ravg > -math.inf else ravg
+
+    # SQN of the closed trades
+    if closed > 1:
+        mean, std = _mean_std(pnl)
+        sqn = math.sqrt(closed) * mean / std if std else None
+    else:
+        sqn = 0
+
+    # PeriodStats over days, every day returns from the last value of the previous day
+    days = periods(recorded['datetime'], bt.TimeFrame.Days, 1)
+    ends = np.flatnonzero(np.r_[days[1:] != days[:-1], True]) if len(days) else days
+    closes = value[ends]
+    daily = closes / np.r_[start, closes[:-1]] - 1.0
+    average, stddev = _mean_std(daily)
+
+    row = {
+        'total': recorded['opened'],
+        'open': recorded['opened'] - closed,
+        'closed': closed,
+        'won_streak': longest_streak(won),
+        'lost_streak': longest_streak(~won),
+        'won': 0,
+        'won_pnl': 0,
+        'won_pnl_avg': 0,
+        'lost': 0,
+        'lost_pnl': 0,
+        'lost_pnl_avg': 0,
+        'long': 0,
+        'long_pnl': 0,
+        'short': 0,
+        'short_pnl': 0,
+        'pnl': 0,
+    }
+    if closed:
+        won_pnl, lost_pnl = _total(pnl[won]), _total(pnl[~won])
+        row.update({
+            'won': int(won.sum()),
+            'won_pnl': _round(won_pnl),
+            'won_pnl_avg': _round(won_pnl / (int(won.sum()) or 1.0)),
+            'lost': int((~won).sum()),
+            'lost_pnl': _round(lost_pnl),
+            'lost_pnl_avg': _round(lost_pnl / (int((~won).sum()) or 1.0)),
+            'long': int(long.sum()),
+            'long_pnl': _round(_total(pnl[long])),
+            'short': int((~long).sum()),
+            'short_pnl': _round(_total(pnl[~long])),
+            'pnl': _round(_total(pnl)),
+        })
+
+    return {
+        **row,
+        'drawdown': _round(float(max(drawdown.max(), 0.0))) if len(value) else 0.0,
+        'moneydown': _round(float(max(moneydown.max(), 0.0))) if len(value) else 0.0,
+        'rtot': _round(rtot),
+        'rnorm': _round(rnorm),
+        'sqn': sqn,
+        'avg_day': _round(average),
+        'stddev': _round(stddev),
+        'positive_days': int((daily > 0.0).sum()),
+        'negative_days': int((daily < 0.0).sum()),
+        'best_day': _round(float(daily.max())),
+        'worst_day': _round(float(daily.min())),
+    }
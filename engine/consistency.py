@@ -0,0 +1,71 @@
+from typing import Dict, List, Type
+
+import backtrader as bt
+import numpy as np
+
+from backtest import add_feed, create_cerebro
+from data.barcache import CachedData, NS_PER_DAY
+from engine.fast import FAST_ENGINES, Execution
+from strategies.customStrategy import BaseStrategy
+
+
+class Executions(bt.Analyzer):
+    """Records every completed order with the step it was executed at."""
+
+    def start(self):
+        self.executions: List[Execution] = []
+
+    def notify_order(self, order):
+        if order.status == order.Completed:
+            self.executions.append(Execution(
+                step=len(self.strategy) - 1,
+                size=order.executed.size,
+                price=order.executed.price
+            ))
+
+    def get_analysis(self):
+        return self.executions
+
+
+def sample(feeds: List[Dict[str, np.ndarray]], days: int) -> List[Dict[str, np.ndarray]]:
+    """The bars of the first days of all feeds."""
+    start = min(bars['datetime'][0] for bars in feeds if len(bars['datetime']))
+    end = start + days * NS_PER_DAY
+    return [
+        {column: values[:np.searchsorted(bars['datetime'], end)] for column, values in bars.items()}
+        for bars in feeds
+    ]
+
+
+def check_consistency(
+    strategy: Type[BaseStrategy],
+    specs: List[dict],
+    feeds: List[Dict[str, np.ndarray]],
+    params: dict,
+    startcash: int,
+    tolerance: float = 1e-6
+) -> List[str]:
+    """
+    Runs the fast engine and backtrader on the same bars and compares their executions.
+
+    Returns a description of every difference, an empty list if both engines
+    traded identically.
+    """
+    fast = FAST_ENGINES[strategy](feeds).run(params, startcash)
+
+    cerebro = create_cerebro(startcash)
+    cerebro.addstrategy(strategy, **params)
+    cerebro.addanalyzer(Executions, _name='executions')
+    for spec, bars in zip(specs, feeds):
+        add_feed(cerebro, CachedData(bars=bars, **spec))
+    expected = cerebro.run()[0].analyzers.executions.get_analysis()
+
+    differences = []
+    for i, (e, f) in enumerate(zip(expected, fast.executions)):
+        if e.step != f.step or abs(e.size - f.size) > tolerance or abs(e.price - f.price) > tolerance:
+            differences.append(f'Execution {i}: backtrader {e}, fast {f}')
+
+    if len(expected) != len(fast.executions):
+        differences.append(f'backtrader executed {len(expected)} orders, fast {len(fast.executions)}')
+
+    return differences
@@ -0,0 +1,335 @@
+"""
+Vectorized fast-path backtester for screening parameter combinations.
+
+Indicators and entry signals are computed on whole NumPy arrays. Orders are
+simulated by searching the bar arrays for the first bar which fills them, so
+the Python work per combination scales with the number of trades instead of
+the number of bars. The fills follow backtrader's BackBroker: orders are
+checked from the step after their creation against the current bar of their
+data, limit and stop orders fill at the open on gaps and at their price
+otherwise, and market orders fill at the open of the next new bar.
+"""
+import math
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+
+from backtest import COMMISSION, SIZER_PERCENTS
+from engine import indicators
+from strategies.customStrategy import BaseStrategy
+from strategies.RSIStack import RSIStack
+from strategies.Slingshot import Slingshot
+
+
+@dataclass
+class Execution:
+    step: int  # index into the timeline of all bars of all feeds
+    size: float  # positive for buys, negative for sells
+    price: float
+
+
+@dataclass
+class FastResult:
+    params: dict
+    startcash: float
+    value: float = 0.0
+    executions: List[Execution] = field(default_factory=list)
+    trades: List[float] = field(default_factory=list)  # pnl incl. commission of every closed trade
+
+    @property
+    def pnl(self) -> float:
+        return self.value - self.startcash
+
+    @property
+    def rtot(self) -> float:
+        return math.log(self.value / self.startcash) if self.value > 0 else -math.inf
+
+    @property
+    def won(self) -> int:
+        return sum(1 for pnl in self.trades if pnl > 0)
+
+    @property
+    def lost(self) -> int:
+        return sum(1 for pnl in self.trades if pnl <= 0)
+
+
+class FastEngine(ABC):
+    """
+    Aligns all feeds of a strategy on one timeline of steps, one step per
+    distinct bar datetime, like backtrader advances multiple datas. Subclasses
+    precompute everything parameter independent once, so a sweep only pays
+    for the signals and trades of every combination.
+    """
+    max_tickers: Optional[int] = None  # most tickers the engine backtests at once, None for any
+
+    def __init__(self, feeds: List[Dict[str, np.ndarray]]):
+        self.feeds = [{column: np.asarray(values) for column, values in bars.items()} for bars in feeds]
+        self.timeline = np.unique(np.concatenate([bars['datetime'] for bars in self.feeds]))
+        self.steps = len(self.timeline)
+        # Index of the current bar of every feed at every step, -1 before its first bar
+        self.positions = [
+            np.searchsorted(bars['datetime'], self.timeline, side='right') - 1
+            for bars in self.feeds
+        ]
+        self._cache = {}
+
+    @abstractmethod
+    def run(self, params: dict, startcash: float) -> FastResult:
+        """Backtests the params from startcash."""
+
+    def aligned(self, feed: int, values: np.ndarray, ago: int = 0) -> np.ndarray:
+        """The values of a per-bar array of the feed at every step, ago bars back, NaN where not available."""
+        pos = self.positions[feed] - ago
+        out = np.asarray(values, dtype=np.float64)[np.maximum(pos, 0)]
+        out[pos < 0] = np.nan
+        return out
+
+    def ready(self, minperiods: Dict[int, int]) -> np.ndarray:
+        """Steps at which backtrader calls next, every feed has at least its minimum period of bars."""
+        ready = np.ones(self.steps, dtype=bool)
+        for feed, pos in enumerate(self.positions):
+            ready &= pos + 1 >= minperiods.get(feed, 1)
+        return ready
+
+    def cached(self, key: tuple, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def first(self, condition: Callable[[slice], np.ndarray], start: int) -> Optional[int]:
+        """The first step from start on for which condition holds, scanning in growing chunks."""
+        size = 256
+        while start < self.steps:
+            stop = min(self.steps, start + size)
+            hits = np.flatnonzero(condition(slice(start, stop)))
+            if len(hits):
+                return start + int(hits[0])
+            start, size = stop, size * 4
+        return None
+
+    @staticmethod
+    def next_signal(signals: np.ndarray, start: int) -> Optional[int]:
+        """The first signal step from start on, signals being the sorted steps of all signals."""
+        i = np.searchsorted(signals, start)
+        return int(signals[i]) if i < len(signals) else None
+
+    @staticmethod
+    def accepted(cash: float, orders: List[Tuple[float, float]]) -> List[bool]:
+        """
+        Which of the (size, price) orders the broker accepts on submission.
+
+        The broker pseudo-executes the orders in submission order at their
+        created prices and rejects every order after which the cash is negative.
+        """
+        result = []
+        for size, price in orders:
+            cash -= size * price + abs(size) * price * COMMISSION
+            result.append(cash >= 0)
+        return result
+
+    @staticmethod
+    def finish(result: FastResult, close: np.ndarray) -> FastResult:
+        """Books the executions like the broker and values the open position at the last close."""
+        cash = result.startcash
+        position = price = trade = 0.0
+
+        for e in result.executions:
+            comm = abs(e.size) * e.price * COMMISSION
+            cash -= e.size * e.price + comm
+
+            closing = 0.0 if position * e.size >= 0 else min(abs(e.size), abs(position))
+            if closing:
+                # Split the commission between the closed and the opened part
+                trade += closing * (e.price - price) * np.sign(position) - comm * closing / abs(e.size)
+                position += math.copysign(closing, e.size)
+                if not position:
+                    result.trades.append(trade)
+                    trade = price = 0.0
+
+            opening = abs(e.size) - closing
+            if opening:
+                price = (price * abs(position) + e.price * opening) / (abs(position) + opening)
+                position += math.copysign(opening, e.size)
+                trade -= comm * opening / abs(e.size)
+
+        last = close[~np.isnan(close)]
+        result.value = cash + position * (last[-1] if len(last) else 0.0)
+        return result
+
+
+class FastRSIStack(FastEngine):
+    """RSIStack.next on arrays, for a single ticker."""
+    max_tickers = 1
+
+    def __init__(self, feeds: List[Dict[str, np.ndarray]]):
+        super().__init__(feeds)
+
+        if len(feeds) != len(RSIStack.timeframes):
+            raise ValueError('The fast RSIStack engine supports a single ticker only')
+
+        # Orders are placed on the last (lowest frequency) timeframe
+        d = len(feeds) - 1
+        self.rsi = [self.aligned(i, indicators.rsi(bars['close'])) for i, bars in enumerate(self.feeds)]
+        self.atr = self.aligned(d, indicators.atr(self.feeds[d]['high'], self.feeds[d]['low'], self.feeds[d]['close']))
+        self.open, self.high, self.low, self.close = (
+            self.aligned(d, self.feeds[d][column]) for column in ['open', 'high', 'low', 'close']
+        )
+        self.prevclose = self.aligned(d, self.feeds[d]['close'], ago=1)
+
+        # RSI and ATR with their default period of 14 need 15 bars on every feed
+        self.isready = self.ready({i: 15 for i in range(len(feeds))})
+
+    def run(self, params: dict, startcash: float) -> FastResult:
+        result = FastResult(params, startcash)
+
+        overbought = np.logical_and.reduce([rsi >= params['rsi_overbought'] for rsi in self.rsi])
+        oversold = np.logical_and.reduce([rsi <= params['rsi_oversold'] for rsi in self.rsi])
+        short = self.isready & overbought & (self.close < self.prevclose)
+        long = self.isready & ~short & oversold & (self.close > self.prevclose)
+        signals = np.flatnonzero(short | long)
+
+        cash = startcash
+        j = self.next_signal(signals, 0)
+        while j is not None:
+            price, atr = self.close[j], self.atr[j]
+            size = cash // price
+            if not size:
+                break
+
+            direction = -1 if short[j] else 1
+            if short[j]:
+                stop, limit = price + atr, price - atr * params['rrr']
+            else:
+                stop, limit = price - atr, price + atr * params['rrr']
+
+            # Rejecting any order of the bracket cancels all of them, the
+            # strategy then tries again on the next step
+            if not all(self.accepted(cash, [(direction * size, price), (-direction * size, stop),
+                                            (-direction * size, limit)])):
+                j = self.next_signal(signals, j + 1)
+                continue
+
+            if short[j]:
+                entry = self.first(lambda s: self.high[s] >= price, j + 1)
+            else:
+                entry = self.first(lambda s: self.low[s] <= price, j + 1)
+
+            if entry is None:
+                # The entry order stays open and blocks every further entry
+                break
+
+            result.executions.append(Execution(entry, direction * size, self._limitfill(entry, price, direction)))
+            cash -= direction * size * result.executions[-1].price * (1 + direction * COMMISSION)
+
+            if direction == 1:
+                exit = self.first(lambda s: (self.low[s] <= stop) | (self.high[s] >= limit), entry + 1)
+            else:
+                exit = self.first(lambda s: (self.high[s] >= stop) | (self.low[s] <= limit), entry + 1)
+            if exit is None:
+                break
+
+            # The stop was submitted before the limit, so it is checked first
+            if (self.low[exit] <= stop) if direction == 1 else (self.high[exit] >= stop):
+                fill = self._stopfill(exit, stop, -direction)
+            else:
+                fill = self._limitfill(exit, limit, -direction)
+            result.executions.append(Execution(exit, -direction * size, fill))
+            cash += direction * size * fill * (1 - direction * COMMISSION)
+
+            j = self.next_signal(signals, exit)
+
+        return self.finish(result, self.close)
+
+    def _limitfill(self, step: int, price: float, direction: int) -> float:
+        o = self.open[step]
+        return o if (o <= price if direction == 1 else o >= price) else price
+
+    def _stopfill(self, step: int, price: float, direction: int) -> float:
+        o = self.open[step]
+        return o if (o >= price if direction == 1 else o <= price) else price
+
+
+class FastSlingshot(FastEngine):
+    """Slingshot.next on arrays, trading the first two feeds like the strategy."""
+
+    def __init__(self, feeds: List[Dict[str, np.ndarray]]):
+        super().__init__(feeds)
+
+        self.open, self.high, self.low, self.close = (
+            self.aligned(0, self.feeds[0][column]) for column in ['open', 'high', 'low', 'close']
+        )
+        self.dailylow = self.aligned(1, self.feeds[1]['low'])
+
+    def run(self, params: dict, startcash: float) -> FastResult:
+        result = FastResult(params, startcash)
+        hourly, daily = self.feeds[0], self.feeds[1]
+        length = params['slingshot_ema_length']
+
+        slingshot_ema = self.cached(('ema', 0, length), lambda: indicators.ema(hourly['high'], length))
+        strong_sma = self.cached(('sma', 1, params['strong_sma_length']),
+                                 lambda: indicators.sma(daily['open'], params['strong_sma_length']))
+        pullback_ema = self.cached(('ema', 1, params['pullback_ema_length']),
+                                   lambda: indicators.ema(daily['open'], params['pullback_ema_length']))
+
+        # Closes of the previous length - 1 bars all below the EMA
+        below = np.cumsum(np.r_[0, hourly['close'] < slingshot_ema])
+        idx = np.arange(len(hourly['close']))
+        all_previous_below = below[idx] - below[np.maximum(idx - length + 1, 0)] == length - 1
+        slingshot = (hourly['close'] > slingshot_ema) & all_previous_below
+
+        is_strong = daily['low'] > strong_sma
+        is_pullback = daily['high'] < pullback_ema
+
+        ready = self.ready({
+            0: length,
+            1: max(params['strong_sma_length'], params['pullback_ema_length'])
+        })
+        signal = ready & (self.aligned(0, slingshot) == 1) \
+            & (self.aligned(1, is_strong) == 1) & (self.aligned(1, is_pullback) == 1)
+        signals = np.flatnonzero(signal)
+
+        position = 0.0
+        cash = startcash
+        j = self.next_signal(signals, 0)
+        while j is not None:
+            close, low = self.close[j], self.dailylow[j]
+            size = abs(position) if position else cash / close * (SIZER_PERCENTS / 100)
+            target = close + (close - low) * params['rrr']
+
+            # The market buy fills at the open of the next new hourly bar,
+            # the stop and the limit are independent orders, not a bracket
+            buy = np.searchsorted(self.positions[0], self.positions[0][j], side='right')
+            orders = [
+                (buy if buy < self.steps else None, size, lambda k: self.open[k]),
+                (self.first(lambda s: self.low[s] <= low, j + 1), -size,
+                 lambda k: min(self.open[k], low)),
+                (self.first(lambda s: self.high[s] >= target, j + 1), -size,
+                 lambda k: max(self.open[k], target)),
+            ]
+            accepted = self.accepted(cash, [(size, close), (-size, low), (-size, target)])
+            orders = [order for order, ok in zip(orders, accepted) if ok]
+
+            filled = sorted(
+                ((step, i, size, fill(step)) for i, (step, size, fill) in enumerate(orders) if step is not None),
+                key=lambda order: order[:2]
+            )
+            for step, _, size, price in filled:
+                result.executions.append(Execution(step, size, price))
+                cash -= size * price + abs(size) * price * COMMISSION
+                position += size
+
+            if len(filled) < len(orders):
+                # An order stays open, the strategy never enters again
+                break
+
+            j = self.next_signal(signals, filled[-1][0] if filled else j + 1)
+
+        return self.finish(result, self.close)
+
+
+FAST_ENGINES: Dict[Type[BaseStrategy], Type[FastEngine]] = {
+    RSIStack: FastRSIStack,
+    Slingshot: FastSlingshot,
+}
@@ -0,0 +1,91 @@
+"""
+Indicators computed once per process and shared by every strategy instance.
+
+An optimization backtests many parameter combinations on the same bars,
+most of which use the same indicators. With preloaded data the series are
+computed once with the NumPy versions in engine.indicators, cached by
+the contents of their input lines, the indicator and its period, and handed
+to each strategy as a Precomputed line. The cache holds the series of the
+CACHE_ENTRIES most recently used indicators. Without preloading, as in live
+trading, the backtrader indicator itself is used.
+"""
+import hashlib
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import backtrader as bt
+import numpy as np
+
+from engine import indicators
+
+# backtrader indicator -> (NumPy version, input lines, default period, minperiod for a period)
+SHARED: Dict[type, Tuple[Callable[..., np.ndarray], Tuple[Optional[str], ...], int, Callable[[int], int]]] = {
+    bt.ind.RSI: (indicators.rsi, (None,), 14, lambda period: period + 1),
+    bt.ind.ATR: (indicators.atr, ('high', 'low', 'close'), 14, lambda period: period + 1),
+    bt.ind.EMA: (indicators.ema, (None,), 30, lambda period: period),
+    bt.ind.SMA: (indicators.sma, (None,), 30, lambda period: period),
+}
+
+# Indicator series kept per process, the least recently used are evicted
+CACHE_ENTRIES = 64
+
+_cache: 'OrderedDict[tuple, np.ndarray]' = OrderedDict()
+
+
+class Precomputed(bt.Indicator):
+    """A line with values computed ahead of the backtest, one per bar of its data."""
+    lines = ('value',)
+    params = (('values', None), ('minperiod', 1))
+
+    def __init__(self):
+        self.addminperiod(self.p.minperiod)
+
+    def next(self):
+        self.lines.value[0] = self.p.values[len(self) - 1]
+
+    def once(self, start, end):
+        self.lines.value.array[start:end] = array('d', self.p.values[start:end])
+
+
+def line_key(data: bt.feed.DataBase, line: str) -> bytes:
+    """
+    Identifies the values of a line of a preloaded feed by their digest, the
+    same for every Cerebro loading the same bars. Computed once per feed.
+    """
+    digests = data.__dict__.setdefault('_line_digests', {})
+    if line not in digests:
+        values = getattr(data, line).array
+        digests[line] = hashlib.blake2b(memoryview(values).cast('B'), digest_size=16).digest()
+    return digests[line]
+
+
+def shared_indicator(
+    strategy: bt.Strategy,
+    indicator: type,
+    data: bt.feed.DataBase,
+    line: str = 'close',
+    period: Optional[int] = None
+) -> bt.Indicator:
+    """
+    The indicator on the line of data, e.g. shared_indicator(strategy,
+    bt.ind.EMA, data, 'high', period=4) for bt.ind.EMA(data.high, period=4).
+    Indicators which read several lines, like ATR, ignore line.
+    """
+    compute, inputs, default, minperiod = SHARED[indicator]
+    period = period or default
+
+    if not strategy.env._dopreload:
+        source = data if inputs != (None,) else getattr(data, line)
+        return indicator(source, period=period)
+
+    names = [line if name is None else name for name in inputs]
+    key = (indicator.__name__, period, *(line_key(data, name) for name in names))
+    if key in _cache:
+        _cache.move_to_end(key)
+    else:
+        _cache[key] = compute(*[np.asarray(getattr(data, name).array) for name in names], period)
+        if len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+    return Precomputed(data, values=_cache[key], minperiod=minperiod(period))
@@ -0,0 +1,71 @@
+"""
+NumPy versions of the backtrader indicators used by the strategies.
+
+Every function returns an array of the same length as its input with NaN
+before the indicator's minimum period. The values are identical to the ones
+backtrader computes, down to the last bit, as both engines and the
+indicator cache rely on that.
+"""
+import math
+
+import numpy as np
+
+
+def sma(x: np.ndarray, period: int) -> np.ndarray:
+    """bt.ind.SMA"""
+    values = np.asarray(x, dtype=np.float64).tolist()
+    out = np.full(len(values), np.nan)
+    # math.fsum like backtrader, a cumulative sum would differ in the last bits
+    out[period - 1:] = [math.fsum(values[i - period + 1:i + 1]) / period for i in range(period - 1, len(values))]
+    return out
+
+
+def _smoothing(x: np.ndarray, period: int, alpha: float, first: int = 0) -> np.ndarray:
+    """
+    Exponential smoothing seeded with the SMA of the first period values
+    starting at first, in the same order of operations as backtrader.
+    """
+    values = np.asarray(x, dtype=np.float64).tolist()
+    out = np.full(len(values), np.nan)
+    seed = first + period - 1
+    if len(values) <= seed:
+        return out
+
+    alpha1 = 1.0 - alpha
+    prev = math.fsum(values[first:seed + 1]) / period
+    smoothed = [prev]
+    for value in values[seed + 1:]:
+        prev = prev * alpha1 + value * alpha
+        smoothed.append(prev)
+
+    out[seed:] = smoothed
+    return out
+
+
+def ema(x: np.ndarray, period: int) -> np.ndarray:
+    """bt.ind.EMA"""
+    return _smoothing(x, period, 2.0 / (1 + period))
+
+
+def smma(x: np.ndarray, period: int, first: int = 0) -> np.ndarray:
+    """bt.ind.SmoothedMovingAverage"""
+    return _smoothing(x, period, 1.0 / period, first)
+
+
+def rsi(close: np.ndarray, period: int = 14) -> np.ndarray:
+    """bt.ind.RSI with its default SmoothedMovingAverage"""
+    close = np.asarray(close, dtype=np.float64)
+    diff = np.r_[np.nan, np.diff(close)]
+    up = smma(np.maximum(diff, 0.0), period, first=1)
+    down = smma(np.maximum(-diff, 0.0), period, first=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100.0 - 100.0 / (1.0 + up / down)
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> np.ndarray:
+    """bt.ind.ATR with its default SmoothedMovingAverage"""
+    prev = np.r_[np.nan, np.asarray(close, dtype=np.float64)[:-1]]
+    truerange = np.fmax(high, prev) - np.fmin(low, prev)
+    truerange[0] = np.nan
+    return smma(truerange, period, first=1)
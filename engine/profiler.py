@@ -0,0 +1,186 @@
+"""
+Opt-in profiling of backtests by section of the backtrader loop.
+
+The Profile analyzer wraps the methods backtrader calls on every bar when
+the strategy starts: loading the bars of every feed, the broker's order
+matching and notifications, every indicator (attributed to its feed),
+the strategy's next(), the order calls made from it, the analyzers and the
+observers. The time of every call is accumulated by its stack of sections,
+whatever is left of the wall time is backtrader's own loop and line
+machinery. Profiles of many runs, e.g. of the worker processes of an
+optimization, are merged with Profiler.merge.
+
+The stacks are written in the folded format of flamegraph.pl and
+speedscope, one line per stack with its self time in microseconds.
+"""
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import backtrader as bt
+from backtrader.lineiterator import LineIterator
+
+# Top level sections of a strategy, in the order of the report
+SECTIONS = ['feeds', 'broker', 'notifications', 'indicators', 'next', 'analyzers', 'observers', 'backtrader']
+
+
+class Profiler:
+    """Accumulates the time spent per stack of sections, bars and wall time per strategy."""
+
+    def __init__(self):
+        self.time: Dict[Tuple[str, ...], int] = defaultdict(int)  # inclusive ns per stack
+        self.bars: Dict[str, int] = defaultdict(int)  # strategy or feed -> bars
+        self.wall: Dict[str, int] = defaultdict(int)  # strategy -> ns
+        self._stack: List[str] = []
+
+    def wrap(self, owner, method: str, *frames: str) -> None:
+        """Replaces owner.method by a wrapper which times it as the frames on top of the current stack."""
+        call = getattr(owner, method)
+        stack, times, size, top = self._stack, self.time, len(frames), list(frames)
+
+        def timed(*args, **kwargs):
+            # Already timed by the caller, like data.next calling data.advance
+            if stack[-size:] == top:
+                return call(*args, **kwargs)
+
+            stack.extend(frames)
+            path = tuple(stack)
+            start = time.perf_counter_ns()
+            try:
+                return call(*args, **kwargs)
+            finally:
+                times[path] += time.perf_counter_ns() - start
+                del stack[-size:]
+
+        setattr(owner, method, timed)
+
+    def merge(self, other: 'Profiler') -> None:
+        for path, ns in other.time.items():
+            self.time[path] += ns
+        for name, bars in other.bars.items():
+            self.bars[name] += bars
+        for name, ns in other.wall.items():
+            self.wall[name] += ns
+
+    def self_time(self) -> Dict[Tuple[str, ...], int]:
+        """The time of every stack without the time of the stacks called from it."""
+        result = dict(self.time)
+        for path, ns in self.time.items():
+            if len(path) > 1 and path[:-1] in result:
+                result[path[:-1]] -= ns
+
+        # The wall time of a strategy not spent in any section is the backtrader loop
+        for strategy, wall in self.wall.items():
+            sections = sum(ns for path, ns in result.items() if path[0] == strategy or path[0] not in self.wall)
+            result[(strategy, 'backtrader')] = max(wall - sections, 0)
+        return result
+
+    def dump(self, path: str) -> None:
+        """Writes the stacks in the folded format of flamegraph.pl, self times in microseconds."""
+        with open(path, 'w') as f:
+            for stack, ns in sorted(self.self_time().items()):
+                if ns >= 1000:
+                    f.write(f'{";".join(stack)} {ns // 1000}\n')
+
+    def sections(self, strategy: str) -> Dict[str, int]:
+        """The ns spent in every top level section of the strategy, feeds and broker are shared by all strategies."""
+        result = {section: 0 for section in SECTIONS}
+        for path, ns in self.self_time().items():
+            if path[0] == strategy and path[1] in result:
+                result[path[1]] += ns
+            elif path[0] in result:
+                result[path[0]] += ns
+        return result
+
+    def report(self) -> None:
+        """Prints the bars per second and the share of every section of each strategy and the bars of each feed."""
+        print(f'{"strategy":<16}{"bars":>10}{"seconds":>10}{"bars/s":>12}  ' + ''.join(f'{s:>14}' for s in SECTIONS))
+        for strategy, wall in self.wall.items():
+            bars = self.bars[strategy]
+            seconds = wall / 1e9
+            shares = ''.join(f'{ns / wall:>14.1%}' for ns in self.sections(strategy).values()) if wall else ''
+            print(f'{strategy:<16}{bars:>10}{seconds:>10.2f}{bars / seconds if seconds else 0:>12,.0f}  {shares}')
+
+        print(f'\n{"feed":<24}{"bars":>10}{"load s":>10}{"indicators s":>14}')
+        feeds = [name for name in self.bars if name not in self.wall]
+        for feed in feeds:
+            load = self.time.get(('feeds', feed), 0)
+            indicators = sum(ns for path, ns in self.self_time().items() if path[1:3] == ('indicators', feed))
+            print(f'{feed:<24}{self.bars[feed]:>10}{load / 1e9:>10.2f}{indicators / 1e9:>14.2f}')
+
+
+class Profile(bt.Analyzer):
+    """Profiles its strategy, the broker and the feeds into the profiler."""
+    params = (('profiler', None),)
+
+    def start(self):
+        profiler: Profiler = self.p.profiler
+        strategy = self.strategy
+        self.name = type(strategy).__name__
+
+        profiler.wrap(strategy, 'next', self.name, 'next')
+        profiler.wrap(strategy, 'prenext', self.name, 'next')
+        profiler.wrap(strategy, '_notify', self.name, 'notifications')
+        profiler.wrap(strategy, 'notify_order', 'notify_order')
+        profiler.wrap(strategy, 'notify_trade', 'notify_trade')
+
+        for indicator in strategy._lineiterators[LineIterator.IndType]:
+            self._wrap_indicator(indicator, (self.name, 'indicators', feed_name(_feed(indicator))))
+        for analyzer in strategy.analyzers:
+            if analyzer is not self:
+                for method in ('_next', '_prenext', '_nextstart'):
+                    profiler.wrap(analyzer, method, self.name, 'analyzers', type(analyzer).__name__)
+        for observer in strategy._lineiterators[LineIterator.ObsType]:
+            for method in ('next', 'prenext'):
+                profiler.wrap(observer, method, self.name, 'observers', type(observer).__name__)
+
+        # The broker and the feeds are shared by all strategies of the Cerebro, they are profiled once
+        broker = strategy.broker
+        self.profiles_feeds = not getattr(broker, 'profiled', False)
+        if self.profiles_feeds:
+            broker.profiled = True
+            profiler.wrap(broker, 'next', 'broker')
+            for method in ('buy', 'sell', 'cancel'):
+                profiler.wrap(broker, method, 'orders')
+            for data in strategy.datas:
+                profiler.wrap(data, 'next', 'feeds', feed_name(data))
+                profiler.wrap(data, 'advance', 'feeds', feed_name(data))
+
+        self.started = time.perf_counter_ns()
+
+    def _wrap_indicator(self, indicator, frames: Tuple[str, ...]) -> None:
+        # Indicators built from other indicators call them from their own _next and _once,
+        # line operations like data.close - data.open have no children
+        for child in getattr(indicator, '_lineiterators', {}).get(LineIterator.IndType, []):
+            self._wrap_indicator(child, ())
+        frames = frames + (type(indicator).__name__,)
+        self.p.profiler.wrap(indicator, '_next', *frames)
+        self.p.profiler.wrap(indicator, '_once', *frames)
+
+    def stop(self):
+        profiler: Profiler = self.p.profiler
+        profiler.wall[self.name] += time.perf_counter_ns() - self.started
+        profiler.bars[self.name] += len(self.strategy)
+        if self.profiles_feeds:
+            for data in self.strategy.datas:
+                profiler.bars[feed_name(data)] += len(data)
+
+
+def feed_name(data) -> str:
+    if data is None:
+        return 'lines'
+    name = data._name or data.p.dataname
+    return f'{name} {data._compression} {bt.TimeFrame.getname(data._timeframe, data._compression)}'
+
+
+def _feed(indicator):
+    """The data feed an indicator is computed on, following the owners of lines and indicators on indicators."""
+    source = indicator
+    for _ in range(16):
+        if isinstance(source, bt.AbstractDataBase):
+            return source
+        datas = getattr(source, 'datas', None)
+        source = datas[0] if datas else getattr(source, '_owner', None)
+        if source is None:
+            return None
+    return None
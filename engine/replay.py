@@ -0,0 +1,190 @@
+"""
+Tick replay of the SuperScalper with fills inside the minute.
+
+backtrader fills the market orders of the SuperScalper at the open of the
+next 1 minute bar. The replay streams the trades or quotes of a tick file in
+chunks, builds the 1 minute bars from them and runs the decisions of
+ScalperLogic on the close of every bar of the session. Each order fills on
+the first tick at or after the close of its bar plus a latency: at the trade
+price of trades, at the ask for buys and the bid for sells of quotes.
+
+Bars, the session filter and the fills are computed on whole chunks with
+NumPy, Python only runs once per bar, so memory is bounded by the chunk size
+and millions of ticks are replayed per second.
+"""
+import math
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data.barcache import EXCHANGE_TZ, NS_PER_DAY
+from data.journal import Journal
+from data.resample import NS_PER_MINUTE, SESSION_END, SESSION_START
+from engine.fast import Execution, FastEngine, FastResult
+from strategies.SuperScalper import TRADE_COLUMNS, Entry, ScalperLogic, SuperScalper, Trade
+
+
+def minute_bars(chunks: Iterable[Dict[str, np.ndarray]]) -> Iterator[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]]:
+    """
+    Yields every chunk of ticks limited to the session with the 1 minute bars
+    completed in it: their start in UTC ns, minute of the day in exchange
+    time and close.
+
+    The ticks of the last minute of a chunk are held back and yielded with
+    the next chunk, as more ticks of that minute may follow.
+    """
+    carry = None
+    for chunk in _with_last(chunks):
+        ticks, last = chunk
+        if carry is not None:
+            ticks = {column: np.concatenate([carry[column], values]) for column, values in ticks.items()}
+        if not len(ticks['datetime']):
+            carry = ticks
+            continue
+
+        bucket = ticks['datetime'] // NS_PER_MINUTE
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+
+        # Drop the ticks of bars outside 09:30 - 16:00, the bars the session filter of the cache keeps
+        local = pd.DatetimeIndex(bucket[starts] * NS_PER_MINUTE, tz='UTC').tz_convert(EXCHANGE_TZ).tz_localize(None).asi8
+        minute = local % NS_PER_DAY // NS_PER_MINUTE
+        session = (minute >= SESSION_START) & (minute <= SESSION_END)
+        if not session.all():
+            keep = np.repeat(session, np.diff(np.r_[starts, len(bucket)]))
+            ticks = {column: values[keep] for column, values in ticks.items()}
+            bucket, minute = bucket[keep], minute[session]
+            if not len(bucket):
+                # Only ticks outside the session, e.g. a pre-market block
+                carry = ticks
+                continue
+            starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+
+        ends = np.r_[starts[1:], len(bucket)] - 1
+        complete = len(starts) if last else len(starts) - 1
+        carry = {column: values[starts[complete]:] for column, values in ticks.items()} if complete < len(starts) else None
+        if carry is not None:
+            ticks = {column: values[:starts[complete]] for column, values in ticks.items()}
+
+        # The close of quotes is the mid price
+        ends = ends[:complete]
+        closes = ticks['price'][ends] if 'price' in ticks else (ticks['bid'][ends] + ticks['ask'][ends]) / 2
+        yield ticks, {
+            'datetime': bucket[starts[:complete]] * NS_PER_MINUTE,
+            'minute': minute[:complete],
+            'close': closes,
+        }
+
+
+def _with_last(chunks: Iterable[Dict[str, np.ndarray]]) -> Iterator[Tuple[Dict[str, np.ndarray], bool]]:
+    """The chunks with whether each is the last one."""
+    chunks = iter(chunks)
+    previous = next(chunks, None)
+    if previous is None:
+        return
+    for chunk in chunks:
+        yield previous, False
+        previous = chunk
+    yield previous, True
+
+
+class ScalperReplay(ScalperLogic):
+    """
+    Replays ticks through the SuperScalper decisions.
+
+    The orders are those the strategy sends to backtrader, including closing
+    the whole position of the data when an entry is closed. Orders are
+    collected per chunk and filled together once its bars are decided, the
+    decisions of the SuperScalper only depend on the closes of the bars.
+    """
+
+    def __init__(self, params: Optional[dict] = None, latency: float = 0.0, journal: Optional[str] = None):
+        # The params as attributes, like backtrader's p
+        self.p = SimpleNamespace(**{**dict(SuperScalper.params._getitems()), **(params or {})})
+        self.latency = int(latency * 1e9)
+        self.journal = Journal(journal, TRADE_COLUMNS) if journal else None
+
+    def run(self, chunks: Iterable[Dict[str, np.ndarray]], startcash: float) -> FastResult:
+        """Replays the chunks of ticks, as read by data.tickfile.read_ticks, from startcash."""
+        self.reset_book()
+        self.startcash = startcash
+        self.entry_size = None
+        self.position = 0.0
+        self.orders: List[Tuple[int, float]] = []  # (time the order is sent in UTC ns, size)
+        self.now = 0
+
+        result = FastResult(params=vars(self.p).copy(), startcash=startcash)
+        alpha = 2.0 / (1.0 + self.p.ema_length)
+        ema, closes = math.nan, []
+        last, ticks = math.nan, 0
+
+        for chunk, bars in minute_bars(chunks):
+            for start, minute, close in zip(bars['datetime'].tolist(), bars['minute'].tolist(), bars['close'].tolist()):
+                # backtrader's EMA, seeded with the average of the first ema_length closes
+                previous = ema
+                if len(closes) < self.p.ema_length:
+                    closes.append(close)
+                    if len(closes) < self.p.ema_length:
+                        continue
+                    ema = math.fsum(closes) / self.p.ema_length
+                else:
+                    ema = ema * (1.0 - alpha) + close * alpha
+
+                self.now = start + NS_PER_MINUTE + self.latency
+                self.price = close
+                self.decide(close, ema >= previous, minute)
+
+            ticks = self.fill(chunk, ticks, result)
+            if len(bars['close']):
+                last = bars['close'][-1]
+
+        if self.journal is not None:
+            self.journal.close()
+        self.ticks = ticks
+        return FastEngine.finish(result, np.array([last]))
+
+    def fill(self, chunk: Dict[str, np.ndarray], offset: int, result: FastResult) -> int:
+        """
+        Fills the pending orders on the first tick of the chunk at or after
+        they were sent, the others stay pending for the next chunk. Returns
+        the index of the first tick of the next chunk.
+        """
+        dt = chunk['datetime']
+        if self.orders and len(dt):
+            sent = np.array([order[0] for order in self.orders], dtype=np.int64)
+            sizes = np.array([order[1] for order in self.orders])
+            at = np.searchsorted(dt, sent)
+            filled = at < len(dt)
+
+            at, size = at[filled], sizes[filled]
+            if 'price' in chunk:
+                prices = chunk['price'][at]
+            else:
+                prices = np.where(size > 0, chunk['ask'][at], chunk['bid'][at])
+            result.executions.extend(
+                Execution(step, size, price) for step, size, price in zip((at + offset).tolist(), size.tolist(), prices.tolist())
+            )
+            self.orders = [order for order, done in zip(self.orders, filled.tolist()) if not done]
+        return offset + len(dt)
+
+    def send(self, size: float) -> None:
+        self.orders.append((self.now, size))
+        self.position += size
+
+    def enter(self, tradeid: int, type: int) -> Any:
+        if self.entry_size is None:
+            # Sized on the cash before the first order, like the strategy
+            self.entry_size = self.startcash / self.price / (self.p.amt_open_trades * self.p.size_security)
+        self.send(type * self.entry_size)
+
+    def leave(self, tradeid: int, entry: Entry, dayClose: bool) -> None:
+        if dayClose:
+            self.send(-entry.type * self.entry_size)
+        elif self.position:
+            # backtrader's close(tradeid=...) closes the whole position of the data
+            self.send(-self.position)
+
+    def record(self, trade: Trade) -> None:
+        if self.journal is not None:
+            self.journal.append(trade)
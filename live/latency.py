@@ -0,0 +1,220 @@
+"""
+Latency instrumentation of live trading.
+
+Every live bar is timestamped when its feed delivers it, when the strategy's
+next() with its indicators has run, when an order call returns from the
+broker and when the broker acknowledges and fills the order. The latencies
+between these stages are recorded in log-bucketed histograms of constant
+size, so a session of any length costs the same memory and a few hundred
+nanoseconds per sample. Percentiles are reported periodically and the
+histograms can be exported when the session ends.
+
+The feeds are also watched for backlog: when bars queue up faster than the
+strategy processes them, an alert is printed until the queue is drained.
+"""
+import bisect
+import csv
+import time
+from typing import Dict, List, Optional
+
+import backtrader as bt
+import numpy as np
+
+# Latency stages, each measured from the stage before
+STAGES = {
+    'decision': 'bar received until next() returned',
+    'submit': 'order call until the broker returned it',
+    'ack': 'order sent until accepted by the broker',
+    'fill': 'order sent until filled',
+}
+
+# Upper bounds of the histogram buckets in ns, 5% apart from 1 microsecond to 100 seconds
+BOUNDS: List[int] = [int(bound) for bound in np.geomspace(1e3, 1e11, int(np.log(1e8) / np.log(1.05)) + 1)]
+
+
+class Histogram:
+    """Latencies in buckets which are 5% wide, percentiles are exact to the width of a bucket."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.max = 0
+
+    def record(self, ns: int) -> None:
+        self.counts[bisect.bisect_left(BOUNDS, ns)] += 1
+        self.count += 1
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, q: float) -> Optional[int]:
+        """The upper bound in ns of the bucket holding the q-th percentile, None without samples."""
+        if not self.count:
+            return None
+
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BOUNDS[bucket], self.max) if bucket < len(BOUNDS) else self.max
+        return self.max
+
+
+class LatencyMonitor:
+    """
+    Collects the stage timestamps of a live session.
+
+    backlog is the number of bars queued in a feed at which an alert is
+    printed, report the seconds between the percentile reports.
+    """
+
+    def __init__(self, backlog: int = 2, report: float = 60.0):
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.backlog = backlog
+        self.report_every = report
+        self.reported = time.monotonic()
+
+        self.received: Optional[int] = None  # perf_counter_ns of the last live bar not yet decided on
+        self.sent: Dict[int, int] = {}  # order ref -> perf_counter_ns the order was sent
+        self.behind: Dict[str, int] = {}  # feed -> bars queued at the last backlog alert
+        self.max_backlog = 0
+
+    def receive(self, data: bt.feed.DataBase) -> None:
+        # Bars of the backfill are loaded as fast as possible and are not live
+        if data._laststatus != data.LIVE:
+            return
+
+        self.received = time.perf_counter_ns()
+
+        queue = getattr(data, 'qlive', None)
+        queued = queue.qsize() if queue is not None else 0
+        self.max_backlog = max(self.max_backlog, queued)
+
+        name = data._name or data.p.dataname
+        # Alert when the backlog is reached and again whenever it doubled since the last alert
+        if queued >= max(self.backlog, 2 * self.behind.get(name, 0)):
+            print(f'WARNING: {name} is {queued} bars behind, the strategy is slower than the market data')
+            self.behind[name] = queued
+        elif not queued and name in self.behind:
+            print(f'{name} caught up')
+            del self.behind[name]
+
+    def decided(self) -> None:
+        now = time.perf_counter_ns()
+        if self.received is not None:
+            self.histograms['decision'].record(now - self.received)
+            self.received = None
+
+        if time.monotonic() - self.reported >= self.report_every:
+            self.print_report()
+
+    def submitted(self, order: bt.Order, started: int) -> None:
+        now = time.perf_counter_ns()
+        self.histograms['submit'].record(now - started)
+        self.sent[order.ref] = now
+
+    def notified(self, order: bt.Order) -> None:
+        sent = self.sent.get(order.ref)
+        if sent is None:
+            return
+
+        now = time.perf_counter_ns()
+        if order.status == order.Accepted:
+            self.histograms['ack'].record(now - sent)
+        elif order.status == order.Completed:
+            self.histograms['fill'].record(now - sent)
+        if not order.alive():
+            del self.sent[order.ref]
+
+    def summary(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """Count and p50, p99 and max in milliseconds of every stage."""
+        return {
+            stage: {
+                'count': histogram.count,
+                'p50': _ms(histogram.percentile(50)),
+                'p99': _ms(histogram.percentile(99)),
+                'max': _ms(histogram.max if histogram.count else None),
+            }
+            for stage, histogram in self.histograms.items()
+        }
+
+    def print_report(self) -> None:
+        self.reported = time.monotonic()
+        stages = ', '.join(
+            f'{stage} {latency["p50"]:.2f}/{latency["p99"]:.2f}'
+            for stage, latency in self.summary().items() if latency['count']
+        )
+        print(f'Latency p50/p99 in ms: {stages or "no live bars yet"}, max backlog {self.max_backlog} bars')
+
+    def export(self, path: str) -> None:
+        """Writes the non-empty buckets of every histogram as CSV, the bounds in milliseconds."""
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'upper_ms', 'count'])
+            for stage, histogram in self.histograms.items():
+                for bucket, count in enumerate(histogram.counts):
+                    if count:
+                        bound = BOUNDS[bucket] if bucket < len(BOUNDS) else histogram.max
+                        writer.writerow([stage, _ms(bound), count])
+
+
+class Received:
+    """Data filter which timestamps every bar of its feed as it is loaded, it never removes a bar."""
+
+    def __init__(self, data: bt.feed.DataBase, monitor: LatencyMonitor):
+        self.monitor = monitor
+
+    def __call__(self, data: bt.feed.DataBase) -> bool:
+        self.monitor.receive(data)
+        return False
+
+
+class Latency(bt.Analyzer):
+    """
+    Timestamps the decisions and orders of its strategy. The analyzers of a
+    strategy run right after its next(), the order calls of the broker are
+    wrapped to time them.
+    """
+    params = (('monitor', None),)
+
+    def start(self):
+        broker = self.strategy.broker
+        for name in ('buy', 'sell'):
+            call = getattr(broker, name)
+            if not getattr(call, 'timed', False):
+                setattr(broker, name, _timed(call, self.p.monitor))
+
+    def next(self):
+        self.p.monitor.decided()
+
+    def notify_order(self, order):
+        self.p.monitor.notified(order)
+
+    def stop(self):
+        self.p.monitor.print_report()
+
+    def get_analysis(self):
+        return self.p.monitor.summary()
+
+
+def instrument(cerebro: bt.Cerebro, monitor: LatencyMonitor) -> None:
+    """Adds the latency instrumentation to the feeds and strategies of the Cerebro."""
+    for data in cerebro.datas:
+        data.addfilter(Received, monitor)
+    cerebro.addanalyzer(Latency, _name='latency', monitor=monitor)
+
+
+def _timed(call, monitor: LatencyMonitor):
+    def timed(*args, **kwargs):
+        started = time.perf_counter_ns()
+        order = call(*args, **kwargs)
+        if order is not None:
+            monitor.submitted(order, started)
+        return order
+
+    timed.timed = True
+    return timed
+
+
+def _ms(ns: Optional[int]) -> Optional[float]:
+    return None if ns is None else ns / 1e6
@@ -0,0 +1,394 @@
+"""
+Several strategies trading live in one process.
+
+Every strategy runs as a sleeve: its own Cerebro in its own thread, with an
+isolated share of the capital in a SleeveBroker and optional risk limits.
+The feeds all sleeves need are deduplicated by ticker, timeframe and
+compression and streamed only once, by a source Cerebro whose Fanout
+strategy hands every new bar to the sleeves subscribed to its feed. The
+source waits until every sleeve has decided on the bars of a step, then the
+OrderRouter nets the positions and market orders of all sleeves per symbol
+and sends only the change of the net position to the broker, one order per
+symbol and step.
+
+The sleeve brokers fill the orders of their strategies like a backtest, the
+book of every strategy is kept there. The broker account holds the sum of
+all sleeves: market orders are routed as soon as they are placed, limit
+and stop orders once a sleeve filled them.
+"""
+import queue
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import backtrader as bt
+
+from backtest import create_cerebro
+from live.latency import LatencyMonitor, instrument
+from strategies.customStrategy import BaseStrategy
+
+# (ticker, timeframe, compression) of a feed, the feeds of all sleeves are deduplicated by it
+FeedKey = Tuple[str, int, int]
+
+# execute(symbol, size, price) sends a market order for size, negative to sell, to the broker.
+# price is the last close of the symbol, for simulated executions
+Execute = Callable[[str, float, float], None]
+
+# Lines of a bar in the order the Fanout hands them to the sleeves
+BAR_LINES = ('datetime', 'open', 'high', 'low', 'close', 'volume', 'openinterest')
+
+# Alpaca accepts fractional quantities with up to 9 decimals
+SIZE_DECIMALS = 9
+
+# Seconds the source waits for a sleeve to decide on a step before it warns about it
+STEP_TIMEOUT = 30.0
+
+# Sent to the inbox of a sleeve when the stream ended
+CLOSED = object()
+
+
+def feed_key(spec: dict) -> FeedKey:
+    return spec['dataname'], spec['timeframe'], spec['compression']
+
+
+def alpaca_execution(store) -> Execute:
+    """Returns an execution which sends market orders through the REST API of an AlpacaStore."""
+
+    def execute(symbol, size, price):
+        store.oapi.submit_order(
+            symbol=symbol,
+            qty=abs(size),
+            side='buy' if size > 0 else 'sell',
+            type='market',
+            time_in_force='day'
+        )
+        print(f'Sent {"buy" if size > 0 else "sell"} of {abs(size)} {symbol}')
+
+    return execute
+
+
+class SimulatedExecution:
+    """Fills the net orders at the last close of the symbol instead of sending them, for --simulate."""
+
+    def __init__(self):
+        self.fills: List[Tuple[str, float, float]] = []  # (symbol, size, price)
+
+    def __call__(self, symbol: str, size: float, price: float) -> None:
+        self.fills.append((symbol, size, price))
+
+    @property
+    def positions(self) -> Dict[str, float]:
+        positions = defaultdict(float)
+        for symbol, size, _ in self.fills:
+            positions[symbol] += size
+        return dict(positions)
+
+
+class Inbox:
+    """
+    The bars of one sleeve. The Fanout puts the bars of every step as one
+    batch, the feeds of the sleeve take their bar of the batch and the sleeve
+    acknowledges the step once its strategy decided on it. The next batch is
+    only taken after that, so the feeds without a bar in a step never wait
+    for one or take the bars of the next step.
+    """
+
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue()
+        self.batch: Dict[FeedKey, tuple] = {}
+        self.ready = True  # the last batch was decided on
+        self.closed = False
+        self.acks = threading.Semaphore(0)
+
+    def take(self, key: FeedKey, timeout: Optional[float]) -> Any:
+        """The bar of the feed in the current batch, None without one and CLOSED once the stream ended."""
+        if key in self.batch:
+            return self.batch.pop(key)
+        if self.closed:
+            return CLOSED
+        if self.batch or not self.ready:
+            return None
+
+        try:
+            batch = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if batch is CLOSED:
+            self.closed = True
+            return CLOSED
+
+        self.batch, self.ready = batch, False
+        return self.batch.pop(key, None)
+
+    def pending(self, key: FeedKey) -> bool:
+        return key in self.batch or not self.queue.empty()
+
+    def stepped(self) -> None:
+        # A step whose bars were held back by the Cerebro is delivered later, it is not acknowledged again
+        if not self.ready:
+            self.ready = True
+            self.acks.release()
+
+
+class HubData(bt.feed.DataBase):
+    """A live feed of a sleeve, taking the bars of one shared feed from the inbox of the sleeve."""
+    params = (
+        ('inbox', None),
+        ('key', None),  # FeedKey of the shared feed
+        ('qcheck', 0.5),
+    )
+
+    def islive(self):
+        return True
+
+    def haslivedata(self):
+        return self.p.inbox.pending(self.p.key)
+
+    def _load(self):
+        bar = self.p.inbox.take(self.p.key, self._qcheck)
+        if bar is None:
+            return None
+        if bar is CLOSED:
+            return False
+
+        live, values = bar
+        if live and self._laststatus != self.LIVE:
+            self.put_notification(self.LIVE)
+        for name, value in zip(BAR_LINES, values):
+            getattr(self.lines, name)[0] = value
+        return True
+
+
+class SleeveBroker(bt.brokers.BackBroker):
+    """
+    The isolated book of one strategy. Orders are rejected on feeds which
+    do not stream live bars yet, so the bars of a backfill warm up the
+    indicators without trading, and once the sleeve is halted, except those
+    which reduce a position.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.halted = False
+
+    def submit(self, order, check=True):
+        data = order.data
+        position = self.getposition(data).size
+        reducing = position * order.size < 0 and abs(order.size) <= abs(position)
+        if data._laststatus != data.LIVE or (self.halted and not reducing):
+            order.reject(self)
+            self.notify(order)
+            return order
+        return super().submit(order, check)
+
+    def targets(self) -> Dict[str, float]:
+        """The size every symbol of the sleeve holds plus its open market orders."""
+        targets = defaultdict(float)
+        for data, position in self.positions.items():
+            targets[data.p.dataname] += position.size
+
+        orders = {order.ref: order for order in (*self.submitted, *self.pending)}
+        for order in orders.values():
+            if order.exectype == bt.Order.Market and order.alive():
+                targets[order.data.p.dataname] += order.executed.remsize
+        return targets
+
+
+class SleeveMonitor(bt.Analyzer):
+    """
+    Runs after every step of a sleeve: halts the sleeve and closes its
+    positions once it lost max_drawdown of its peak value, hands its
+    targets to the router and acknowledges the step.
+    """
+    params = (
+        ('sleeve', None),
+        ('router', None),
+    )
+
+    def start(self):
+        self.peak = self.strategy.broker.getvalue()
+
+    def next(self):
+        sleeve, broker = self.p.sleeve, self.strategy.broker
+        value = broker.getvalue()
+        self.peak = max(self.peak, value)
+        if sleeve.max_drawdown is not None and not broker.halted and value < self.peak * (1 - sleeve.max_drawdown):
+            print(f'{sleeve.name} is {1 - value / self.peak:.1%} below its peak of ${self.peak:,.2f}, '
+                  f'halting it and closing its positions')
+            broker.halted = True
+            for order in broker.get_orders_open():
+                broker.cancel(order)
+            for data in self.strategy.datas:
+                if broker.getposition(data).size:
+                    self.strategy.close(data=data)
+
+        self.p.router.update(sleeve.name, broker.targets())
+        sleeve.inbox.stepped()
+
+
+class OrderRouter:
+    """
+    Nets the targets of all sleeves per symbol. Only the change of the net
+    position of a symbol since the last flush is sent to the broker, so
+    opposite orders of two sleeves cancel out instead of both being traded.
+    """
+
+    def __init__(self, execute: Execute):
+        self.execute = execute
+        self.targets: Dict[str, Dict[str, float]] = defaultdict(dict)  # symbol -> sleeve -> size
+        self.net: Dict[str, float] = defaultdict(float)  # symbol -> size held at the broker
+        self.lock = threading.Lock()
+
+        # Changes of the sleeve targets and the orders they were netted into
+        self.sleeve_orders = 0
+        self.sleeve_volume = 0.0
+        self.orders = 0
+        self.volume = 0.0
+
+    def update(self, sleeve: str, targets: Dict[str, float]) -> None:
+        with self.lock:
+            for symbol, size in targets.items():
+                change = size - self.targets[symbol].get(sleeve, 0.0)
+                if round(change, SIZE_DECIMALS):
+                    self.sleeve_orders += 1
+                    self.sleeve_volume += abs(change)
+                self.targets[symbol][sleeve] = size
+
+    def flush(self, prices: Dict[str, float]) -> None:
+        with self.lock:
+            for symbol, sizes in self.targets.items():
+                size = round(sum(sizes.values()) - self.net[symbol], SIZE_DECIMALS)
+                if not size:
+                    continue
+                self.execute(symbol, size, prices.get(symbol))
+                self.net[symbol] += size
+                self.orders += 1
+                self.volume += abs(size)
+
+
+@dataclass(eq=False)
+class Sleeve:
+    name: str
+    strategy: Type[BaseStrategy]
+    specs: List[dict]  # CachedData parameters of the feeds of the strategy, in its order
+    cash: float
+    max_drawdown: Optional[float] = None  # fraction of the peak value
+    inbox: Inbox = field(default_factory=Inbox)
+    monitor: LatencyMonitor = field(default_factory=LatencyMonitor)
+    cerebro: Optional[bt.Cerebro] = None
+    thread: Optional[threading.Thread] = None
+    result: Optional[bt.Strategy] = None
+    error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        try:
+            self.result = self.cerebro.run()[0]
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            # A sleeve which stopped never acknowledges again
+            self.inbox.acks.release()
+
+
+class Fanout(bt.Strategy):
+    """
+    The strategy of the source Cerebro. Hands the new bars of every step to
+    the sleeves subscribed to their feeds, waits until all of them decided on
+    the step and flushes the router.
+    """
+    params = (
+        ('runner', None),
+    )
+
+    def start(self):
+        self.lengths = [0] * len(self.datas)
+        self.bars = 0
+
+    def prenext(self):
+        self.next()
+
+    def next(self):
+        runner = self.p.runner
+        batches = defaultdict(dict)
+        prices = {}
+        for i, (data, key) in enumerate(zip(self.datas, runner.keys)):
+            if len(data) == self.lengths[i]:
+                continue
+            self.lengths[i] = len(data)
+            self.bars += 1
+
+            live = not data.islive() or data._laststatus == data.LIVE
+            bar = live, tuple(getattr(data.lines, name)[0] for name in BAR_LINES)
+            for sleeve in runner.subscribers[key]:
+                batches[sleeve.name][key] = bar
+            prices[key[0]] = bar[1][BAR_LINES.index('close')]
+
+        waiting = [sleeve for sleeve in runner.running() if sleeve.name in batches]
+        for sleeve in waiting:
+            sleeve.inbox.queue.put(batches[sleeve.name])
+        for sleeve in waiting:
+            while not sleeve.inbox.acks.acquire(timeout=STEP_TIMEOUT):
+                print(f'WARNING: {sleeve.name} did not decide on the bars of {self.datetime.datetime()} '
+                      f'within {STEP_TIMEOUT:.0f}s')
+
+        runner.router.flush(prices)
+
+
+class LiveRunner:
+    """Runs the sleeves on one deduplicated stream of the feeds they need."""
+
+    def __init__(self, router: OrderRouter, analytics: str = 'backtrader'):
+        self.router = router
+        self.analytics = analytics
+        self.sleeves: List[Sleeve] = []
+        self.keys: List[FeedKey] = []  # the shared feeds, in the order of the source Cerebro
+        self.specs: List[dict] = []
+        self.subscribers: Dict[FeedKey, List[Sleeve]] = defaultdict(list)
+
+    def add(self, sleeve: Sleeve) -> None:
+        cerebro = create_cerebro(sleeve.cash, self.analytics, broker=SleeveBroker())
+        sleeve.strategy.addStrategyToCerebro(cerebro)
+        for spec in sleeve.specs:
+            key = feed_key(spec)
+            if key not in self.subscribers:
+                self.keys.append(key)
+                self.specs.append(spec)
+            if sleeve not in self.subscribers[key]:
+                self.subscribers[key].append(sleeve)
+            cerebro.adddata(HubData(
+                dataname=spec['dataname'],
+                timeframe=spec['timeframe'],
+                compression=spec['compression'],
+                tz=spec.get('tz'),
+                inbox=sleeve.inbox,
+                key=key
+            ))
+        cerebro.addanalyzer(SleeveMonitor, _name='sleeve', sleeve=sleeve, router=self.router)
+        instrument(cerebro, sleeve.monitor)
+
+        sleeve.cerebro = cerebro
+        self.sleeves.append(sleeve)
+
+    def running(self) -> List[Sleeve]:
+        return [sleeve for sleeve in self.sleeves if sleeve.thread.is_alive()]
+
+    def run(self, source: bt.Cerebro) -> List[Sleeve]:
+        """
+        Streams the datas of the source Cerebro, one for every key in
+        order, to the sleeves until the source ends or is interrupted.
+        """
+        for sleeve in self.sleeves:
+            sleeve.thread = threading.Thread(target=sleeve.run, name=sleeve.name, daemon=True)
+            sleeve.thread.start()
+
+        source.addstrategy(Fanout, runner=self)
+        try:
+            source.run(stdstats=False)
+        finally:
+            for sleeve in self.sleeves:
+                sleeve.inbox.queue.put(CLOSED)
+            for sleeve in self.sleeves:
+                sleeve.thread.join()
+        return self.sleeves
@@ -0,0 +1,169 @@
+"""
+Warm-up of live trading from the local bar cache.
+
+A strategy only trades once every indicator has its minimum period of bars.
+Instead of backfilling months of bars from Alpaca at every start, the bars
+every feed needs are taken from the BarCache, which only downloads what
+it is missing, usually the bars of today so far. The live feeds load these
+bars first and then stream, so a restart in the middle of a session trades
+on the next bar.
+
+The minimum periods are measured by building the strategy on empty feeds,
+exactly like backtrader computes them before a run.
+"""
+import math
+from typing import Dict, List, Optional, Tuple, Type
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from data.barcache import COLUMNS, EXCHANGE_TZ, NS_PER_DAY, BarCache, CachedData, to_num
+from data.resample import NS_PER_MINUTE, SESSION_END, SESSION_START
+
+# Bars loaded per bar of minimum period. Exponential averages, like the EMA,
+# RSI and ATR, depend on every bar since their seed, after three periods the
+# weight of the seed is down to a few percent
+WARMUP_FACTOR = 3
+
+# Trading days of a bar of each timeframe from Days up
+TRADING_DAYS = {
+    bt.TimeFrame.Days: 1,
+    bt.TimeFrame.Weeks: 5,
+    bt.TimeFrame.Months: 21,
+    bt.TimeFrame.Years: 252,
+}
+
+# Length of a bar of each timeframe up to Days in ns, times its compression
+BAR_NS = {
+    bt.TimeFrame.Seconds: 1_000_000_000,
+    bt.TimeFrame.Minutes: NS_PER_MINUTE,
+    bt.TimeFrame.Days: NS_PER_DAY,
+}
+
+
+class _Measured(Exception):
+    def __init__(self, periods: List[int]):
+        super().__init__()
+        self.periods = periods
+
+
+class _MinPeriods(bt.Analyzer):
+    """Stops the run before the first bar with the minimum periods of the datas of its strategy."""
+
+    def start(self):
+        raise _Measured(list(self.strategy._minperiods))
+
+
+def minimum_periods(strategy: Type[bt.Strategy], specs: List[dict], params: Optional[dict] = None) -> List[int]:
+    """
+    The bars every feed of specs needs before the strategy's next() is
+    called, in the order of specs, with its default params or params.
+    """
+    cerebro = bt.Cerebro(maxcpus=1)
+    strategy.addStrategyToCerebro(cerebro)
+    if params is not None:
+        cerebro.strats = [[(strategy, (), params)]]
+    empty = {'datetime': np.empty(0, dtype=np.int64), **{column: np.empty(0) for column in COLUMNS}}
+    for spec in specs:
+        cerebro.adddata(CachedData(
+            dataname=spec['dataname'],
+            bars=empty,
+            timeframe=spec['timeframe'],
+            compression=spec['compression'],
+            tz=spec.get('tz')
+        ))
+    cerebro.addanalyzer(_MinPeriods)
+
+    # Without preloading the strategy builds the backtrader indicators, like live
+    try:
+        cerebro.run(preload=False, runonce=False, stdstats=False)
+    except _Measured as measured:
+        return measured.periods
+    raise RuntimeError(f'{strategy.__name__} was not started')
+
+
+def warmup_start(timeframe: int, compression: int, bars: int, end: pd.Timestamp) -> pd.Timestamp:
+    """A start before end from which there are at least bars bars of the timeframe, counting exchange holidays."""
+    if timeframe < bt.TimeFrame.Days:
+        minutes = compression if timeframe == bt.TimeFrame.Minutes else compression / 60
+        days = math.ceil(bars * minutes / (SESSION_END - SESSION_START))
+    else:
+        days = bars * compression * TRADING_DAYS[timeframe]
+    # Up to 10 exchange holidays a year and the day of end itself
+    days += math.ceil(days / 25) + 1
+    return (_exchange(end) - pd.offsets.BDay(days)).normalize()
+
+
+def bar_start(timeframe: int, compression: int, dt) -> pd.Timestamp:
+    """
+    The start of the bar of the timeframe dt falls into. Bars are labeled
+    with their start from midnight exchange time, like data.resample.
+    """
+    ts = _exchange(dt)
+    if timeframe == bt.TimeFrame.Weeks:
+        return ts.normalize() - pd.Timedelta(days=ts.weekday())
+    if timeframe == bt.TimeFrame.Months:
+        return ts.normalize().replace(day=1)
+    if timeframe == bt.TimeFrame.Years:
+        return ts.normalize().replace(month=1, day=1)
+
+    period = BAR_NS[timeframe] * compression
+    local = ts.tz_localize(None).value
+    return pd.Timestamp(local - local % period).tz_localize(EXCHANGE_TZ)
+
+
+def warmup_bars(
+    cache: BarCache,
+    spec: dict,
+    bars: int,
+    end,
+    base: Optional[Tuple[int, int]] = None
+) -> Dict[str, np.ndarray]:
+    """
+    The last bars bars of the feed of spec completed before end, from the
+    cache. The bar still forming at end is left to the stream.
+    """
+    timeframe, compression = spec['timeframe'], spec['compression']
+    end = bar_start(timeframe, compression, end)
+    columns = cache.getbars(
+        spec['dataname'],
+        timeframe,
+        compression,
+        warmup_start(timeframe, compression, bars, end).to_pydatetime(),
+        end.to_pydatetime(),
+        sessionfilter=timeframe < bt.TimeFrame.Days,
+        base=base
+    )
+    return {column: values[-bars:] if bars else values[:0] for column, values in columns.items()}
+
+
+class SimulatedData(CachedData):
+    """
+    Streams cached bars like a live feed for --simulate: the bars before
+    live_from as the backfill, which is not traded, the others as live bars.
+    """
+    params = (
+        ('live_from', None),  # UTC ns of the first live bar
+    )
+
+    def islive(self):
+        return True
+
+    def start(self):
+        super().start()
+        self._live_from = to_num(np.int64(self.p.live_from))
+
+    def _load(self):
+        if not super()._load():
+            return False
+
+        status = self.LIVE if self.lines.datetime[0] >= self._live_from else self.DELAYED
+        if status != self._laststatus:
+            self.put_notification(status)
+        return True
+
+
+def _exchange(dt) -> pd.Timestamp:
+    ts = pd.Timestamp(dt)
+    return ts.tz_localize(EXCHANGE_TZ) if ts.tzinfo is None else ts.tz_convert(EXCHANGE_TZ)
@@ -1,193 +1,795 @@
-from datetime import datetime, time
-from typing import Dict
-
-import alpaca_backtrader_api as alpaca
-import backtrader as bt
-import pandas as pd
-from pytz import timezone
-
-from settings import ALPACA_KEY_ID, ALPACA_SECRET_KEY, parse_args
-from strategies.customStrategy import BaseStrategy
-from strategies.RSIStack import RSIStack
-from strategies.Slingshot import Slingshot
-from strategies.SuperScalper import SuperScalper
-
-strategies: Dict[str, BaseStrategy] = {
-    'RSIStack': RSIStack,
-    'SuperScalper': SuperScalper,
-    'Slingshot': Slingshot
+from __future__ import annotations
+
+import glob
+import importlib
+import os
+import random
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Type
+
+from settings import ALPACA_DATA_URL, ALPACA_KEY_ID, ALPACA_RATE_LIMIT, ALPACA_SECRET_KEY, BAR_CACHE_DIR, parse_args
+
+# Only the settings are imported before the arguments are parsed, every other module is
+# imported by the code path which needs it: --help returns right away, backtests on the bar
+# cache never load the Alpaca client and only downloads load aiohttp
+if TYPE_CHECKING:
+    import alpaca_backtrader_api as alpaca
+    import backtrader as bt
+    import numpy as np
+
+    from data.barcache import BarCache
+    from engine.profiler import Profiler
+    from optimization.search import Budget, Objective, Search
+    from optimization.space import ParameterSpace
+    from results import ResultStore
+    from strategies.customStrategy import BaseStrategy
+
+# Strategy name -> module of the strategy class of the same name
+strategies: Dict[str, str] = {
+    'RSIStack': 'strategies.RSIStack',
+    'SuperScalper': 'strategies.SuperScalper',
+    'Slingshot': 'strategies.Slingshot'
 }
 
-args = parse_args(strategies.keys())
 
-strategy = strategies[args.strategy]
+def load_strategy(name: str) -> Type[BaseStrategy]:
+    """Imports the strategy class of the registry, only the selected strategy is loaded."""
+    return getattr(importlib.import_module(strategies[name]), name)
 
-tickers = args.tickers if args.tickers else ['AAPL']
 
-fromdate = datetime.strptime(args.fromDate, '%Y-%m-%d')
-todate = datetime.strptime(args.toDate, '%Y-%m-%d')
+# Days at the start of the range on which the fast engine is checked against backtrader,
+# long enough for the 50 day warm-up of Slingshot
+CONSISTENCY_CHECK_DAYS = 120
 
-PAPER_TRADING = not args.live
+# Number of best runs printed after a backtest or optimization
+RANKING_SIZE = 20
 
+# Bars queued in a live feed at which a backlog alert is printed
+LATENCY_BACKLOG_BARS = 2
 
-def setup_cerebro() -> bt.Cerebro:
-    cerebro = bt.Cerebro(maxcpus=1)
+# Seconds between the latency reports of a live session
+LATENCY_REPORT_SECONDS = 60
 
-    cerebro.broker.setcash(args.startcash)
-    cerebro.broker.setcommission(commission=0.001)
+# Bars of every feed in the first rung of --search halving per bar of the
+# minimum period of the longest indicators, the rest of the rung trades
+HALVING_PERIODS = 2
 
-    # TODO check this for live trading
-    cerebro.addsizer(bt.sizers.PercentSizer, percents=95)
+# Settings of an optimization which must be the same to resume its results
+RESUME_SETTINGS = (
+    'strategy', 'tickers', 'fromDate', 'toDate', 'startcash', 'resample', 'engine', 'search', 'seed', 'analytics', 'compact'
+)
 
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
-    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trades')
-    cerebro.addanalyzer(bt.analyzers.SQN, _name='SQN')
-    cerebro.addanalyzer(bt.analyzers.PeriodStats,
-                        _name='period', timeframe=bt.TimeFrame.Days)
 
-    store = alpaca.AlpacaStore(
+@lru_cache(maxsize=None)
+def setup_store() -> alpaca.AlpacaStore:
+    """The AlpacaStore, created on first use. Backtests on the bar cache never need it."""
+    import alpaca_backtrader_api as alpaca
+
+    return alpaca.AlpacaStore(
         key_id=ALPACA_KEY_ID,
         secret_key=ALPACA_SECRET_KEY,
         paper=PAPER_TRADING
     )
 
-    if not PAPER_TRADING:
-        print(f"LIVE TRADING")
-        broker = store.getbroker()
-        cerebro.setbroker(broker)
 
-    if PAPER_TRADING and args.optimize:
-        strategy.addOptimizerToCerebro(cerebro)
-    else:
-        strategy.addStrategyToCerebro(cerebro)
+def setup_cache() -> Optional[BarCache]:
+    # Live trading warms up from the cache
+    if args.no_cache:
+        return None
+
+    from data.barcache import BarCache, alpaca_fetcher
 
-    DataFactory = store.getdata
+    def fetch(*request):
+        # Only ranges the bulk download left missing are fetched through the store
+        return alpaca_fetcher(setup_store())(*request)
 
+    return BarCache(
+        BAR_CACHE_DIR,
+        fetcher=None if args.offline else fetch
+    )
+
+
+def resample_base() -> Optional[Tuple[int, int]]:
+    """The timeframe to load once per ticker and derive every timeframe from with --resample."""
+    import backtrader as bt
+
+    if not args.resample:
+        return None
+
+    # The strategies of --with are streamed from the same cache
+    classes = [strategy, *(load_strategy(name) for name in args.with_strategies)]
+    intraday = any(timeframe < bt.TimeFrame.Days for cls in classes for _, timeframe in cls.timeframes.values())
+    return (bt.TimeFrame.Minutes, 1) if intraday else (bt.TimeFrame.Days, 1)
+
+
+def feed_specs(cls: Optional[Type[BaseStrategy]] = None) -> List[dict]:
+    """The parameters of every data feed, in the order the strategy, or the given one, expects them."""
+    from pytz import timezone
+
+    specs = []
     for ticker in tickers:
-        for name, (minutes, timeframe) in strategy.timeframes.items():
+        for name, (minutes, timeframe) in (cls or strategy).timeframes.items():
             print(f'Adding ticker {ticker} using timeframe at {name}.')
 
-            d = DataFactory(
+            specs.append(dict(
                 dataname=ticker,
                 timeframe=timeframe,
                 compression=minutes,
                 fromdate=fromdate,
                 todate=todate,
-                historical=True,
                 tz=timezone('US/Eastern')
-            )
+            ))
 
-            if timeframe < bt.TimeFrame.Days:
-                d.addfilter(bt.filters.SessionFilter)
+    return specs
 
-            cerebro.adddata(d)
 
-    return cerebro
+def download_bars(cache: BarCache, specs: List[dict]) -> None:
+    """Downloads the bars missing in the cache for all feeds concurrently, before they are loaded one by one."""
+    import backtrader as bt
+
+    if args.offline:
+        return
+
+    feeds = []
+    for spec in specs:
+        timeframe, compression = resample_base() or (spec['timeframe'], spec['compression'])
+        feeds.append((spec['dataname'], timeframe, compression, timeframe < bt.TimeFrame.Days))
+
+    # The downloader and aiohttp are only imported when something is missing
+    if not any(cache.missing(ticker, timeframe, compression, fromdate, todate, sessionfilter)
+               for ticker, timeframe, compression, sessionfilter in feeds):
+        return
+
+    from data.downloader import BulkDownloader, Job
+
+    jobs = [Job(*feed, fromdate, todate) for feed in feeds]
+
+    downloader = BulkDownloader(
+        cache,
+        ALPACA_KEY_ID,
+        ALPACA_SECRET_KEY,
+        base_url=ALPACA_DATA_URL,
+        connections=args.connections,
+        rate_limit=ALPACA_RATE_LIMIT
+    )
+    downloader.download(jobs)
+
+
+def setup_cerebro(cache: Optional[BarCache]) -> bt.Cerebro:
+    import backtrader as bt
+
+    from backtest import add_feed, create_cerebro
+
+    cerebro = create_cerebro(args.startcash, args.analytics)
+
+    if not PAPER_TRADING:
+        print(f"LIVE TRADING")
+        broker = setup_store().getbroker()
+        cerebro.setbroker(broker)
+
+    if PAPER_TRADING and args.optimize:
+        strategy.addOptimizerToCerebro(cerebro)
+    else:
+        strategy.addStrategyToCerebro(cerebro)
 
+    specs = feed_specs()
+    if cache and PAPER_TRADING:
+        download_bars(cache, specs)
+    if cache and not PAPER_TRADING:
+        warmups = warmup_feeds(cache, specs, strategy.warmupBars(specs))
+    else:
+        warmups = [None] * len(specs)
+
+    for spec, warmup in zip(specs, warmups):
+        if cache and PAPER_TRADING:
+            d = cache.getdata(
+                **spec,
+                sessionfilter=spec['timeframe'] < bt.TimeFrame.Days,
+                base=resample_base(),
+                compact=args.compact
+            )
+        elif PAPER_TRADING:
+            d = setup_store().getdata(**spec, historical=True)
+        else:
+            d = live_feed(spec, warmup)
 
-def analyze_results(runs) -> None:
-    print("Final Portfolio Value: %.2f" % cerebro.broker.getvalue())
+        add_feed(cerebro, d)
 
-    if args.optimize:
-        runs = [run[0] for run in runs]
+    return cerebro
 
-    data = []
-    for run in runs:
-        run_data = []
 
-        run_data.append(
-            ';'.join([f'{k}: {v}' for k, v in run.p.__dict__.items()])
+def warmup_feeds(cache: BarCache, specs: List[dict], lookbacks: List[int]) -> List[bt.feed.DataBase]:
+    """Feeds of the last completed bars every live feed needs to warm up the indicators, from the bar cache."""
+    import pandas as pd
+
+    from data.barcache import EXCHANGE_TZ, CachedData
+    from live.warmup import warmup_bars
+
+    started = time.perf_counter()
+    now = pd.Timestamp.now(tz=EXCHANGE_TZ)
+    feeds, loaded = [], 0
+    for spec, bars in zip(specs, lookbacks):
+        columns = warmup_bars(cache, spec, bars, now, resample_base())
+        loaded += len(columns['datetime'])
+        if len(columns['datetime']) < bars:
+            print(f'WARNING: only {len(columns["datetime"])} of the {bars} bars to warm up {spec["dataname"]} are cached')
+        feeds.append(CachedData(
+            dataname=spec['dataname'],
+            bars=columns,
+            timeframe=spec['timeframe'],
+            compression=spec['compression'],
+            tz=spec['tz']
+        ))
+    print(f'Warmed up {len(specs)} feeds with {loaded} bars of the bar cache in {time.perf_counter() - started:.1f}s')
+    return feeds
+
+
+def live_feed(spec: dict, warmup: Optional[bt.feed.DataBase]) -> bt.feed.DataBase:
+    """
+    A feed streaming live bars after the bars of warmup, without warm-up
+    after backfilling from fromdate. todate would drop every bar of today.
+    """
+    if warmup is None:
+        return setup_store().getdata(**{**spec, 'todate': None}, historical=False, backfill_start=True)
+    return setup_store().getdata(**{**spec, 'todate': None}, historical=False, backfill_start=False, backfill_from=warmup)
+
+
+def load_bars(cache: BarCache, specs: List[dict]) -> List[Dict[str, np.ndarray]]:
+    import backtrader as bt
+
+    download_bars(cache, specs)
+    return [
+        cache.getbars(
+            spec['dataname'],
+            spec['timeframe'],
+            spec['compression'],
+            fromdate,
+            todate,
+            sessionfilter=spec['timeframe'] < bt.TimeFrame.Days,
+            base=resample_base()
         )
+        for spec in specs
+    ]
+
+
+def share_bars(cache: BarCache, specs: List[dict], bars: List[Dict[str, np.ndarray]]):
+    """The bars of the feeds for worker processes, the bar files of the cache with --compact."""
+    import backtrader as bt
+    import pandas as pd
+
+    from data.barcache import EXCHANGE_TZ
+    from data.barfile import BarFiles
+    from optimization.sweep import SharedBars
+
+    if not args.compact:
+        return SharedBars.create(bars, directory=BAR_CACHE_DIR)
+
+    paths = [
+        cache.compact(spec['dataname'], spec['timeframe'], spec['compression'], spec['timeframe'] < bt.TimeFrame.Days)
+        for spec in specs
+    ]
+    start, end = pd.Timestamp(fromdate, tz=EXCHANGE_TZ), pd.Timestamp(todate, tz=EXCHANGE_TZ)
+    return BarFiles(paths, start.value, end.value)
+
+
+def create_search(batch: int, specs: List[dict], bars: List[Dict[str, np.ndarray]]) -> Tuple[Search, Budget]:
+    from optimization.search import SEARCHES, Budget
+
+    space = strategy.parameterSpace()
+    budget = Budget(args.budget_runs, args.budget_time)
+    if args.search in ('random', 'model') and args.budget_runs is None and args.budget_time is None:
+        budget.runs = max(len(space) // 4, 1)
+        print(f'No budget given, running {budget.runs} of {len(space)} combinations')
+
+    options = {}
+    if args.search == 'halving':
+        options['min_fraction'] = halving_fraction(space, specs, bars)
+    return SEARCHES[args.search](space, batch=batch, seed=args.seed, **options), budget
+
+
+def halving_fraction(space: ParameterSpace, specs: List[dict], bars: List[Dict[str, np.ndarray]]) -> float:
+    """
+    The fraction of the range the first rung of --search halving runs on,
+    long enough for the longest indicators of the space to warm up and trade.
+    """
+    from live.warmup import minimum_periods
+    from optimization.search import MIN_FRACTION
+    from optimization.sweep import min_fraction
+
+    # The largest value of every dimension, the longest periods of the indicators
+    longest = {name: max(values) for name, values in space.dimensions.items()}
+    periods = minimum_periods(strategy, specs, longest)
+    fraction = min_fraction(bars, [HALVING_PERIODS * period for period in periods])
+    if fraction > 1:
+        raise SystemExit(
+            f'The range is too short for --search halving, every feed needs {HALVING_PERIODS} times the '
+            f'minimum period of its indicators ({", ".join(map(str, periods))} bars)'
+        )
+    if fraction > MIN_FRACTION:
+        print(f'The first rung of --search halving runs on at least {fraction:.0%} of the range to warm up the indicators')
+    return max(fraction, MIN_FRACTION)
+
+
+def open_results() -> ResultStore:
+    """
+    The store of the results of this run. An optimization records its
+    settings and seed in it, with --resume the store of an interrupted
+    optimization with the same settings is opened instead of a new one.
+    """
+    from results import ResultStore
+
+    name = f'{args.strategy}_{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_results'
+    if not args.optimize:
+        return ResultStore.create(name)
+
+    job = {setting: str(getattr(args, setting)) for setting in RESUME_SETTINGS}
+    job['tickers'] = ','.join(tickers)
+    # Without --seed the seed of the interrupted search is continued
+    if args.seed is None:
+        del job['seed']
+
+    results = None
+    if args.resume:
+        if not os.path.exists(args.resume):
+            raise SystemExit(f'There are no results to resume in {args.resume}')
+        results = ResultStore(args.resume)
+        differing = [setting for setting, value in job.items() if results.job.get(setting) != value]
+        if differing:
+            raise SystemExit(f'{args.resume} was run with a different {", ".join(differing)} and can not be resumed')
+    elif args.resume is not None:
+        for path in sorted(glob.glob(f'{args.strategy}_*_results.sqlite'), key=os.path.getmtime, reverse=True):
+            candidate = ResultStore(path)
+            if all(candidate.job.get(setting) == value for setting, value in job.items()):
+                results = candidate
+                break
+            candidate.close()
+        else:
+            print('No results of the same settings to resume, starting a new optimization')
 
-        trades = run.analyzers.trades.get_analysis()
+    if results is None:
+        results = ResultStore.create(name)
+    else:
+        print(f'Resuming {results.path} with {len(results.scores())} combinations already run')
+        # Continue the random order of the interrupted search
+        if args.seed is None and 'seed' in results.job:
+            args.seed = int(results.job['seed'])
+
+    if args.seed is None:
+        args.seed = random.randrange(2 ** 32)
+    results.job = {**job, 'seed': args.seed}
+    return results
+
+
+def skip_done(objective: Objective, results: ResultStore) -> Objective:
+    """
+    Wraps the objective of a search to score the combinations already in
+    the results by their stored rtot and only backtest the others, so the
+    search of a resumed optimization takes the path of the interrupted one.
+    """
+    from results import format_params
+
+    done = results.scores()
+    defaults = dict(strategy.params._getitems())
+
+    def resumed(params: List[dict], fraction: float) -> List[float]:
+        # Only complete runs are stored, the shorter runs of the halving search are repeated
+        if fraction < 1 or not done:
+            return objective(params, fraction)
+
+        keys = [format_params({**defaults, **p}) for p in params]
+        todo = [p for p, key in zip(params, keys) if key not in done]
+        if len(todo) < len(params):
+            print(f'Skipped {len(params) - len(todo)} combinations already run')
+        scores = iter(objective(todo, fraction) if todo else [])
+        return [done[key] if key in done else next(scores) for key in keys]
+
+    return resumed
+
+
+def report(count: int, params: str, rtot: float, fraction: float) -> None:
+    window = f' on {fraction:.0%} of the range' if fraction < 1 else ''
+    print(f'[{count}] {rtot:.2f}{window} for Params: {params}')
+
+
+def run_sweep(cache: BarCache, results: ResultStore) -> None:
+    """Runs the optimization on all cores, loading the bars only once in this process."""
+    from optimization.sweep import Sweep
+
+    specs = feed_specs()
+    bars = load_bars(cache, specs)
+    search, budget = create_search(2 * (args.workers or os.cpu_count()), specs, bars)
+
+    shared = share_bars(cache, specs, bars)
+    try:
+        with Sweep(strategy, args.startcash, specs, shared, args.workers, profile=args.profile, analytics=args.analytics) as sweep:
+            def objective(params: List[dict], fraction: float) -> List[float]:
+                # Full runs are numbered after those stored before, the runs of a halving rung by the budget
+                completed = len(results) if fraction == 1 else budget.spent
+
+                # Every run is reported and stored as soon as it completes
+                def store(row: Dict[str, Any]) -> None:
+                    nonlocal completed
+                    completed += 1
+                    report(completed, row['params'], row['rtot'], fraction)
+                    if fraction == 1:
+                        results.append([row])
+
+                return [row['rtot'] for row in sweep.evaluate(params, fraction, store)]
+
+            search.run(skip_done(objective, results), budget)
+    finally:
+        shared.unlink()
+
+    if sweep.profiler:
+        report_profile(sweep.profiler, results)
+
+
+def run_fast_sweep(cache: BarCache, results: ResultStore) -> None:
+    """Searches the parameter space with the vectorized fast engine."""
+    from engine.consistency import check_consistency, sample
+    from engine.fast import FAST_ENGINES
+    from optimization.sweep import window
+    from results import format_params
+
+    specs = feed_specs()
+    bars = load_bars(cache, specs)
+    defaults = dict(strategy.params._getitems())
+
+    differences = check_consistency(strategy, specs, sample(bars, CONSISTENCY_CHECK_DAYS), defaults, args.startcash)
+    if differences:
+        print('WARNING: the fast engine differs from backtrader on the sample range:')
+        for difference in differences:
+            print(f'  {difference}')
+    else:
+        print(f'The fast engine matches backtrader on the first {CONSISTENCY_CHECK_DAYS} days.')
+
+    search, budget = create_search(1, specs, bars)
+    engines = {}
+
+    def objective(params: List[dict], fraction: float) -> List[float]:
+        if fraction not in engines:
+            engines[fraction] = FAST_ENGINES[strategy](window(bars, fraction))
+
+        scores = []
+        for p in params:
+            result = engines[fraction].run({**defaults, **p}, args.startcash)
+            # Stored run by run, an interrupted search keeps every completed run
+            if fraction == 1:
+                results.append([{
+                    'params': format_params(result.params),
+                    'closed': len(result.trades),
+                    'won': result.won,
+                    'lost': result.lost,
+                    'pnl': round(result.pnl, 5),
+                    'rtot': round(result.rtot, 5)
+                }])
+            scores.append(result.rtot)
+        return scores
+
+    search.run(skip_done(objective, results), budget)
+    print(f'Ran {budget.spent} backtests')
+
+
+def run_portfolio_backtest(cache: BarCache, results: ResultStore) -> None:
+    """Backtests every ticker in its own process and merges them into the portfolio results."""
+    from portfolio import merge, run_portfolio
+
+    specs = feed_specs()
+    bars = load_bars(cache, specs)
+
+    shards = {ticker: [] for ticker in tickers}
+    shared = {}
+    for spec in specs:
+        shards[spec['dataname']].append(spec)
+    try:
+        for ticker, ticker_specs in shards.items():
+            shared[ticker] = share_bars(
+                cache,
+                ticker_specs,
+                [feed for spec, feed in zip(specs, bars) if spec['dataname'] == ticker]
+            )
 
-        if trades['total']['total'] == 0:
-            return
+        symbols = []
+        for symbol in run_portfolio(strategy, shards, shared, args.startcash, args.workers, args.analytics):
+            symbols.append(symbol)
+            results.append([symbol.row])
+            print(f'[{len(symbols)}/{len(shards)}] {symbol.row["rtot"]:.2f} for {symbol.ticker}')
+    finally:
+        for bars in shared.values():
+            bars.unlink()
+
+    portfolio = merge(symbols)
+    results.append([portfolio])
+    print(
+        f'Portfolio of {len(symbols)} tickers: rtot {portfolio["rtot"]:.2f}, rnorm {portfolio["rnorm"]:.2f}, '
+        f'max drawdown {portfolio["drawdown"]:.2f}%, SQN {portfolio["sqn"]:.2f} ({portfolio["risk"]})'
+    )
 
-        run_data.append(trades['total']['total'])
-        run_data.append(trades['total']['open'])
-        run_data.append(trades['total']['closed'])
-        run_data.append(trades['streak']['won']['longest'])
-        run_data.append(trades['streak']['lost']['longest'])
-        run_data.append(trades['won']['total'])
-        run_data.append(round(trades['won']['pnl']['total'], 5))
-        run_data.append(round(trades['won']['pnl']['average'], 5))
-        run_data.append(trades['lost']['total'])
-        run_data.append(round(trades['lost']['pnl']['total'], 5))
-        run_data.append(round(trades['lost']['pnl']['average'], 5))
-        run_data.append(trades['long']['total'])
-        run_data.append(round(trades['long']['pnl']['total'], 5))
-        run_data.append(trades['short']['total'])
-        run_data.append(round(trades['short']['pnl']['total'], 5))
-
-        maxDrawDown = run.analyzers.drawdown.get_analysis().max
-        run_data.append(round(maxDrawDown['drawdown'], 5))
-        run_data.append(round(maxDrawDown['moneydown'], 5))
-
-        returns = run.analyzers.returns.get_analysis()
-        run_data.append(round(returns['rtot'], 5))
-        run_data.append(round(returns['rnorm'], 5))
-
-        sqn = run.analyzers.SQN.get_analysis()
-        run_data.append(sqn['sqn'])
-        if sqn.sqn < 0:
-            run_data.append('Really Bad')
-        elif sqn.sqn < 1.6:
-            run_data.append('Bad')
-        elif sqn.sqn < 2.0:
-            run_data.append('Below average')
-        elif sqn.sqn < 2.5:
-            run_data.append('Average')
-        elif sqn.sqn < 3.0:
-            run_data.append('Good')
-        elif sqn.sqn < 5.0:
-            run_data.append('Excellent')
-        elif sqn.sqn < 7.0:
-            run_data.append('Superb')
+
+def run_walk_forward(cache: BarCache, results: ResultStore) -> None:
+    """Optimizes on rolling windows and stitches the out of sample results of the best parameters."""
+    import numpy as np
+    import pandas as pd
+
+    from data.barcache import EPOCH_NUM, EXCHANGE_TZ, NS_PER_DAY
+    from optimization.walkforward import WalkForward, rolling_windows, stitch
+    from results import format_params
+
+    specs = feed_specs()
+    bars = load_bars(cache, specs)
+    train, test, step = args.walk_forward
+    windows = rolling_windows(bars, train, test, step)
+    if not windows:
+        raise SystemExit(f'The range from {args.fromDate} to {args.toDate} is shorter than {train} train days')
+    print(f'Walk-forward over {len(windows)} windows of {len(strategy.parameterSpace())} combinations each')
+
+    shared = share_bars(cache, specs, bars)
+    try:
+        done = []
+        for result in WalkForward(strategy, args.startcash, specs, shared, args.workers, args.analytics).run(windows):
+            done.append(result)
+            print(
+                f'[{len(done)}/{len(windows)}] {result.window.name}: {result.train_rtot:.2f} in sample '
+                f'for Params: {format_params(result.params)}'
+            )
+    finally:
+        shared.unlink()
+
+    datetimes, values, indices, rows = stitch(done, args.startcash)
+    for row in rows:
+        print(f'{row["window"]}: {row["rtot"]:.2f} out of sample, {row["closed"]} trades for Params: {row["params"]}')
+    results.append(rows)
+
+    # Store the stitched out of sample curve next to the results
+    filename = f'{os.path.splitext(results.path)[0]}_equity.csv'
+    dates = pd.to_datetime(np.round((datetimes - EPOCH_NUM) * NS_PER_DAY).astype(np.int64), utc=True)
+    pd.DataFrame({
+        'datetime': dates.tz_convert(EXCHANGE_TZ),
+        'value': values,
+        'window': [windows[i].name for i in indices]
+    }).to_csv(filename, index=False)
+
+    total = values[-1] / args.startcash - 1 if len(values) else 0.0
+    print(f'Out of sample return of {len(rows)} windows: {total:.2%}, equity curve saved to {filename}')
+
+
+def run_replay(results: ResultStore) -> None:
+    """Backtests the SuperScalper on the ticks of a tick file with its orders filled inside the minute."""
+    import pandas as pd
+
+    from data.barcache import EXCHANGE_TZ
+    from data.journal import Journal
+    from data.tickfile import read_ticks
+    from engine.replay import ScalperReplay
+    from results import format_params
+    from strategies.SuperScalper import journal_path, plotTrades
+
+    journal = journal_path(tickers[0])
+    start, end = pd.Timestamp(fromdate, tz=EXCHANGE_TZ), pd.Timestamp(todate, tz=EXCHANGE_TZ)
+
+    replay = ScalperReplay(latency=args.latency, journal=journal)
+    started = time.perf_counter()
+    result = replay.run(read_ticks(args.ticks, start.value, end.value), args.startcash)
+    seconds = time.perf_counter() - started
+    print(f'Replayed {replay.ticks:,} ticks in {seconds:.1f}s ({replay.ticks / max(seconds, 1e-9):,.0f} ticks/s)')
+
+    results.append([{
+        'params': format_params(result.params),
+        'closed': len(result.trades),
+        'won': result.won,
+        'lost': result.lost,
+        'pnl': round(result.pnl, 5),
+        'rtot': round(result.rtot, 5)
+    }])
+
+    print(f'Trades saved to {journal}')
+    if not args.no_plot:
+        path = os.path.join(journal, 'trades.png')
+        plotTrades(Journal.read(journal), path)
+        print(f'Trade plot saved to {path}')
+
+
+def report_profile(profiler: Profiler, results: ResultStore) -> None:
+    print('Profile of all runs:')
+    profiler.report()
+    filename = f'{os.path.splitext(results.path)[0]}_profile.folded'
+    profiler.dump(filename)
+    print(f'Flame graph stacks saved to {filename}, render them with flamegraph.pl or speedscope')
+
+
+def run_live(cerebro: bt.Cerebro, results: ResultStore) -> None:
+    """Trades live with latency instrumentation, exporting the latency histograms when the session ends."""
+    from live.latency import LatencyMonitor, instrument
+    from results import summarize
+
+    monitor = LatencyMonitor(backlog=LATENCY_BACKLOG_BARS, report=LATENCY_REPORT_SECONDS)
+    instrument(cerebro, monitor)
+    try:
+        results.append([summarize(cerebro.run()[0])])
+    finally:
+        filename = f'{os.path.splitext(results.path)[0]}_latency.csv'
+        monitor.export(filename)
+        print(f'Latency histograms saved to {filename}')
+
+
+def run_sleeves(cache: Optional[BarCache], results: ResultStore) -> None:
+    """
+    Trades the strategy and those of --with in one process, each with an
+    equal share of the cash, on one stream of the feeds they need. With
+    --simulate the cached bars are streamed and the orders are not sent.
+    """
+    import backtrader as bt
+    import numpy as np
+    import pandas as pd
+
+    from backtest import add_feed
+    from data.barcache import EXCHANGE_TZ
+    from live.latency import LatencyMonitor
+    from live.runner import LiveRunner, OrderRouter, SimulatedExecution, Sleeve, alpaca_execution, feed_key
+    from live.warmup import SimulatedData, warmup_bars
+    from results import summarize
+
+    names = [args.strategy, *args.with_strategies]
+    execution = SimulatedExecution() if args.simulate else alpaca_execution(setup_store())
+    router = OrderRouter(execution)
+    runner = LiveRunner(router, args.analytics)
+    for name in names:
+        cls = load_strategy(name)
+        runner.add(Sleeve(
+            name,
+            cls,
+            feed_specs(cls),
+            args.startcash / len(names),
+            max_drawdown=args.max_drawdown / 100 if args.max_drawdown else None,
+            monitor=LatencyMonitor(backlog=LATENCY_BACKLOG_BARS, report=LATENCY_REPORT_SECONDS)
+        ))
+    feeds = sum(len(sleeve.specs) for sleeve in runner.sleeves)
+    print(f'Streaming {len(runner.specs)} feeds to {len(names)} strategies, which use {feeds} feeds')
+
+    # A feed of several strategies warms up for the longest of them
+    lookbacks = {}
+    for sleeve in runner.sleeves:
+        for spec, bars in zip(sleeve.specs, sleeve.strategy.warmupBars(sleeve.specs)):
+            lookbacks[feed_key(spec)] = max(lookbacks.get(feed_key(spec), 0), bars)
+    lookback = [lookbacks[key] for key in runner.keys]
+
+    source = bt.Cerebro(maxcpus=1)
+    if args.simulate:
+        download_bars(cache, runner.specs)
+        warmups = [None] * len(runner.specs)
+    else:
+        warmups = warmup_feeds(cache, runner.specs, lookback) if cache else [None] * len(runner.specs)
+    for spec, bars, warmup in zip(runner.specs, lookback, warmups):
+        if args.simulate:
+            # The bars before fromdate warm up the strategies without trading
+            warm = warmup_bars(cache, spec, bars, fromdate, resample_base())
+            if len(warm['datetime']) < bars:
+                print(f'WARNING: only {len(warm["datetime"])} of the {bars} bars to warm up {spec["dataname"]} are cached')
+            stream = cache.getbars(
+                spec['dataname'],
+                spec['timeframe'],
+                spec['compression'],
+                fromdate,
+                todate,
+                sessionfilter=spec['timeframe'] < bt.TimeFrame.Days,
+                base=resample_base()
+            )
+            d = SimulatedData(
+                dataname=spec['dataname'],
+                bars={column: np.concatenate([warm[column], stream[column]]) for column in stream},
+                timeframe=spec['timeframe'],
+                compression=spec['compression'],
+                tz=spec['tz'],
+                live_from=pd.Timestamp(fromdate, tz=EXCHANGE_TZ).value
+            )
         else:
-            run_data.append('Holy Grail?')
-
-        period = run.analyzers.period.get_analysis()
-        run_data.append(round(period['average'], 5))
-        run_data.append(round(period['stddev'], 5))
-        run_data.append(period['positive'])
-        run_data.append(period['negative'])
-        run_data.append(round(period['best'], 5))
-        run_data.append(round(period['worst'], 5))
-
-        data.append(run_data)
-
-    dataframe = pd.DataFrame(
-        data,
-        columns=[
-            'params', 'drawdown', 'moneydown', 'rtot', 'rnorm', 'total', 'open', 'closed', 'won_streak', 'lost_streak', 'won', 'won_pnl', 'won_pnl_avg', 'lost',
-            'lost_pnl', 'lost_pnl_avg', 'long', 'long_pnl', 'short', 'short_pnl', 'sqn', 'risk', 'avg_day', 'stddev', 'positive_days', 'negative_days', 'best_day', 'worst_day'
-        ]
+            d = live_feed(spec, warmup)
+        add_feed(source, d)
+
+    try:
+        runner.run(source)
+    except KeyboardInterrupt:
+        print('Stopping the strategies')
+
+    for sleeve in runner.sleeves:
+        if sleeve.result is not None:
+            results.append([{**summarize(sleeve.result), 'strategy': sleeve.name}])
+        filename = f'{os.path.splitext(results.path)[0]}_{sleeve.name}_latency.csv'
+        sleeve.monitor.export(filename)
+        print(f'Latency histograms of {sleeve.name} saved to {filename}')
+
+    print(
+        f'Netted {router.sleeve_orders} orders of the strategies for {router.sleeve_volume:,.2f} shares '
+        f'into {router.orders} orders for {router.volume:,.2f} shares'
     )
-    filename = f'{args.strategy}_{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_results.csv'
-    dataframe.to_csv(filename, sep=',', index=False)
-    print(f'Results saved to {filename}')
-    print(dataframe)
 
-    if not PAPER_TRADING or not args.optimize:
+
+def analyze_results(cerebro: Optional[bt.Cerebro], results: ResultStore) -> None:
+    if cerebro:
+        print("Final Portfolio Value: %.2f" % cerebro.broker.getvalue())
+
+    filename = f'{os.path.splitext(results.path)[0]}.csv'
+    results.to_csv(filename)
+    print(f'Results saved to {results.path} and {filename}')
+
+    best = results.top(RANKING_SIZE)
+    print(best)
+
+    if cerebro and (not PAPER_TRADING or not args.optimize):
+        if args.no_plot:
+            return
         cerebro.plot(style='candlestick', barup='green', bardown='red')
     else:
         # Generate results
-        print('Results by PnL:')
-        for run in sorted(
-            runs,
-            key=lambda run: run.analyzers.returns.get_analysis()['rtot'],
-            reverse=True
-        ):
-            profit = run.analyzers.returns.get_analysis()['rtot']
-            params = ','.join([f'{k}: {v}' for k, v in run.p.__dict__.items()])
-            print(f'{profit:.2f} for Params: {params}')
+        print(f'Best {len(best)} of {len(results)} results by PnL:')
+        for row in best.itertuples():
+            label = row.ticker or row.window or row.strategy
+            prefix = f'{label} ' if label else ''
+            print(f'{row.rtot:.2f} for {prefix}Params: {row.params}')
+
+
+if __name__ == '__main__':
+    args = parse_args(strategies.keys())
+
+    from engine.profiler import Profiler
+    from results import summarize
 
+    strategy = load_strategy(args.strategy)
 
-cerebro = setup_cerebro()
+    tickers = args.tickers if args.tickers else ['AAPL']
+
+    fromdate = datetime.strptime(args.fromDate, '%Y-%m-%d')
+    todate = datetime.strptime(args.toDate, '%Y-%m-%d')
+
+    PAPER_TRADING = not args.live
+
+    cache = setup_cache()
+
+    results = open_results()
+    cerebro = None
+
+    if args.walk_forward:
+        run_walk_forward(cache, results)
+    elif PAPER_TRADING and args.optimize and args.engine == 'fast':
+        from engine.fast import FAST_ENGINES
+
+        if strategy not in FAST_ENGINES or not cache:
+            supported = ', '.join(s.__name__ for s in FAST_ENGINES)
+            raise SystemExit(f'The fast engine needs the bar cache and supports only {supported}')
+        limit = FAST_ENGINES[strategy].max_tickers
+        if limit is not None and len(tickers) > limit:
+            raise SystemExit(
+                f'The fast engine of {strategy.__name__} supports only {limit} of the {len(tickers)} tickers, '
+                f'optimize them one by one or with --engine backtrader'
+            )
+        run_fast_sweep(cache, results)
+    elif PAPER_TRADING and args.optimize and cache:
+        run_sweep(cache, results)
+    elif args.portfolio:
+        run_portfolio_backtest(cache, results)
+    elif args.ticks:
+        run_replay(results)
+    elif not PAPER_TRADING and (args.with_strategies or args.simulate):
+        run_sleeves(cache, results)
+    else:
+        cerebro = setup_cerebro(cache)
+        profiler = Profiler() if args.profile else None
+        if profiler:
+            strategy.addProfilerToCerebro(cerebro, profiler)
+
+        # if some weird Index error gets printed, check the ticker names again
+        if not PAPER_TRADING:
+            run_live(cerebro, results)
+        elif args.optimize:
+            # Store every run as it finishes instead of keeping all of them for the end
+            cerebro.optcallback(lambda run: results.append([summarize(run[0])]))
+            cerebro.run(optreturn=True)
+        else:
+            results.append([summarize(cerebro.run()[0])])
 
-# if some weird Index error gets printed, check the ticker names again
-runs = cerebro.run(optreturn=not args.optimize)
+        if profiler:
+            report_profile(profiler, results)
 
-analyze_results(runs)
+    analyze_results(cerebro, results)
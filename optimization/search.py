@@ -0,0 +1,251 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from optimization.space import ParameterSpace
+
+# Fraction of the date range the first rung of the successive halving runs on
+MIN_FRACTION = 1 / 9
+
+# Backtests a batch of parameter combinations on the given fraction of the
+# date range and returns their scores (higher is better) in the same order
+Objective = Callable[[List[dict], float], List[float]]
+
+
+@dataclass
+class Trial:
+    params: dict
+    fraction: float
+    score: float
+
+
+class Budget:
+    """Stops a search after a number of backtests or seconds, whichever comes first."""
+
+    def __init__(self, runs: Optional[int] = None, seconds: Optional[float] = None):
+        self.runs = runs
+        self.seconds = seconds
+        self.spent = 0
+        self.started = time.monotonic()
+
+    def start(self) -> None:
+        self.spent = 0
+        self.started = time.monotonic()
+
+    def spend(self, runs: int) -> None:
+        self.spent += runs
+
+    @property
+    def remaining(self) -> Optional[int]:
+        """Backtests left, None without a run budget."""
+        return None if self.runs is None else max(self.runs - self.spent, 0)
+
+    @property
+    def exhausted(self) -> bool:
+        if self.remaining == 0:
+            return True
+        return self.seconds is not None and time.monotonic() - self.started >= self.seconds
+
+
+class Search(ABC):
+    """
+    Base class of the search strategies over a ParameterSpace.
+
+    Subclasses implement search and evaluate their candidates through
+    evaluate, which stops as soon as the budget is exhausted. The candidates
+    are handed to the objective all at once, so it can keep every worker
+    busy, and in batches of the given size with a time budget, which is
+    checked between them.
+    """
+
+    def __init__(self, space: ParameterSpace, batch: int = 1, seed: Optional[int] = None):
+        self.space = space
+        self.batch = max(batch, 1)
+        self.rng = np.random.default_rng(seed)
+        self.trials: List[Trial] = []
+
+    def run(self, objective: Objective, budget: Optional[Budget] = None) -> List[Trial]:
+        budget = budget or Budget()
+        budget.start()
+        self.trials = []
+        self.search(objective, budget)
+        return self.trials
+
+    @abstractmethod
+    def search(self, objective: Objective, budget: Budget) -> None:
+        """Evaluates the candidates of the search until it is done or the budget is exhausted."""
+
+    def evaluate(self, objective: Objective, budget: Budget, candidates: List[dict], fraction: float = 1.0) -> List[Trial]:
+        done = []
+        size = self.batch if budget.seconds is not None else max(len(candidates), 1)
+        for i in range(0, len(candidates), size):
+            if budget.exhausted:
+                break
+
+            batch = candidates[i:i + size]
+            if budget.remaining is not None:
+                batch = batch[:budget.remaining]
+
+            scores = objective(batch, fraction)
+            budget.spend(len(batch))
+            done += [Trial(params, fraction, score) for params, score in zip(batch, scores)]
+
+        self.trials += done
+        return done
+
+    def best(self) -> Optional[Trial]:
+        """The best trial on the full date range."""
+        full = [trial for trial in self.trials if trial.fraction == 1.0]
+        return max(full, key=lambda trial: trial.score, default=None)
+
+    def shuffled(self) -> List[dict]:
+        grid = self.space.grid()
+        return [grid[i] for i in self.rng.permutation(len(grid))]
+
+
+class GridSearch(Search):
+    """Every valid combination, the behaviour of cerebro.optstrategy without the invalid ones."""
+
+    def search(self, objective: Objective, budget: Budget) -> None:
+        self.evaluate(objective, budget, self.space.grid())
+
+
+class RandomSearch(Search):
+    """Valid combinations in random order without repetition."""
+
+    def __init__(self, space: ParameterSpace, runs: Optional[int] = None, batch: int = 1, seed: Optional[int] = None):
+        super().__init__(space, batch, seed)
+        self.runs = runs
+
+    def search(self, objective: Objective, budget: Budget) -> None:
+        self.evaluate(objective, budget, self.shuffled()[:self.runs])
+
+
+class SuccessiveHalving(Search):
+    """
+    Backtests many random combinations on a short window at the start of the
+    date range and only keeps the best 1/eta of them for the next, eta times
+    longer window, until the survivors run on the full range. The first
+    window is at least min_fraction of the range, there are fewer rungs when
+    it has to be longer.
+    """
+
+    def __init__(
+        self,
+        space: ParameterSpace,
+        candidates: Optional[int] = None,
+        eta: int = 3,
+        min_fraction: float = MIN_FRACTION,
+        batch: int = 1,
+        seed: Optional[int] = None
+    ):
+        super().__init__(space, batch, seed)
+        self.candidates = candidates
+        self.eta = eta
+        # Tolerates the float error of the logarithm of exact powers of eta
+        self.rungs = max(math.floor(math.log(1 / min_fraction, eta) + 1e-9), 0) + 1
+
+    def search(self, objective: Objective, budget: Budget) -> None:
+        candidates = self.shuffled()
+        count = self.candidates or len(candidates)
+        if budget.remaining is not None:
+            # Number of candidates of the first rung whose rungs fit into the run budget
+            runs_per_candidate = sum(self.eta ** -rung for rung in range(self.rungs))
+            count = min(count, max(int(budget.remaining / runs_per_candidate), 1))
+        candidates = candidates[:count]
+
+        for rung in range(self.rungs):
+            fraction = float(self.eta) ** (rung - self.rungs + 1)
+            trials = self.evaluate(objective, budget, candidates, fraction)
+            if budget.exhausted or rung == self.rungs - 1:
+                break
+
+            trials.sort(key=lambda trial: trial.score, reverse=True)
+            survivors = max(len(trials) // self.eta, 1)
+            candidates = [trial.params for trial in trials[:survivors]]
+
+
+class ModelSearch(Search):
+    """
+    Model based search in the style of a tree-structured Parzen estimator.
+
+    After startup random combinations, the trials are split into the best
+    gamma and the rest. Every dimension gets a smoothed histogram of its
+    values in both groups and new combinations are drawn from the good
+    histograms, keeping those most likely to be good rather than bad.
+    """
+
+    def __init__(
+        self,
+        space: ParameterSpace,
+        startup: int = 10,
+        gamma: float = 0.25,
+        samples: int = 32,
+        batch: int = 1,
+        seed: Optional[int] = None
+    ):
+        super().__init__(space, batch, seed)
+        self.startup = startup
+        self.gamma = gamma
+        self.samples = samples
+
+    def search(self, objective: Objective, budget: Budget) -> None:
+        unseen = {self.space.key(params): params for params in self.shuffled()}
+
+        while unseen and not budget.exhausted:
+            if len(self.trials) < self.startup:
+                batch = list(unseen.values())[:min(self.batch, self.startup - len(self.trials))]
+            else:
+                batch = self.propose(unseen)
+
+            for params in batch:
+                del unseen[self.space.key(params)]
+            self.evaluate(objective, budget, batch)
+
+    def propose(self, unseen: Dict[tuple, dict]) -> List[dict]:
+        trials = sorted(self.trials, key=lambda trial: trial.score, reverse=True)
+        split = max(int(math.ceil(self.gamma * len(trials))), 1)
+        good = self.histograms([trial.params for trial in trials[:split]])
+        bad = self.histograms([trial.params for trial in trials[split:]])
+
+        names = list(self.space.dimensions)
+        batch = {}
+        while len(batch) < min(self.batch, len(unseen)):
+            best, best_ratio = None, -math.inf
+            for _ in range(self.samples):
+                indices = [self.rng.choice(len(good[name]), p=good[name]) for name in names]
+                params = {name: self.space.dimensions[name][i] for name, i in zip(names, indices)}
+                key = self.space.key(params)
+                if key not in unseen or key in batch:
+                    continue
+                ratio = sum(math.log(good[name][i] / bad[name][i]) for name, i in zip(names, indices))
+                if ratio > best_ratio:
+                    best, best_ratio = params, ratio
+
+            if best is None:
+                # All samples were evaluated or invalid, fall back to a random combination
+                best = next(params for key, params in unseen.items() if key not in batch)
+            batch[self.space.key(best)] = best
+
+        return list(batch.values())
+
+    def histograms(self, params: List[dict]) -> Dict[str, np.ndarray]:
+        histograms = {}
+        for name, values in self.space.dimensions.items():
+            counts = np.ones(len(values))  # every value keeps a non-zero probability
+            for p in params:
+                counts[values.index(p[name])] += 1
+            histograms[name] = counts / counts.sum()
+        return histograms
+
+
+SEARCHES = {
+    'grid': GridSearch,
+    'random': RandomSearch,
+    'halving': SuccessiveHalving,
+    'model': ModelSearch,
+}
@@ -0,0 +1,38 @@
+import itertools
+from typing import Callable, List, Optional, Sequence
+
+
+class ParameterSpace:
+    """
+    The values every optimized parameter of a strategy can take.
+
+    Each dimension is a finite sequence of values like the ranges passed to
+    cerebro.optstrategy. Constraints are predicates on a full parameter dict,
+    combinations for which any constraint returns False are never backtested.
+    """
+
+    def __init__(self, constraints: Optional[List[Callable[[dict], bool]]] = None, **dimensions: Sequence):
+        self.dimensions = {name: list(values) for name, values in dimensions.items()}
+        self.constraints = constraints or []
+        self._grid: Optional[List[dict]] = None
+
+    def valid(self, params: dict) -> bool:
+        return all(constraint(params) for constraint in self.constraints)
+
+    def grid(self) -> List[dict]:
+        """Every valid combination, in the order cerebro.optstrategy would run them."""
+        if self._grid is None:
+            names = list(self.dimensions)
+            combinations = (
+                dict(zip(names, values))
+                for values in itertools.product(*self.dimensions.values())
+            )
+            self._grid = [params for params in combinations if self.valid(params)]
+        return self._grid
+
+    def __len__(self) -> int:
+        return len(self.grid())
+
+    @staticmethod
+    def key(params: dict) -> tuple:
+        return tuple(sorted(params.items()))
@@ -0,0 +1,214 @@
+import math
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+
+from backtest import add_feed, create_cerebro
+from data.barcache import CachedData
+from engine.profiler import Profiler
+from results import summarize
+from strategies.customStrategy import BaseStrategy
+
+
+class SharedBars:
+    """
+    The bars of all feeds packed into a single memory-mapped file.
+
+    Only the path and the layout are pickled to the worker processes, which
+    map the file read-only. All processes therefore share the same pages
+    through the OS cache instead of each receiving a pickled copy of the data.
+    """
+
+    def __init__(self, path: str, layout: List[Dict[str, Tuple[int, str, int]]]):
+        self.path = path
+        self.layout = layout  # per feed: column -> (offset, dtype, length)
+
+    @classmethod
+    def create(cls, feeds: List[Dict[str, np.ndarray]], directory: Optional[str] = None) -> 'SharedBars':
+        layout = []
+        offset = 0
+        for bars in feeds:
+            columns = {}
+            for column, values in bars.items():
+                values = np.asarray(values)
+                columns[column] = (offset, values.dtype.str, len(values))
+                offset += values.nbytes
+            layout.append(columns)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix='.bars', dir=directory)
+        os.close(fd)
+
+        # np.memmap can not map an empty file
+        buffer = np.memmap(path, dtype=np.uint8, mode='w+', shape=max(offset, 1))
+        for bars, columns in zip(feeds, layout):
+            for column, (start, dtype, length) in columns.items():
+                buffer[start:start + length * np.dtype(dtype).itemsize] = \
+                    np.asarray(bars[column], dtype=dtype).view(np.uint8)
+        buffer.flush()
+        del buffer
+
+        return cls(path, layout)
+
+    def feeds(self) -> List[Dict[str, np.ndarray]]:
+        """Maps the file and returns read-only views of the columns of every feed."""
+        buffer = np.memmap(self.path, dtype=np.uint8, mode='r')
+        return [
+            {
+                column: buffer[start:start + length * np.dtype(dtype).itemsize].view(dtype)
+                for column, (start, dtype, length) in columns.items()
+            }
+            for columns in self.layout
+        ]
+
+    def unlink(self) -> None:
+        os.remove(self.path)
+
+
+def window(feeds: List[Dict[str, np.ndarray]], fraction: float) -> List[Dict[str, np.ndarray]]:
+    """The bars of all feeds in the given fraction of the date range, counted from its start."""
+    if fraction >= 1:
+        return feeds
+
+    dts = [bars['datetime'] for bars in feeds if len(bars['datetime'])]
+    start = min(dt[0] for dt in dts)
+    end = start + (max(dt[-1] for dt in dts) - start) * fraction
+    return [
+        {column: values[:np.searchsorted(bars['datetime'], end, side='right')] for column, values in bars.items()}
+        for bars in feeds
+    ]
+
+
+def min_fraction(feeds: List[Dict[str, np.ndarray]], bars: List[int]) -> float:
+    """
+    The shortest fraction of the date range, counted from its start, in
+    which every feed has at least its number of bars, inf if a feed has less.
+    """
+    dts = [feed['datetime'] for feed in feeds if len(feed['datetime'])]
+    if not dts:
+        return math.inf
+
+    start = min(dt[0] for dt in dts)
+    span = max(max(dt[-1] for dt in dts) - start, 1)
+    fraction = 0.0
+    for feed, count in zip(feeds, bars):
+        if count > len(feed['datetime']):
+            return math.inf
+        if count:
+            fraction = max(fraction, (feed['datetime'][count - 1] - start) / span)
+    return float(fraction)
+
+
+class Sweep:
+    """
+    Backtests parameter combinations of a strategy on a pool of worker processes.
+
+    Every combination is backtested in its own Cerebro, configured by the
+    strategy's addOptimizerToCerebro, with the data feeds built from the
+    SharedBars. Used as a context manager the worker processes are kept alive
+    between calls, which searches evaluating many small batches rely on.
+    """
+
+    def __init__(
+        self,
+        strategy: Type[BaseStrategy],
+        startcash: int,
+        specs: List[dict],
+        bars: SharedBars,
+        workers: Optional[int] = None,
+        profile: bool = False,
+        analytics: str = 'backtrader'
+    ):
+        self.strategy = strategy
+        self.startcash = startcash
+        self.specs = specs  # CachedData parameters of every feed, without the bars
+        self.bars = bars
+        self.workers = workers  # None for one per core
+        self.analytics = analytics  # the analytics of backtest.create_cerebro
+        # The profiles of all runs merged, the workers profile every run on its own
+        self.profiler: Optional[Profiler] = Profiler() if profile else None
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> 'Sweep':
+        self._pool = self.pool()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._pool.shutdown()
+        self._pool = None
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, '_pool': None}
+
+    def pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self,)
+        )
+
+    def evaluate(
+        self,
+        params: List[dict],
+        fraction: float = 1.0,
+        callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        The results row of every parameter combination on the given fraction
+        of the date range, in order. callback is called with every row as
+        soon as its run completes.
+        """
+        if self._pool is None:
+            with self:
+                return self.evaluate(params, fraction, callback)
+
+        futures = {
+            self._pool.submit(_run_combination, ((self.strategy, (), p),), fraction): i
+            for i, p in enumerate(params)
+        }
+        rows: List[Optional[Dict[str, Any]]] = [None] * len(params)
+        for future in as_completed(futures):
+            row = future.result()
+            if self.profiler is not None:
+                row, profiler = row
+                self.profiler.merge(profiler)
+            rows[futures[future]] = row
+            if callback:
+                callback(row)
+        return rows
+
+
+_sweep: Optional[Sweep] = None
+_feeds: List[Dict[str, np.ndarray]] = []
+
+
+def _init_worker(sweep: Sweep) -> None:
+    global _sweep, _feeds
+    _sweep = sweep
+    _feeds = sweep.bars.feeds()
+
+
+def _run_combination(combination: tuple, fraction: float = 1.0):
+    cerebro = create_cerebro(_sweep.startcash, _sweep.analytics)
+
+    # Let the strategy configure the Cerebro as for a normal optimization,
+    # then replace the full grid with this single combination
+    _sweep.strategy.addOptimizerToCerebro(cerebro)
+    cerebro.strats = [[strat] for strat in combination]
+
+    profiler = Profiler() if _sweep.profiler is not None else None
+    if profiler:
+        _sweep.strategy.addProfilerToCerebro(cerebro, profiler)
+
+    for spec, bars in zip(_sweep.specs, window(_feeds, fraction)):
+        add_feed(cerebro, CachedData(bars=bars, **spec))
+
+    # Only the results row is sent back, the parent never holds the strategies. The
+    # standard observers are not needed for it, DataTrades even creates its lines
+    # class at runtime for multiple datas, which could not be pickled
+    row = summarize(cerebro.run(optreturn=True, stdstats=False)[0][0])
+    return (row, profiler) if profiler else row
@@ -0,0 +1,261 @@
+"""
+Walk-forward optimization on rolling windows.
+
+The date range is split into windows of train days followed by test days,
+starting every step days. In every window the full parameter grid of the
+strategy is backtested on the train days and the combination with the best
+return is backtested out of sample on the test days. The windows are
+independent, so the backtests of all of them are scheduled on one pool of
+worker processes which map the same SharedBars: the test run of a window is
+submitted as soon as its last training run finishes, while other windows are
+still training.
+
+A test run starts on the train days as warm-up for the indicators. Its
+broker rejects every order before the first test bar, so the test days
+start flat with the starting cash and only their equity and trades count as
+out of sample. The out of sample equity curves of all windows are stitched
+into one curve.
+"""
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from backtest import add_feed, create_cerebro
+from data.barcache import EXCHANGE_TZ, CachedData, to_num
+from optimization.sweep import SharedBars
+from portfolio import Equity, equity_row
+from results import format_params, summarize
+from strategies.customStrategy import BaseStrategy
+
+
+@dataclass
+class Window:
+    index: int
+    # UTC ns, every range includes its start and excludes its end
+    train_start: int
+    train_end: int
+    test_start: int
+    test_end: int
+
+    @property
+    def name(self) -> str:
+        start, end = pd.to_datetime([self.test_start, self.test_end], utc=True).tz_convert(EXCHANGE_TZ)
+        return f'{start:%Y-%m-%d} - {end:%Y-%m-%d}'
+
+
+@dataclass
+class WindowResult:
+    window: Window
+    params: dict  # the best combination on the train days
+    train_rtot: float
+    datetime: np.ndarray  # backtrader datetime numbers of the out of sample equity curve
+    value: np.ndarray
+    start_value: float  # the broker value before the first test bar, the starting cash
+    pnl: np.ndarray  # net P&L of the trades closed out of sample
+    closed: np.ndarray
+
+
+def rolling_windows(feeds: List[Dict[str, np.ndarray]], train: int, test: int, step: int) -> List[Window]:
+    """The walk-forward windows over the date range of the feeds, train, test and step in days."""
+    dts = [bars['datetime'] for bars in feeds if len(bars['datetime'])]
+    if not dts:
+        return []
+
+    # The edges are midnights in exchange time, whole sessions across DST changes
+    first = pd.Timestamp(min(int(dt[0]) for dt in dts), tz='UTC').tz_convert(EXCHANGE_TZ).tz_localize(None).normalize()
+    end = max(int(dt[-1]) for dt in dts) + 1
+
+    def edge(days: int) -> int:
+        return (first + pd.Timedelta(days=days)).tz_localize(EXCHANGE_TZ).value
+
+    result = []
+    offset = 0
+    while edge(offset + train) < end:
+        result.append(Window(len(result), edge(offset), edge(offset + train), edge(offset + train), min(edge(offset + train + test), end)))
+        offset += step
+    return result
+
+
+def between(feeds: List[Dict[str, np.ndarray]], start: int, end: int) -> List[Dict[str, np.ndarray]]:
+    """The bars of all feeds from start until before end, in UTC ns."""
+    result = []
+    for bars in feeds:
+        lo, hi = np.searchsorted(bars['datetime'], [start, end])
+        result.append({column: values[lo:hi] for column, values in bars.items()})
+    return result
+
+
+class WarmupBroker(bt.brokers.BackBroker):
+    """
+    Rejects the orders of a strategy before trade_from, a backtrader
+    datetime number, so the bars before it only warm up the indicators.
+    Strategies whose orders were rejected are told with warmedUp on the
+    first bar of trade_from, before their next.
+    """
+    params = (
+        ('trade_from', 0.0),
+    )
+
+    def __init__(self):
+        super().__init__()
+        self.warming = set()
+
+    def submit(self, order, check=True):
+        if order.owner.datetime[0] < self.p.trade_from:
+            self.warming.add(order.owner)
+            order.reject(self)
+            self.notify(order)
+            return order
+        return super().submit(order, check)
+
+    def next(self):
+        super().next()
+        for strategy in [strategy for strategy in self.warming if strategy.datetime[0] >= self.p.trade_from]:
+            self.warming.discard(strategy)
+            strategy.warmedUp()
+
+
+class WalkForward:
+    """Runs the walk-forward windows of a strategy on a pool of worker processes."""
+
+    def __init__(
+        self,
+        strategy: Type[BaseStrategy],
+        startcash: int,
+        specs: List[dict],
+        bars: SharedBars,
+        workers: Optional[int] = None,
+        analytics: str = 'backtrader'
+    ):
+        self.strategy = strategy
+        self.startcash = startcash
+        self.specs = specs  # CachedData parameters of every feed, without the bars
+        self.bars = bars
+        self.workers = workers  # None for one per core
+        self.analytics = analytics  # the analytics of backtest.create_cerebro
+
+    def run(self, windows: List[Window]) -> Iterator[WindowResult]:
+        """Optimizes and tests every window, yielding the results as the test runs complete."""
+        grid = self.strategy.parameterSpace().grid()
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self,))
+
+        with pool:
+            # Window index -> train rtot of every combination, in the order of the grid
+            scores: Dict[int, List[Optional[float]]] = {window.index: [None] * len(grid) for window in windows}
+            remaining = {window.index: len(grid) for window in windows}
+            pending: Dict[Future, Tuple[str, Window, int]] = {}
+
+            for window in windows:
+                for i, params in enumerate(grid):
+                    future = pool.submit(_train, params, window.train_start, window.train_end)
+                    pending[future] = ('train', window, i)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, window, i = pending.pop(future)
+
+                    if kind == 'test':
+                        yield future.result()
+                        continue
+
+                    scores[window.index][i] = future.result()
+                    remaining[window.index] -= 1
+                    if remaining[window.index] == 0:
+                        best = int(np.argmax(scores[window.index]))
+                        future = pool.submit(_test, grid[best], scores[window.index][best], window)
+                        pending[future] = ('test', window, best)
+
+
+def stitch(results: List[WindowResult], startcash: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict[str, Any]]]:
+    """
+    Chains the out of sample equity curves of the windows by their returns,
+    each starting at the value the previous one ended with.
+
+    With a step shorter than the test days the test days of consecutive
+    windows overlap, every window is then only used until the next one starts.
+    Returns the stitched datetimes and values, the window index of every bar
+    and the results row of every window.
+    """
+    results = sorted(results, key=lambda result: result.window.index)
+    datetimes, values, indices, rows = [], [], [], []
+    level = startcash
+
+    for i, result in enumerate(results):
+        end = results[i + 1].window.test_start if i + 1 < len(results) else result.window.test_end
+        end = to_num(np.array([min(end, result.window.test_end)]))[0]
+
+        keep = result.datetime < end
+        # The sizer trades a percentage of the broker value, so the P&L of the
+        # trades scales with the equity like the curve
+        value = result.value[keep] / result.start_value * level
+        pnl = result.pnl[result.closed < end] * level / result.start_value
+
+        rows.append({
+            'window': result.window.name,
+            'params': format_params(result.params),
+            **equity_row(result.datetime[keep], value, pnl, level),
+        })
+        datetimes.append(result.datetime[keep])
+        values.append(value)
+        indices.append(np.full(len(value), result.window.index))
+        if len(value):
+            level = value[-1]
+
+    return (
+        np.concatenate(datetimes) if datetimes else np.empty(0),
+        np.concatenate(values) if values else np.empty(0),
+        np.concatenate(indices) if indices else np.empty(0, dtype=int),
+        rows
+    )
+
+
+_walk: Optional[WalkForward] = None
+_feeds: List[Dict[str, np.ndarray]] = []
+
+
+def _init_worker(walk: WalkForward) -> None:
+    global _walk, _feeds
+    _walk = walk
+    _feeds = walk.bars.feeds()
+
+
+def _cerebro(params: dict, start: int, end: int, broker: Optional[bt.BrokerBase] = None):
+    cerebro = create_cerebro(_walk.startcash, _walk.analytics, broker)
+
+    # Configure the Cerebro like an optimization, then run only this combination
+    _walk.strategy.addOptimizerToCerebro(cerebro)
+    cerebro.strats = [[(_walk.strategy, (), params)]]
+
+    for spec, bars in zip(_walk.specs, between(_feeds, start, end)):
+        add_feed(cerebro, CachedData(bars=bars, **spec))
+    return cerebro
+
+
+def _train(params: dict, start: int, end: int) -> float:
+    cerebro = _cerebro(params, start, end)
+    return summarize(cerebro.run(optreturn=True, stdstats=False)[0][0])['rtot']
+
+
+def _test(params: dict, train_rtot: float, window: Window) -> WindowResult:
+    # The train days only warm up the indicators, the test days start flat
+    test_start = to_num(np.array([window.test_start]))[0]
+    cerebro = _cerebro(params, window.train_start, window.test_end, WarmupBroker(trade_from=test_start))
+    cerebro.addanalyzer(Equity, _name='equity')
+    equity = cerebro.run(optreturn=True, stdstats=False)[0][0].analyzers.equity.get_analysis()
+
+    first = np.searchsorted(equity['datetime'], test_start)
+    return WindowResult(
+        window,
+        params,
+        train_rtot,
+        equity['datetime'][first:],
+        equity['value'][first:],
+        float(_walk.startcash),
+        equity['pnl'],
+        equity['closed']
+    )
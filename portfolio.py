@@ -0,0 +1,156 @@
+"""
+Portfolio backtests sharded per symbol.
+
+Each ticker is backtested in its own Cerebro on a pool of worker processes,
+with an equal share of the starting cash. The equity curves and closed
+trades of all symbols are merged afterwards into the portfolio drawdown,
+returns and SQN, computed like the backtrader analyzers.
+This is only equivalent to a single Cerebro with all tickers for
+strategies which decide per symbol and do not share cash between symbols.
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Type
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from backtest import add_feed, create_cerebro
+from data.barcache import EPOCH_NUM, EXCHANGE_TZ, NS_PER_DAY, CachedData
+from optimization.sweep import SharedBars
+from results import sqn_rating, summarize
+from strategies.customStrategy import BaseStrategy
+
+
+class Equity(bt.Analyzer):
+    """Records the broker value at every bar and the net P&L and closing time of every closed trade."""
+
+    def start(self):
+        self.datetimes: List[float] = []
+        self.values: List[float] = []
+        self.pnls: List[float] = []
+        self.closed: List[float] = []
+
+    def next(self):
+        self.datetimes.append(self.strategy.datetime[0])
+        self.values.append(self.strategy.broker.getvalue())
+
+    def notify_trade(self, trade):
+        if trade.isclosed:
+            self.pnls.append(trade.pnlcomm)
+            self.closed.append(self.strategy.datetime[0])
+
+    def get_analysis(self):
+        return dict(
+            datetime=np.asarray(self.datetimes),
+            value=np.asarray(self.values),
+            pnl=np.asarray(self.pnls),
+            closed=np.asarray(self.closed)
+        )
+
+
+@dataclass
+class SymbolResult:
+    ticker: str
+    startcash: float
+    row: Dict[str, Any]  # results.summarize of the symbol's run
+    datetime: np.ndarray  # backtrader datetime numbers of the equity curve
+    value: np.ndarray
+    pnl: np.ndarray
+
+
+def run_symbol(
+    strategy: Type[BaseStrategy],
+    ticker: str,
+    specs: List[dict],
+    bars: SharedBars,
+    startcash: float,
+    analytics: str = 'backtrader'
+) -> SymbolResult:
+    cerebro = create_cerebro(startcash, analytics)
+    strategy.addStrategyToCerebro(cerebro)
+    cerebro.addanalyzer(Equity, _name='equity')
+    for spec, feed in zip(specs, bars.feeds()):
+        add_feed(cerebro, CachedData(bars=feed, **spec))
+
+    run = cerebro.run(stdstats=False)[0]
+    equity = run.analyzers.equity.get_analysis()
+    return SymbolResult(ticker, startcash, {'ticker': ticker, **summarize(run)}, equity['datetime'], equity['value'], equity['pnl'])
+
+
+def run_portfolio(
+    strategy: Type[BaseStrategy],
+    specs: Dict[str, List[dict]],
+    bars: Dict[str, SharedBars],
+    startcash: float,
+    workers: Optional[int] = None,
+    analytics: str = 'backtrader'
+) -> Iterator[SymbolResult]:
+    """Backtests every ticker in specs on its own share of startcash, yielding the results as they complete."""
+    cash = startcash / len(specs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(run_symbol, strategy, ticker, specs[ticker], bars[ticker], cash, analytics)
+            for ticker in specs
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def equity_row(datetime: np.ndarray, equity: np.ndarray, pnl: np.ndarray, startcash: float) -> Dict[str, Any]:
+    """
+    The results row of an equity curve over backtrader datetime numbers and
+    the net P&L of its closed trades, computed like the backtrader analyzers.
+    """
+    peak = np.maximum.accumulate(equity)
+    drawdown = 100.0 * (peak - equity) / peak
+    moneydown = peak - equity
+
+    # Log return like bt.analyzers.Returns, but always normalized to 252 trading days
+    value = equity[-1] if len(equity) else startcash
+    rtot = math.log(value / startcash) if value > 0 else -math.inf
+    dates = pd.to_datetime(np.round((datetime - EPOCH_NUM) * NS_PER_DAY).astype(np.int64), utc=True)
+    days = len(np.unique(dates.tz_convert(EXCHANGE_TZ).date))
+    rnorm = math.expm1(rtot / days * 252) if days and rtot > -math.inf else -1.0
+
+    # bt.analyzers.SQN
+    sqn = float(math.sqrt(len(pnl)) * pnl.mean() / pnl.std()) if len(pnl) > 1 and pnl.std() else 0.0
+
+    return {
+        'closed': int(len(pnl)),
+        'won': int((pnl >= 0).sum()),
+        'lost': int((pnl < 0).sum()),
+        'pnl': round(float(pnl.sum()), 5),
+        'drawdown': round(float(drawdown.max()), 5) if len(drawdown) else 0.0,
+        'moneydown': round(float(moneydown.max()), 5) if len(moneydown) else 0.0,
+        'rtot': round(rtot, 5),
+        'rnorm': round(rnorm, 5),
+        'sqn': sqn,
+        'risk': sqn_rating(sqn),
+    }
+
+
+def merge(symbols: List[SymbolResult]) -> Dict[str, Any]:
+    """The portfolio results row of the merged equity curves and trades of all symbols."""
+    timeline = np.unique(np.concatenate([symbol.datetime for symbol in symbols]))
+
+    # Every symbol holds its last value between its own bars and its cash before its first
+    equity = np.zeros(len(timeline))
+    for symbol in symbols:
+        if not len(symbol.value):
+            equity += symbol.startcash
+            continue
+        positions = np.searchsorted(symbol.datetime, timeline, side='right') - 1
+        equity += np.where(positions >= 0, symbol.value[np.maximum(positions, 0)], symbol.startcash)
+
+    startcash = sum(symbol.startcash for symbol in symbols)
+    pnl = np.concatenate([symbol.pnl for symbol in symbols])
+
+    return {
+        'ticker': 'PORTFOLIO',
+        'params': symbols[0].row['params'] if symbols else '',
+        'total': sum(symbol.row['total'] for symbol in symbols),
+        **equity_row(timeline, equity, pnl, startcash),
+    }
@@ -0,0 +1,207 @@
+import os
+import sqlite3
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+# Columns of the results table with their SQLite types, in the order of the CSV export
+COLUMNS = {
+    'ticker': 'TEXT',  # only set for the per symbol rows of a --portfolio backtest
+    'window': 'TEXT',  # only set for the out of sample rows of a --walk-forward optimization
+    'strategy': 'TEXT',  # only set for the rows of the strategies of a --live --with run
+    'params': 'TEXT',
+    'total': 'INTEGER',
+    'open': 'INTEGER',
+    'closed': 'INTEGER',
+    'won_streak': 'INTEGER',
+    'lost_streak': 'INTEGER',
+    'won': 'INTEGER',
+    'won_pnl': 'REAL',
+    'won_pnl_avg': 'REAL',
+    'lost': 'INTEGER',
+    'lost_pnl': 'REAL',
+    'lost_pnl_avg': 'REAL',
+    'long': 'INTEGER',
+    'long_pnl': 'REAL',
+    'short': 'INTEGER',
+    'short_pnl': 'REAL',
+    'pnl': 'REAL',
+    'drawdown': 'REAL',
+    'moneydown': 'REAL',
+    'rtot': 'REAL',
+    'rnorm': 'REAL',
+    'sqn': 'REAL',
+    'risk': 'TEXT',
+    'avg_day': 'REAL',
+    'stddev': 'REAL',
+    'positive_days': 'INTEGER',
+    'negative_days': 'INTEGER',
+    'best_day': 'REAL',
+    'worst_day': 'REAL',
+}
+
+
+def format_params(params: Dict[str, Any]) -> str:
+    return ';'.join([f'{k}: {v}' for k, v in params.items()])
+
+
+def sqn_rating(sqn: float) -> str:
+    if sqn < 0:
+        return 'Really Bad'
+    elif sqn < 1.6:
+        return 'Bad'
+    elif sqn < 2.0:
+        return 'Below average'
+    elif sqn < 2.5:
+        return 'Average'
+    elif sqn < 3.0:
+        return 'Good'
+    elif sqn < 5.0:
+        return 'Excellent'
+    elif sqn < 7.0:
+        return 'Superb'
+    else:
+        return 'Holy Grail?'
+
+
+def _get(analysis, *keys, default=0):
+    """
+    The value at keys in a nested analysis, default if a key is missing.
+
+    The analyzers return AutoOrderedDicts which create missing keys on access,
+    e.g. the TradeAnalyzer has no 'won' section for a run without closed trades.
+    """
+    for key in keys:
+        if not isinstance(analysis, dict) or key not in analysis:
+            return default
+        analysis = analysis[key]
+    return default if isinstance(analysis, dict) else analysis
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 5)
+
+
+def summarize(run) -> Dict[str, Any]:
+    """The results row of a strategy or OptReturn with the analyzers of backtest.create_cerebro."""
+    if hasattr(run.analyzers, 'recorder'):
+        # Imported here, engine.analytics imports backtrader
+        from engine.analytics import metrics
+
+        row = metrics(run.analyzers.recorder.get_analysis())
+        return {'params': format_params(run.p.__dict__), **row, 'risk': sqn_rating(row['sqn'])}
+
+    trades = run.analyzers.trades.get_analysis()
+    drawdown = run.analyzers.drawdown.get_analysis()
+    returns = run.analyzers.returns.get_analysis()
+    sqn = run.analyzers.SQN.get_analysis()
+    period = run.analyzers.period.get_analysis()
+
+    return {
+        'params': format_params(run.p.__dict__),
+        'total': _get(trades, 'total', 'total'),
+        'open': _get(trades, 'total', 'open'),
+        'closed': _get(trades, 'total', 'closed'),
+        'won_streak': _get(trades, 'streak', 'won', 'longest'),
+        'lost_streak': _get(trades, 'streak', 'lost', 'longest'),
+        'won': _get(trades, 'won', 'total'),
+        'won_pnl': _round(_get(trades, 'won', 'pnl', 'total')),
+        'won_pnl_avg': _round(_get(trades, 'won', 'pnl', 'average')),
+        'lost': _get(trades, 'lost', 'total'),
+        'lost_pnl': _round(_get(trades, 'lost', 'pnl', 'total')),
+        'lost_pnl_avg': _round(_get(trades, 'lost', 'pnl', 'average')),
+        'long': _get(trades, 'long', 'total'),
+        'long_pnl': _round(_get(trades, 'long', 'pnl', 'total')),
+        'short': _get(trades, 'short', 'total'),
+        'short_pnl': _round(_get(trades, 'short', 'pnl', 'total')),
+        'pnl': _round(_get(trades, 'pnl', 'net', 'total')),
+        'drawdown': _round(drawdown.max.drawdown),
+        'moneydown': _round(drawdown.max.moneydown),
+        'rtot': _round(returns['rtot']),
+        'rnorm': _round(returns['rnorm']),
+        'sqn': sqn['sqn'],
+        'risk': sqn_rating(sqn['sqn']),
+        'avg_day': _round(period['average']),
+        'stddev': _round(period['stddev']),
+        'positive_days': period['positive'],
+        'negative_days': period['negative'],
+        'best_day': _round(period['best']),
+        'worst_day': _round(period['worst']),
+    }
+
+
+class ResultStore:
+    """
+    The results of a backtest or optimization in an SQLite table.
+
+    Rows are appended and committed as the runs finish, so a sweep never
+    keeps its strategies or rows in memory and an interrupted sweep keeps
+    every finished run. Rankings are queried from the table. The settings
+    of the job which produced the results are kept in a second table, so an
+    interrupted sweep can be resumed with the same settings.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        columns = ', '.join(f'{column} {type}' for column, type in COLUMNS.items())
+        self.connection.execute(f'CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, {columns})')
+        # Results written before a column was added get it as NULL
+        existing = {row[1] for row in self.connection.execute('PRAGMA table_info(results)')}
+        for column, type in COLUMNS.items():
+            if column not in existing:
+                self.connection.execute(f'ALTER TABLE results ADD COLUMN {column} {type}')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS job (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.commit()
+
+    def append(self, rows: List[Dict[str, Any]]) -> None:
+        """Appends rows with any subset of the COLUMNS, missing columns are NULL."""
+        for row in rows:
+            columns = ', '.join(row)
+            placeholders = ', '.join('?' * len(row))
+            self.connection.execute(f'INSERT INTO results ({columns}) VALUES ({placeholders})', list(row.values()))
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def top(self, n: Optional[int] = None, by: str = 'rtot') -> pd.DataFrame:
+        """The n best runs by the given column, all runs without n."""
+        if by not in COLUMNS:
+            raise ValueError(f'Unknown results column {by}')
+        limit = '' if n is None else f' LIMIT {int(n)}'
+        return pd.read_sql_query(
+            f'SELECT {", ".join(COLUMNS)} FROM results ORDER BY {by} IS NULL, {by} DESC, id{limit}',
+            self.connection
+        )
+
+    def scores(self, by: str = 'rtot') -> Dict[str, float]:
+        """The given column of every parameter combination, only of the rows of whole runs."""
+        if by not in COLUMNS:
+            raise ValueError(f'Unknown results column {by}')
+        return dict(self.connection.execute(
+            f'SELECT params, {by} FROM results WHERE ticker IS NULL AND window IS NULL ORDER BY id'
+        ))
+
+    @property
+    def job(self) -> Dict[str, str]:
+        return dict(self.connection.execute('SELECT key, value FROM job'))
+
+    @job.setter
+    def job(self, job: Dict[str, Any]) -> None:
+        self.connection.executemany('REPLACE INTO job (key, value) VALUES (?, ?)', [(k, str(v)) for k, v in job.items()])
+        self.connection.commit()
+
+    def to_csv(self, path: str) -> None:
+        self.top().to_csv(path, sep=',', index=False)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @classmethod
+    def create(cls, name: str) -> 'ResultStore':
+        """A store in a new file name.sqlite, replacing an existing one."""
+        path = f'{name}.sqlite'
+        if os.path.exists(path):
+            os.remove(path)
+        return cls(path)
@@ -10,6 +10,12 @@ load_dotenv()
 ALPACA_KEY_ID = os.getenv('ALPACA_KEY_ID')
 ALPACA_SECRET_KEY = os.getenv('ALPACA_SECRET_KEY')
 
+BAR_CACHE_DIR = os.getenv('BAR_CACHE_DIR', '.barcache')
+
+# Market data API of the bulk downloader and its limit of requests per minute
+ALPACA_DATA_URL = os.getenv('ALPACA_DATA_URL', 'https://data.alpaca.markets')
+ALPACA_RATE_LIMIT = float(os.getenv('ALPACA_RATE_LIMIT', 200))
+
 
 def parse_args(strategies: List[str]):
     parser = argparse.ArgumentParser(
@@ -22,6 +28,28 @@ def parse_args(strategies: List[str]):
         choices=strategies
     )
     parser.add_argument('--live', action='store_true', help='run live trading')
+    parser.add_argument(
+        '--with',
+        dest='with_strategies',
+        nargs='+',
+        default=[],
+        choices=strategies,
+        metavar='STRATEGY',
+        help='trade these strategies with --live in the same process, each with an equal share of the cash, '
+             'on one stream of the bars all of them need and with their orders netted per symbol'
+    )
+    parser.add_argument(
+        '--simulate',
+        action='store_true',
+        help='stream the cached bars from -from to -to to the strategies of --live instead of Alpaca and only '
+             'simulate the orders, to test live trading without an account'
+    )
+    parser.add_argument(
+        '--max-drawdown',
+        type=float,
+        metavar='PERCENT',
+        help='halt a strategy of --with or --simulate and close its positions once its value fell PERCENT below its peak'
+    )
     parser.add_argument(
         '--optimize',
         action='store_true',
@@ -47,5 +75,150 @@ def parse_args(strategies: List[str]):
         default=100_000
     )
     parser.add_argument('-t', '--tickers', nargs='+', help='tickers to use')
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='download the historical bars from Alpaca instead of using the local bar cache, '
+             '--live backfills from -from instead of warming up from it'
+    )
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='only use bars from the local bar cache, never download missing ranges'
+    )
+    parser.add_argument(
+        '--resample',
+        action='store_true',
+        help='download only 1 minute bars once per ticker and resample all timeframes of the strategy from them'
+    )
+    parser.add_argument(
+        '--compact',
+        action='store_true',
+        help='feed backtests from memory-mapped bar files of the local bar cache with float32 prices, '
+             'shared by all worker processes'
+    )
+    parser.add_argument(
+        '--connections',
+        type=int,
+        default=8,
+        help='number of concurrent connections used to download missing bars into the local bar cache. Default is 8'
+    )
+
+    parser.add_argument(
+        '--portfolio',
+        action='store_true',
+        help='backtest every ticker in its own worker process with an equal share of the cash and merge the results'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='number of worker processes for --optimize, --walk-forward and --portfolio. Default is one per core'
+    )
+
+    parser.add_argument(
+        '--walk-forward',
+        type=int,
+        nargs=3,
+        metavar=('TRAIN', 'TEST', 'STEP'),
+        help='optimize on rolling windows of TRAIN days and backtest the best parameters on the following TEST days, '
+             'starting a window every STEP days'
+    )
+
+    parser.add_argument(
+        '--engine',
+        choices=['backtrader', 'fast'],
+        default='backtrader',
+        help='the engine used for --optimize. fast is a vectorized NumPy backtester for RSIStack and Slingshot'
+    )
+
+    parser.add_argument(
+        '--analytics',
+        choices=['backtrader', 'numpy'],
+        default='backtrader',
+        help='how the results are computed. numpy only records the equity and trades during the run and computes the '
+             'same results from them afterwards, instead of the backtrader analyzers'
+    )
+    parser.add_argument(
+        '--search',
+        choices=['grid', 'random', 'halving', 'model'],
+        default='grid',
+        help='how --optimize searches the parameter space of the strategy. Default is every valid combination'
+    )
+    parser.add_argument(
+        '--budget-runs',
+        type=int,
+        help='stop --optimize after this many backtests'
+    )
+    parser.add_argument(
+        '--budget-time',
+        type=float,
+        help='stop --optimize after this many seconds'
+    )
+    parser.add_argument('--seed', type=int, help='random seed of the random, halving and model search')
+    parser.add_argument(
+        '--resume',
+        nargs='?',
+        const='',
+        metavar='RESULTS',
+        help='continue an interrupted --optimize in its RESULTS .sqlite file, skipping the combinations already run. '
+             'Without RESULTS the newest results of the strategy with the same settings are continued, if any'
+    )
+
+    parser.add_argument(
+        '--ticks',
+        metavar='TICKFILE',
+        help='backtest the SuperScalper on the trades or quotes of a tick file, filling its orders on the ticks after '
+             'each 1 minute bar instead of at the open of the next bar'
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.0,
+        help='seconds from the close of a bar until the orders of --ticks reach the market. Default is 0'
+    )
+
+    parser.add_argument(
+        '--no-plot',
+        action='store_true',
+        help='do not plot the backtest when it finished, for headless and batch runs'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='report the time spent in the feeds, broker, indicators, next, analyzers and observers and save a flame graph'
+    )
+
+    args = parser.parse_args()
+
+    if args.resample and args.no_cache:
+        parser.error('--resample needs the local bar cache, it can not be used with --no-cache')
+    if args.compact and (args.no_cache or args.live or args.resample):
+        parser.error('--compact needs the local bar cache and can not be used with --live or --resample')
+    if args.portfolio and (args.no_cache or args.live or args.optimize):
+        parser.error('--portfolio needs the local bar cache and can not be used with --live or --optimize')
+    if args.walk_forward and (args.no_cache or args.live or args.portfolio):
+        parser.error('--walk-forward needs the local bar cache and can not be used with --live or --portfolio')
+    if args.walk_forward and min(args.walk_forward) <= 0:
+        parser.error('--walk-forward needs positive TRAIN, TEST and STEP days')
+    if args.profile and (args.portfolio or args.walk_forward or args.engine == 'fast'):
+        parser.error('--profile profiles backtests and --optimize with the backtrader engine, not --portfolio or --walk-forward')
+    if args.search != 'grid' and args.no_cache:
+        parser.error('--search needs the local bar cache, it can not be used with --no-cache')
+    if args.ticks and (args.strategy != 'SuperScalper' or args.optimize or args.live or args.portfolio or args.walk_forward):
+        parser.error('--ticks replays a single SuperScalper backtest, not --optimize, --live, --portfolio or --walk-forward')
+    if args.latency < 0:
+        parser.error('--latency can not be negative')
+    if (args.with_strategies or args.simulate) and not args.live:
+        parser.error('--with and --simulate run live trading and need --live')
+    if args.strategy in args.with_strategies or len(set(args.with_strategies)) < len(args.with_strategies):
+        parser.error('--with can trade every strategy only once')
+    if args.simulate and args.no_cache:
+        parser.error('--simulate streams the bars of the local bar cache, it can not be used with --no-cache')
+    if args.max_drawdown is not None and not (args.with_strategies or args.simulate):
+        parser.error('--max-drawdown halts the strategies of --with or --simulate')
+    if args.max_drawdown is not None and not 0 < args.max_drawdown < 100:
+        parser.error('--max-drawdown must be between 0 and 100 percent')
+    if args.resume is not None and (not args.optimize or args.no_cache or args.live or args.walk_forward):
+        parser.error('--resume continues --optimize with the local bar cache, not --no-cache, --live or --walk-forward')
 
-    return parser.parse_args()
+    return args
@@ -1,6 +1,8 @@
 
 import backtrader as bt
+import numpy as np
 
+from optimization.space import ParameterSpace
 from strategies.customStrategy import BaseStrategy
 
 
@@ -18,12 +20,12 @@ class RSIStack(BaseStrategy):
     }
 
     @classmethod
-    def addOptimizerToCerebro(cls, cerebro: bt.Cerebro):
-        cerebro.optstrategy(
-            RSIStack,
+    def parameterSpace(cls) -> ParameterSpace:
+        return ParameterSpace(
             rsi_overbought=range(10, 100, 10),
             rsi_oversold=range(10, 100, 10),
-            rrr=range(1, 10)
+            rrr=range(1, 10),
+            constraints=[lambda p: p['rsi_oversold'] < p['rsi_overbought']]
         )
 
     def __init__(self):
@@ -32,70 +34,92 @@ class RSIStack(BaseStrategy):
         self.inds = {}
         for d in self.datas:
             self.inds[d] = {}
-            self.inds[d]['rsi'] = bt.ind.RSI(d)
-            self.inds[d]['rsiob'] = self.inds[d]['rsi'] >= self.p.rsi_overbought
-            self.inds[d]['rsios'] = self.inds[d]['rsi'] <= self.p.rsi_oversold
+            self.inds[d]['rsi'] = self.sharedIndicator(bt.ind.RSI, d)
         for i in range(len(self.timeframes)-1, len(self.datas), len(self.timeframes)):
-            self.inds[self.datas[i]]['atr'] = bt.ind.ATR(self.datas[i])
+            self.inds[self.datas[i]]['atr'] = self.sharedIndicator(bt.ind.ATR, self.datas[i])
+
+        # The datas are grouped by ticker, each from highest to lowest frequency
+        # timeframe, so the RSI of every data is a cell of a (ticker x timeframe)
+        # matrix. Orders are placed on the lowest frequency data of a ticker
+        shape = (len(self.datas) // len(self.timeframes), len(self.timeframes))
+        self.rsis = [self.inds[d]['rsi'].lines[0] for d in self.datas]
+        self.traded = self.datas[len(self.timeframes)-1::len(self.timeframes)]
+        self.rsi = np.empty(shape)
+        self.overbought = np.empty(shape, dtype=bool)
+        self.oversold = np.empty(shape, dtype=bool)
+        self.stackedob = np.empty(shape[0], dtype=bool)
+        self.stackedos = np.empty(shape[0], dtype=bool)
+        self.stacked = np.zeros(shape[0], dtype=bool)
+        # Stacks are traded in the order they formed, a ticker's rank is the bar count
+        # when its stack formed plus its position among the stacks formed on that bar
+        self.formed = np.zeros(shape[0], dtype=np.int64)
+        self.fresh = np.empty(shape[0], dtype=bool)
+        self.ranks = np.empty(shape[0], dtype=np.int64)
+        self.bars = 0
 
     def start(self):
         # Timeframes must be entered from highest to lowest frequency.
         # Getting the length of the lowest frequency timeframe will
         # show us how many periods have passed
         self.lenlowtframe = len(self.datas[-1])
-        self.stacks = {}
 
     def next(self):
-        # Reset all of the stacks if a bar has passed on our
+        # All stacks form anew once a bar has passed on our
         # lowest frequency timeframe
         if not self.lenlowtframe == len(self.datas[-1]):
             self.lenlowtframe += 1
-            self.stacks = {}
-
-        for i, d in enumerate(self.datas):
-            # Create a dictionary for each new symbol.
-            ticker = d.p.dataname
-            if i % len(self.timeframes) == 0:
-                self.stacks[ticker] = {}
-                self.stacks[ticker]['rsiob'] = 0
-                self.stacks[ticker]['rsios'] = 0
-            if i % len(self.timeframes) == len(self.timeframes) - 1:
-                self.stacks[ticker]['data'] = d
-            self.stacks[ticker]['rsiob'] += self.inds[d]['rsiob'][0]
-            self.stacks[ticker]['rsios'] += self.inds[d]['rsios'][0]
-
-        for k, v in list(self.stacks.items()):
-            if v['rsiob'] < len(self.timeframes) and v['rsios'] < len(self.timeframes):
-                del self.stacks[k]
+            self.stacked[:] = False
+
+        # Tickers which were not stacked on the previous bar rank after all which were
+        np.logical_not(self.stacked, out=self.fresh)
+        np.cumsum(self.fresh, out=self.ranks)
+        self.ranks += self.bars
+        np.copyto(self.formed, self.ranks, where=self.fresh)
+        self.bars += len(self.fresh)
+
+        # Update the state matrices in place, a NaN RSI is neither overbought nor oversold
+        rsi = self.rsi.reshape(-1)
+        for i, line in enumerate(self.rsis):
+            rsi[i] = line[0]
+        np.greater_equal(self.rsi, self.p.rsi_overbought, out=self.overbought)
+        np.less_equal(self.rsi, self.p.rsi_oversold, out=self.oversold)
+
+        # A ticker is stacked when it is overbought or oversold on all of its timeframes
+        np.all(self.overbought, axis=1, out=self.stackedob)
+        np.all(self.oversold, axis=1, out=self.stackedos)
+        np.logical_or(self.stackedob, self.stackedos, out=self.stacked)
 
         # Check if there are any stacks from the previous period
         # And buy/sell stocks if there are no existing positions or open orders
+        if not self.stacked.any() or self.orefs:
+            return
         positions = [d for d, pos in self.getpositions().items() if pos]
-        if self.stacks and not positions and not self.orefs:
-            for k, v in self.stacks.items():
-                d = v['data']
-                size = self.broker.get_cash() // d
-                if v['rsiob'] == len(self.timeframes) and \
-                        d.close[0] < d.close[-1]:
-                    print(f"{d.p.dataname} overbought")
-                    risk = d + self.inds[d]['atr'][0]
-                    reward = d - self.inds[d]['atr'][0] * self.p.rrr
-                    os = self.sell_bracket(data=d,
-                                           price=d.close[0],
-                                           size=size,
-                                           stopprice=risk,
-                                           limitprice=reward)
-                    self.orefs = [o.ref for o in os]
-                elif v['rsios'] == len(self.timeframes) and d.close[0] > d.close[-1]:
-                    print(f"{d.p.dataname} oversold")
-                    risk = d - self.inds[d]['atr'][0]
-                    reward = d + self.inds[d]['atr'][0] * self.p.rrr
-                    os = self.buy_bracket(data=d,
-                                          price=d.close[0],
-                                          size=size,
-                                          stopprice=risk,
-                                          limitprice=reward)
-                    self.orefs = [o.ref for o in os]
+        if positions:
+            return
+
+        for i in sorted(np.flatnonzero(self.stacked), key=self.formed.__getitem__):
+            d = self.traded[i]
+            size = self.broker.get_cash() // d
+            if self.stackedob[i] and d.close[0] < d.close[-1]:
+                print(f"{d.p.dataname} overbought")
+                risk = d + self.inds[d]['atr'][0]
+                reward = d - self.inds[d]['atr'][0] * self.p.rrr
+                os = self.sell_bracket(data=d,
+                                       price=d.close[0],
+                                       size=size,
+                                       stopprice=risk,
+                                       limitprice=reward)
+                self.orefs = [o.ref for o in os]
+            elif self.stackedos[i] and d.close[0] > d.close[-1]:
+                print(f"{d.p.dataname} oversold")
+                risk = d - self.inds[d]['atr'][0]
+                reward = d + self.inds[d]['atr'][0] * self.p.rrr
+                os = self.buy_bracket(data=d,
+                                      price=d.close[0],
+                                      size=size,
+                                      stopprice=risk,
+                                      limitprice=reward)
+                self.orefs = [o.ref for o in os]
 
     def log(self, txt, dt=None):
         ''' Logging function for this strategy'''
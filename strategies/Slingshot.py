@@ -3,6 +3,7 @@ from datetime import time
 
 import backtrader as bt
 
+from optimization.space import ParameterSpace
 from strategies.customStrategy import BaseStrategy
 
 
@@ -27,9 +28,8 @@ class Slingshot(BaseStrategy):
         cerebro.addstrategy(Slingshot)
 
     @classmethod
-    def addOptimizerToCerebro(cls, cerebro: bt.Cerebro):
-        cerebro.optstrategy(
-            Slingshot,
+    def parameterSpace(cls) -> ParameterSpace:
+        return ParameterSpace(
             slingshot_ema_length=range(3, 6),
             strong_sma_length=range(20, 66, 15),
             pullback_ema_length=range(5, 16, 5),
@@ -37,14 +37,14 @@ class Slingshot(BaseStrategy):
         )
 
     def __init__(self):
-        self.slingshot_ema = bt.ind.EMA(
-            self.data.high, period=self.p.slingshot_ema_length
+        self.slingshot_ema = self.sharedIndicator(
+            bt.ind.EMA, self.data, 'high', period=self.p.slingshot_ema_length
         )
-        self.strong_sma = bt.ind.SMA(
-            self.data1.open, period=self.p.strong_sma_length
+        self.strong_sma = self.sharedIndicator(
+            bt.ind.SMA, self.data1, 'open', period=self.p.strong_sma_length
         )
-        self.pullback_ema = bt.ind.EMA(
-            self.data1.open, period=self.p.pullback_ema_length
+        self.pullback_ema = self.sharedIndicator(
+            bt.ind.EMA, self.data1, 'open', period=self.p.pullback_ema_length
         )
 
     def next(self):
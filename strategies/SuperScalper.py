@@ -1,15 +1,25 @@
 
+import heapq
+import os
+import tempfile
+from abc import ABC, ABCMeta, abstractmethod
+from array import array
 from dataclasses import dataclass
-from datetime import datetime, time
-from typing import List
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import backtrader as bt
+import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
 
+from data.journal import Journal
+from optimization.space import ParameterSpace
 from strategies.customStrategy import BaseStrategy
 
-ENTRY_INDEX = 0
+# Minute of the day from which all trades are closed, 15:30
+SESSION_CLOSE = 15 * 60 + 30
+
+EPOCH_NUM = bt.date2num(datetime(1970, 1, 1))
 
 
 @dataclass
@@ -20,15 +30,8 @@ class Entry:
     order: bt.Order = None
 
 
-@dataclass
 class Trade:
-    type: int = 0
-    entry: float = 0
-    exit: float = 0
-    entryIndex: int = None
-    exitIndex: int = None
-    dayClose: bool = False
-    reachedProfit: bool = False
+    __slots__ = ('type', 'entry', 'exit', 'entryIndex', 'exitIndex', 'dayClose', 'reachedProfit')
 
     def __init__(self, type, entry, exit, entryIndex, exitIndex, dayClose=False, reachedProfit=False):
         self.type = type
@@ -40,13 +43,212 @@ class Trade:
         self.reachedProfit = reachedProfit
 
 
-class SuperScalper(BaseStrategy):
+# Most trade lines drawn for the visible range of the trade plot
+PLOT_MAX_SEGMENTS = 5_000
+
+# Days in the visible range of the trade plot up to which their profit is labelled
+PLOT_MAX_LABELS = 60
+
+# Columns of the trade journal
+TRADE_COLUMNS = dict(
+    type=np.int8,
+    entry=np.float64,
+    exit=np.float64,
+    entryIndex=np.int64,
+    exitIndex=np.int64,
+    dayClose=np.bool_,
+    reachedProfit=np.bool_
+)
+
+
+class MinuteOfDay(bt.Indicator):
+    """
+    The minute of the day of every bar in the timezone of the data.
+
+    In backtests all bars are converted at once, instead of converting each
+    bar's datetime number in next.
+    """
+    lines = ('minute',)
+
+    def next(self):
+        dt = self.data.num2date(self.data.datetime[0])
+        self.lines.minute[0] = dt.hour * 60 + dt.minute
+
+    def once(self, start, end):
+        nums = np.asarray(self.data.datetime.array[start:end])
+        index = pd.to_datetime(np.round((nums - EPOCH_NUM) * 86_400), unit='s', utc=True)
+        if getattr(self.data, '_tz', None) is not None:
+            index = index.tz_convert(self.data._tz)
+
+        minutes = index.hour * 60 + index.minute
+        self.lines.minute.array[start:end] = array('d', minutes.to_numpy(dtype=np.float64))
+
+
+class EntryBook:
+    """
+    The open entries of the SuperScalper, indexed by their tradeid.
+
+    Keeps the sum of type * entry and the net type of all entries, so the
+    profit of the book is computed in closed form, and one heap per side
+    ordered by entry price, so the best entry to exit is always on top of one
+    of them instead of being searched for on every bar.
+    """
+
+    def __init__(self):
+        self.entries: List[Entry] = []
+        self.entry_sum = 0.0
+        self.net = 0
+        self.longs: List[Tuple[float, int]] = []  # (entry, tradeid), lowest entry first
+        self.shorts: List[Tuple[float, int]] = []  # (-entry, tradeid), highest entry first
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[Entry]:
+        return iter(self.entries)
+
+    def profit(self, close: float) -> float:
+        """sum(entry.type * (entry.entry - close) for entry in entries)"""
+        return self.entry_sum - close * self.net
+
+    def put(self, tradeid: int, entry: Entry) -> None:
+        """Adds the entry as tradeid, which must be a new slot or one freed by pop_best."""
+        if tradeid == len(self.entries):
+            self.entries.append(entry)
+        else:
+            self.entries[tradeid] = entry
+
+        self.entry_sum += entry.type * entry.entry
+        self.net += entry.type
+        if entry.type == 1:
+            heapq.heappush(self.longs, (entry.entry, tradeid))
+        else:
+            heapq.heappush(self.shorts, (-entry.entry, tradeid))
+
+    def pop_best(self, close: float) -> int:
+        """
+        Removes the entry with the highest value -type * (entry - close) and
+        returns its tradeid, the lowest tradeid on ties.
+        """
+        long_value = -(self.longs[0][0] - close) if self.longs else -float('inf')
+        short_value = -self.shorts[0][0] - close if self.shorts else -float('inf')
+
+        if long_value > short_value or (long_value == short_value and self.longs[0][1] < self.shorts[0][1]):
+            _, tradeid = heapq.heappop(self.longs)
+        else:
+            _, tradeid = heapq.heappop(self.shorts)
+
+        entry = self.entries[tradeid]
+        self.entry_sum -= entry.type * entry.entry
+        self.net -= entry.type
+        return tradeid
+
+    def clear(self) -> None:
+        self.__init__()
+
+
+class ScalperLogic(ABC):
+    """
+    The decisions of the SuperScalper on the close of every 1 minute bar.
+
+    Keeps the open entries and decides which to open and close, the orders
+    are sent through enter and leave. The backtrader strategy implements
+    them with its broker and the replay of engine/replay.py with fills on
+    the ticks after the bar, so both run the same decisions. Subclasses
+    provide the SuperScalper params as `p`.
+    """
+
+    def reset_book(self) -> None:
+        self.entries = EntryBook()
+        self.bar_index = 0
+
+    @abstractmethod
+    def enter(self, tradeid: int, type: int) -> Any:
+        """Sends the order opening an entry of type, 1 long and -1 short, and returns it."""
+
+    @abstractmethod
+    def leave(self, tradeid: int, entry: Entry, dayClose: bool) -> None:
+        """Sends the order closing the entry, dayClose when all entries are closed at once."""
+
+    def record(self, trade: Trade) -> None:
+        pass
+
+    def decide(self, close: float, rising: bool, minute: float) -> None:
+        """Decides on the close of a bar, rising if the EMA did not fall, minute its minute of the day."""
+
+        self.bar_index += 1
+
+        # end of day -> Close all trades
+        if minute >= SESSION_CLOSE:
+            return self.exit(close)
+
+        total_profit = self.entries.profit(close)
+
+        # total Profit > goal -> Close all trades
+        if total_profit > self.p.profit_target:
+            print("Reached profit target, closing all trades")
+            return self.exit(close, True)
+
+        if len(self.entries) < self.p.amt_open_trades:
+            self.add_entry(len(self.entries), close, rising)
+        else:
+            best_idx = self.entries.pop_best(close)
+            best = self.entries.entries[best_idx]
+
+            self.leave(best_idx, best, False)
+            self.record(
+                Trade(
+                    type=best.type,
+                    entry=best.entry,
+                    exit=close,
+                    entryIndex=best.index,
+                    exitIndex=self.bar_index
+                )
+            )
+
+            self.add_entry(best_idx, close, rising)
+
+    def add_entry(self, tradeid: int, close: float, rising: bool) -> None:
+        type = 1 if rising else -1
+        order = self.enter(tradeid, type)
+        self.entries.put(tradeid, Entry(
+            type=type,
+            entry=close,
+            index=self.bar_index,
+            order=order
+        ))
+
+    def exit(self, close: float, reachedProfit=False):
+        for tradeid, entry in enumerate(self.entries):
+            self.leave(tradeid, entry, True)
+
+            self.record(
+                Trade(
+                    type=entry.type,
+                    entry=entry.entry,
+                    exit=close,
+                    entryIndex=entry.index,
+                    exitIndex=self.bar_index,
+                    dayClose=True,
+                    reachedProfit=reachedProfit
+                )
+            )
+
+        self.entries.clear()
+
+
+class ScalperStrategyMeta(type(BaseStrategy), ABCMeta):
+    """The metaclass of backtrader strategies combined with the ABCMeta of ScalperLogic."""
+
+
+class SuperScalper(BaseStrategy, ScalperLogic, metaclass=ScalperStrategyMeta):
     params = dict(
         amt_open_trades=100,
         ema_length=5,
         profit_target=1_000,
         size_security=1.3,
-        optimizing=False
+        optimizing=False,
+        journal=None  # directory of the trade journal, a new one per run when None
     )
 
     timeframes = {
@@ -61,15 +263,17 @@ class SuperScalper(BaseStrategy):
     @classmethod
     def addOptimizerToCerebro(cls, cerebro: bt.Cerebro):
         cerebro.sizers.clear()
-        # cerebro.optstrategy(
-        #     SuperScalper,
+        super().addOptimizerToCerebro(cerebro)
+
+    @classmethod
+    def parameterSpace(cls) -> ParameterSpace:
+        # return ParameterSpace(
         #     ema_length=[3, 4],
         #     amt_open_trades=[100, 120],
         #     profit_target=[10_000, 25_000]
         #     optimizing=[True]
         # )
-        cerebro.optstrategy(
-            SuperScalper,
+        return ParameterSpace(
             ema_length=range(2, 6, 2),
             amt_open_trades=range(50, 200, 30),
             profit_target=range(1_000, 20_000, 5_000),
@@ -77,196 +281,180 @@ class SuperScalper(BaseStrategy):
         )
 
     def __init__(self):
-        self.entries: List[Entry] = []
-        self.trades: List[Trade] = []
-
-        self.ema = bt.indicators.EMA(period=self.p.ema_length)
+        self.reset_book()
 
-    def next(self):
-        """This function is called by cerebro each time it has a new data."""
+        self.ema = self.sharedIndicator(bt.ind.EMA, self.data, period=self.p.ema_length)
+        self.minute = MinuteOfDay(self.data)
 
-        global ENTRY_INDEX
-        ENTRY_INDEX += 1
+    def warmedUp(self):
+        # The entries of the rejected warm-up orders never opened a position
+        self.reset_book()
 
-        # end of day -> Close all trades
-        if self.data.num2date(self.data.datetime[0]).time() >= time(15, 30, 0):
-            return self.exit()
+    def start(self):
+        # Trades are only journaled for single backtests, optimizations never look at them
+        self.journal = None
+        if not self.p.optimizing:
+            self.journal = Journal(self.p.journal or journal_path(self.data.p.dataname), TRADE_COLUMNS)
 
-        total_profit = sum(
-            entry.type * (entry.entry - self.data.close[0])
-            for entry in self.entries
-        )
+    def record(self, trade: Trade) -> None:
+        if self.journal is not None:
+            self.journal.append(trade)
 
-        # total Profit > goal -> Close all trades
-        if total_profit > self.p.profit_target:
-            print("Reached profit target, closing all trades")
-            return self.exit(True)
+    def next(self):
+        """This function is called by cerebro each time it has a new data."""
+        self.decide(self.data.close[0], self.ema[0] >= self.ema[-1], self.minute[0])
 
+    def enter(self, tradeid: int, type: int) -> bt.Order:
         if not hasattr(self, 'entry_size'):
             self.entry_size = self.broker.cash / self.data.close[0] / \
                 (self.p.amt_open_trades * self.p.size_security)
 
-        if len(self.entries) < self.p.amt_open_trades:
-            if self.ema[0] >= self.ema[-1]:
-                order = self.buy(
-                    tradeid=len(self.entries),
-                    size=self.entry_size,
-                    exectype=bt.Order.Market
-                )
-                self.entries.append(Entry(
-                    type=1,
-                    entry=self.data.close[0],
-                    index=ENTRY_INDEX,
-                    order=order
-                ))
-            else:
-                order = self.sell(
-                    tradeid=len(self.entries),
-                    size=self.entry_size,
-                    exectype=bt.Order.Market
-                )
-                self.entries.append(Entry(
-                    type=-1,
-                    entry=self.data.close[0],
-                    index=ENTRY_INDEX,
-                    order=order
-                ))
-        else:
-            best_idx = 0
-            best_value = -float('inf')
-
-            for i, entry in enumerate(self.entries):
-                position = -entry.type * (entry.entry - self.data.close[0])
-                if position > best_value:
-                    best_idx, best_value = i, position
-
-            self.close(tradeid=best_idx)
-            self.trades.append(
-                Trade(
-                    type=self.entries[best_idx].type,
-                    entry=self.entries[best_idx].entry,
-                    exit=self.data.close[0],
-                    entryIndex=self.entries[best_idx].index,
-                    exitIndex=ENTRY_INDEX
-                )
-            )
-
-            if self.ema[0] >= self.ema[-1]:
-                order = self.buy(
-                    tradeid=best_idx,
-                    size=self.entry_size,
-                    exectype=bt.Order.Market
-                )
-                self.entries[best_idx] = Entry(
-                    type=1,
-                    entry=self.data.close[0],
-                    index=ENTRY_INDEX,
-                    order=order
-                )
-            else:
-                order = self.sell(
-                    tradeid=best_idx,
-                    size=self.entry_size,
-                    exectype=bt.Order.Market
-                )
-                self.entries[best_idx] = Entry(
-                    type=-1,
-                    entry=self.data.close[0],
-                    index=ENTRY_INDEX,
-                    order=order
-                )
-
-    def exit(self, reachedProfit=False):
-        for entry in self.entries:
-            if entry.type == 1:
-                self.sell(
-                    tradeid=entry.order.tradeid,
-                    size=self.entry_size,
-                    exectype=bt.Order.Market
-                )
-            else:
-                self.buy(
-                    tradeid=entry.order.tradeid,
-                    size=self.entry_size,
-                    exectype=bt.Order.Market
-                )
+        order = self.buy if type == 1 else self.sell
+        return order(
+            tradeid=tradeid,
+            size=self.entry_size,
+            exectype=bt.Order.Market
+        )
 
-            self.trades.append(
-                Trade(
-                    type=entry.type,
-                    entry=entry.entry,
-                    exit=self.data.close[0],
-                    entryIndex=entry.index,
-                    exitIndex=ENTRY_INDEX,
-                    dayClose=True,
-                    reachedProfit=reachedProfit
-                )
-            )
+    def leave(self, tradeid: int, entry: Entry, dayClose: bool) -> None:
+        if not dayClose:
+            self.close(tradeid=tradeid)
+            return
 
-        self.entries = []
+        order = self.sell if entry.type == 1 else self.buy
+        order(
+            tradeid=tradeid,
+            size=self.entry_size,
+            exectype=bt.Order.Market
+        )
 
     def stop(self):
         """This function is called when the strategy is finished with all the data."""
         if not self.p.optimizing:
-            df = pd.DataFrame(self.trades)
-            df.to_csv(
-                f'SuperScalper-Trades-{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.csv'
-            )
-            plotTrades(self.trades)
+            self.journal.close()
+            print(f'Trades saved to {self.journal.path}')
+            # Rendered to a file, the backtest never waits for a window
+            path = os.path.join(self.journal.path, 'trades.png')
+            plotTrades(Journal.read(self.journal.path), path)
+            print(f'Trade plot saved to {path}')
 
     def notify_trade(self, trade):
         if not trade.size:
             print(f'Trade PNL: ${trade.pnlcomm:.2f}')
 
 
+def trade_segments(trades: Dict[str, np.ndarray], lo: int, hi: int, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The lines from entry to exit of the trades overlapping the bars lo to hi
+    as (n, 2, 2) segments and whether each trade is long, at most limit of
+    them. More trades are downsampled to the one with the largest move in
+    each of limit slices of the range.
+    """
+    entries, exits = trades['entryIndex'], trades['exitIndex']
+    visible = np.flatnonzero((exits >= lo) & (entries <= hi))
+
+    if len(visible) > limit:
+        moves = np.abs(trades['exit'][visible] - trades['entry'][visible])
+        slices = (np.clip(entries[visible], lo, hi) - lo) * limit // (hi - lo + 1)
+        # Sorted by slice and largest move first, the first trade of every slice is kept
+        order = np.lexsort((-moves, slices))
+        first = np.r_[True, slices[order][1:] != slices[order][:-1]]
+        visible = np.sort(visible[order[first]])
+
+    segments = np.empty((len(visible), 2, 2))
+    segments[:, 0, 0] = entries[visible]
+    segments[:, 0, 1] = trades['entry'][visible]
+    segments[:, 1, 0] = exits[visible]
+    segments[:, 1, 1] = trades['exit'][visible]
+    return segments, trades['type'][visible] == 1
+
+
+def day_closes(trades: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """The index of the last trade of every day and the profit of the day."""
+    # Figure out all the last trades of a day
+    day_close = np.asarray(trades['dayClose'], dtype=bool)
+    last_of_day = day_close & ~np.r_[day_close[1:], False]
+    ends = np.flatnonzero(last_of_day)
+
+    # The profit of a day is the sum over its trades, from the end of the previous day
+    profit = np.cumsum(trades['type'] * (trades['entry'] - trades['exit']))
+    return ends, np.diff(np.r_[0.0, profit[ends]])
+
+
+def journal_path(ticker: str) -> str:
+    """
+    Creates a new trade journal directory for ticker in the working
+    directory. The suffix keeps it unique among runs started in the same
+    second, like the workers of --portfolio.
+    """
+    stamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    return os.path.relpath(tempfile.mkdtemp(prefix=f'SuperScalper-Trades-{ticker}-{stamp}-', dir='.'))
+
+
 # TODO for Future: Add this plotting to the main Cerebro Plotting
-def plotTrades(trades: List[Trade]) -> None:
-    """Plots the trades of a strategy"""
 
-    fig, ax = plt.subplots(figsize=(10, 5))
+def plotTrades(
+    trades: Dict[str, np.ndarray],
+    path: Optional[str] = None,
+    max_segments: int = PLOT_MAX_SEGMENTS,
+    max_labels: int = PLOT_MAX_LABELS
+) -> None:
+    """
+    Plots the trades of a strategy from the columns of its trade journal.
+
+    All trades are one LineCollection, downsampled to max_segments for the
+    visible range and drawn in more detail when zooming in. The close of
+    every day is marked and its profit labelled once at most max_labels
+    days are visible. With a path the figure is saved there instead of shown.
+    """
+    # Imported here, headless backtests and optimizations never plot
+    from matplotlib import pyplot as plt
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import to_rgba
 
-    # Connect each trades starting point to it's ending point
-    for i, trade in enumerate(trades[::5]):
-        ax.plot(
-            [trade.entryIndex, trade.exitIndex],
-            [trade.entry, trade.exit],
-            label=str(i),
-            color='green' if trade.type == 1 else 'red',
-            linewidth=1
-        )
+    fig, ax = plt.subplots(figsize=(10, 5))
 
-    # Figure out all the last trades of a day
-    days: List[List[Trade]] = []
-    current_day: List[Trade] = []
-
-    for i, trade in enumerate(trades):
-        current_day.append(trade)
-        if trade.dayClose and (i == len(trades) - 1 or not trades[i + 1].dayClose):
-            days.append(current_day)
-            current_day = []
-
-    # add a marker at the close of the day with the profit as a label
-    for day in days:
-        day_profit = sum(
-            trade.type * (trade.entry - trade.exit)
-            for trade in day
-        )
-        ax.plot(
-            day[-1].exitIndex,
-            day[-1].exit,
-            'o',
-            color='orange' if day[-1].reachedProfit else 'black',
-            markersize=5
-        )
-        ax.text(
-            day[-1].exitIndex,
-            day[-1].exit,
-            f'${day_profit:.2f}',
-            color='black'
-        )
+    lines = LineCollection([], linewidths=1)
+    ax.add_collection(lines)
+
+    # add a marker at the close of the day, orange if it reached the profit target
+    ends, day_profits = day_closes(trades)
+    day_x, day_y = trades['exitIndex'][ends], trades['exit'][ends]
+    ax.scatter(day_x, day_y, s=25, c=np.where(trades['reachedProfit'][ends], 'orange', 'black'), zorder=3)
+    labels = []
+
+    def draw(ax):
+        lo, hi = ax.get_xlim()
+        lo, hi = int(np.floor(lo)), int(np.ceil(hi))
+
+        segments, longs = trade_segments(trades, lo, hi, max_segments)
+        lines.set_segments(segments)
+        lines.set_color(np.where(longs[:, None], to_rgba('green'), to_rgba('red')))
+
+        # Label the profit of the days in view, too many labels would overlap anyway
+        for label in labels:
+            label.remove()
+        labels.clear()
+        days = np.flatnonzero((day_x >= lo) & (day_x <= hi))
+        if len(days) <= max_labels:
+            labels.extend(ax.text(day_x[d], day_y[d], f'${day_profits[d]:.2f}', color='black') for d in days)
+
+    if len(trades['type']):
+        low = min(trades['entry'].min(), trades['exit'].min())
+        high = max(trades['entry'].max(), trades['exit'].max())
+        margin = (high - low) * 0.05 or 1
+        ax.set_xlim(trades['entryIndex'].min(), max(trades['exitIndex'].max(), trades['entryIndex'].min() + 1))
+        ax.set_ylim(low - margin, high + margin)
+    draw(ax)
+    ax.callbacks.connect('xlim_changed', draw)
 
     ax.set_title('Trades')
     ax.set_xlabel('Date')
     ax.set_ylabel('Price')
     ax.grid(True)
-    plt.show()
+
+    if path:
+        fig.savefig(path)
+        plt.close(fig)
+    else:
+        plt.show()
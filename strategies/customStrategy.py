@@ -1,6 +1,12 @@
 
+from typing import List, Optional
+
 import backtrader as bt
 
+from engine.indicatorcache import shared_indicator
+from engine.profiler import Profile, Profiler
+from optimization.space import ParameterSpace
+
 
 class BaseStrategy(bt.Strategy):
     timeframes = {}  # Dictionary of timeframes to be used in the strategy i.e. {'15Min': 15, '30Min': 30, '1H': 60}
@@ -12,5 +18,32 @@ class BaseStrategy(bt.Strategy):
 
     @classmethod
     def addOptimizerToCerebro(cls, cerebro: bt.Cerebro):
-        """ Add the strategy to the Cerebro instance to optimize. Override this method in your strategy class if you want to add additional parameters to the strategy. """
+        """ Add the strategy to the Cerebro instance to optimize. Every valid combination of the parameterSpace is run. Override this method in your strategy class if you want to configure the Cerebro for the optimization. """
         cerebro.optstrategy(cls)
+        # optstrategy can only run the full product of the values, replace it with the constrained grid
+        cerebro.strats[-1] = [(cls, (), params) for params in cls.parameterSpace().grid()]
+
+    @classmethod
+    def addProfilerToCerebro(cls, cerebro: bt.Cerebro, profiler: Profiler):
+        """ Profile the strategy with --profile. Every run of the Cerebro adds the time spent in its feeds, broker, indicators, next, analyzers and observers to the profiler. """
+        cerebro.addanalyzer(Profile, _name='profile', profiler=profiler)
+
+    @classmethod
+    def parameterSpace(cls) -> ParameterSpace:
+        """ The parameters to optimize and the values they can take. Override this method in your strategy class to optimize its parameters. """
+        return ParameterSpace()
+
+    @classmethod
+    def warmupBars(cls, specs: List[dict]) -> List[int]:
+        """ The bars every feed of specs needs before trading live, a multiple of the minimum period of the indicators on it. Override this method in your strategy class if it needs more history, e.g. for its own state. """
+        # Imported here, live.warmup builds the strategy to measure its indicators
+        from live.warmup import WARMUP_FACTOR, minimum_periods
+
+        return [WARMUP_FACTOR * period for period in minimum_periods(cls, specs)]
+
+    def sharedIndicator(self, indicator: type, data: bt.feed.DataBase, line: str = 'close', period: Optional[int] = None) -> bt.Indicator:
+        """ Use instead of indicator(getattr(data, line), period=period). With preloaded data every indicator is computed only once per feed, line and period in a process and shared by all optimization runs. """
+        return shared_indicator(self, indicator, data, line, period)
+
+    def warmedUp(self) -> None:
+        """ Called on the first bar a walk-forward test trades, after its orders on the warm-up bars were rejected. Forget any state those orders left. """
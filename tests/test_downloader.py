@@ -0,0 +1,166 @@
+"""
+The BulkDownloader against a local stub of the Alpaca market data API.
+
+Run with python -m unittest discover tests from the repository root.
+"""
+import asyncio
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+import backtrader as bt
+import pandas as pd
+from aiohttp import web
+
+from data.barcache import BarCache
+from data.downloader import BulkDownloader, Job, TokenBucket
+
+# Bars per page of the stub, far below the limit the downloader asks for
+PAGE_SIZE = 100
+
+
+def minute_bars(start: pd.Timestamp, end: pd.Timestamp) -> list:
+    """1 minute bars from 09:00 to 16:30 of every business day, with closes numbered through the day."""
+    bars = []
+    for day in pd.bdate_range(start.tz_convert('US/Eastern').normalize(), end.tz_convert('US/Eastern')):
+        minutes = pd.date_range(day + pd.Timedelta('9h'), day + pd.Timedelta('16h30min'), freq='1min')
+        for i, minute in enumerate(minutes.tz_convert('UTC')):
+            if start <= minute < end:
+                bars.append({'t': minute.strftime('%Y-%m-%dT%H:%M:%SZ'), 'o': i, 'h': i + 0.5, 'l': i - 0.5, 'c': i, 'v': 1})
+    return bars
+
+
+class StubServer:
+    """GET /v2/stocks/{symbol}/bars, failing the first failures requests with the given statuses."""
+
+    def __init__(self, failures: tuple = ()):
+        self.failures = list(failures)
+        self.requests = []
+
+    async def bars(self, request: web.Request) -> web.Response:
+        self.requests.append(dict(request.query))
+        if self.failures:
+            return web.Response(status=self.failures.pop(0), headers={'Retry-After': '0'})
+
+        bars = minute_bars(pd.Timestamp(request.query['start']), pd.Timestamp(request.query['end']))
+        offset = int(request.query.get('page_token', 0))
+        page = bars[offset:offset + PAGE_SIZE]
+        token = str(offset + PAGE_SIZE) if offset + PAGE_SIZE < len(bars) else None
+        return web.json_response({'bars': page, 'next_page_token': token})
+
+    async def __aenter__(self) -> str:
+        app = web.Application()
+        app.router.add_get('/v2/stocks/{symbol}/bars', self.bars)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        return f'http://{host}:{port}'
+
+    async def __aexit__(self, *exc) -> None:
+        await self.runner.cleanup()
+
+
+class BulkDownloaderTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = BarCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def download(self, server: StubServer, jobs: list, **kwargs) -> dict:
+        kwargs.setdefault('rate_limit', 60_000)
+        async with server as url:
+            downloader = BulkDownloader(self.cache, 'key', 'secret', base_url=url, backoff=0.01, **kwargs)
+            return await downloader.download_async(jobs)
+
+    def load(self, job: Job) -> pd.DataFrame:
+        bars = self.cache.load(job.ticker, job.timeframe, job.compression, job.fromdate, job.todate, job.sessionfilter)
+        index = pd.DatetimeIndex(bars.pop('datetime'), tz='UTC').tz_convert('US/Eastern')
+        return pd.DataFrame(bars, index=index)
+
+    async def test_pages(self):
+        server = StubServer()
+        job = Job('AAPL', bt.TimeFrame.Minutes, 1, True, datetime(2021, 1, 4), datetime(2021, 1, 6))
+        counts = await self.download(server, [job])
+
+        # Two days of 451 minutes in pages of 100, the session keeps 391 of them per day
+        self.assertEqual(len(server.requests), 10)
+        self.assertEqual(counts[job], 2 * 391)
+        self.assertTrue(all(request['timeframe'] == '1Min' for request in server.requests))
+        bars = self.load(job)
+        self.assertEqual(str(bars.index[0]), '2021-01-04 09:30:00-05:00')
+        self.assertEqual(str(bars.index[-1]), '2021-01-05 16:00:00-05:00')
+        self.assertEqual(self.cache.missing(job.ticker, job.timeframe, job.compression, job.fromdate, job.todate, True), [])
+
+    async def test_resampled_in_session(self):
+        # The bars after 16:00 are neither in the last 15 minute bar nor in the day
+        server = StubServer()
+        intraday = Job('AAPL', bt.TimeFrame.Minutes, 15, True, datetime(2021, 1, 4), datetime(2021, 1, 5))
+        daily = Job('AAPL', bt.TimeFrame.Days, 1, False, datetime(2021, 1, 4), datetime(2021, 1, 5))
+        await self.download(server, [intraday, daily])
+
+        bars = self.load(intraday)
+        self.assertEqual(len(bars), 27)
+        self.assertEqual(str(bars.index[-1]), '2021-01-04 16:00:00-05:00')
+        self.assertEqual(bars['close'].iloc[-1], 420)  # the close of 16:00 is the 421st minute from 09:00
+
+        day = self.load(daily)
+        self.assertEqual(list(day['open']), [30])
+        self.assertEqual(list(day['close']), [420])
+        self.assertEqual(list(day['volume']), [391])
+
+    async def test_retries(self):
+        server = StubServer(failures=(429, 503))
+        job = Job('AAPL', bt.TimeFrame.Minutes, 1, True, datetime(2021, 1, 4), datetime(2021, 1, 5))
+        counts = await self.download(server, [job], retries=2)
+
+        self.assertEqual(counts[job], 391)
+        self.assertEqual(len(server.requests), 2 + 5)
+
+    async def test_gives_up(self):
+        server = StubServer(failures=(500,) * 3)
+        job = Job('AAPL', bt.TimeFrame.Minutes, 1, True, datetime(2021, 1, 4), datetime(2021, 1, 5))
+        counts = await self.download(server, [job], retries=2)
+
+        # The range stays missing and is requested again by the next run
+        self.assertEqual(counts[job], 0)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(len(self.cache.missing(job.ticker, job.timeframe, job.compression, job.fromdate, job.todate, True)), 1)
+
+    async def test_rate_limit(self):
+        server = StubServer()
+        jobs = [Job(ticker, bt.TimeFrame.Minutes, 1, True, datetime(2021, 1, 4), datetime(2021, 1, 5)) for ticker in 'ABCD']
+        started = time.monotonic()
+        await self.download(server, jobs, rate_limit=600)
+
+        # 20 requests at 10 per second with a burst of 10
+        self.assertEqual(len(server.requests), 20)
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_rate(self):
+        bucket = TokenBucket(rate=50, capacity=5)
+        started = time.monotonic()
+        for _ in range(15):
+            await bucket.acquire()
+
+        # The burst of 5 is free, the other 10 wait for 1/50 s each
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    async def test_burst(self):
+        bucket = TokenBucket(rate=1, capacity=5)
+        started = time.monotonic()
+        await asyncio.gather(*[bucket.acquire() for _ in range(5)])
+        self.assertLess(time.monotonic() - started, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()